@@ -0,0 +1,855 @@
+import argparse
+import contextlib
+import gzip
+import json
+import hashlib
+import itertools
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from transform import (normalize_trading_symbol, normalize_trading_symbols, upstox_equity_mask,
+                       transform_upstox_data, transform_dhan_data)
+from compare import reconcile, name_match_candidates, compare_and_output, reconcile_sources
+from schemas import UPSTOX_SCHEMA, read_csv_kwargs
+from extract import read_csv_filtered, extract_upstox_data, extract_dhan_data
+from load import load_to_mongodb, load_to_sql, connect_sqlite, upsert_reconciled
+from sinks import apply_output_schema
+from engines import get_engine, HAS_POLARS
+from download import download, IntegrityError
+from history import record_history, resolve_as_of, resolve_as_of_many, history_snapshot, to_timestamp
+from validate import validate_frame, validate_frames, isin_check_digits
+from query import ReadPool
+from sources import SOURCES, extract_source, transform_source
+
+FIXTURE_PATH = os.path.join('data', 'NSE.csv.gz')
+# Approximate NSE Equity instrument count per source today
+BASE_ROWS = 8000
+# Generated synthetic masters are kept here and reused between runs
+BENCH_DATA_DIR = os.path.join('cache', 'bench')
+RESULTS_DIR = 'benchmarks'
+
+# Upstox exchange -> Dhan (SEM_EXM_EXCH_ID, SEM_SEGMENT)
+DHAN_SEGMENTS = {
+    'NSE_EQ': ('NSE', 'E'),
+    'NSE_FO': ('NSE', 'D'),
+    'NCD_FO': ('NSE', 'C'),
+    'NSE_COM': ('NSE', 'M'),
+    'NSE_INDEX': ('NSE', 'I'),
+}
+
+def timed(func, *args, repeat=3, **kwargs):
+    """Return the best wall time of `repeat` calls and the last result."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def bench_normalization(path=FIXTURE_PATH):
+    """Check normalize_trading_symbols against normalize_trading_symbol and time both."""
+    symbols = pd.read_csv(path, usecols=['tradingsymbol'])['tradingsymbol']
+    # Diagnostics go to /dev/null so the timings measure the work, not the terminal
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        per_row, expected = timed(symbols.apply, normalize_trading_symbol)
+        vectorized, actual = timed(normalize_trading_symbols, symbols)
+        memo = {}
+        normalize_trading_symbols(symbols, memo)
+        memoized, memo_actual = timed(normalize_trading_symbols, symbols, memo)
+
+    if not actual.equals(expected) or not memo_actual.equals(expected):
+        raise AssertionError("normalize_trading_symbols does not match normalize_trading_symbol")
+    print(f"Trading symbol normalization over {len(symbols)} symbols (outputs identical):")
+    print(f"  per-row apply:     {per_row * 1000:8.1f} ms")
+    print(f"  vectorized:        {vectorized * 1000:8.1f} ms ({per_row / vectorized:.1f}x)")
+    print(f"  vectorized + memo: {memoized * 1000:8.1f} ms ({per_row / memoized:.1f}x)")
+    return {'rows': len(symbols), 'per_row': per_row, 'vectorized': vectorized, 'memoized': memoized}
+
+def synthetic_transformed(scale=1, overlap=0.9, seed=0):
+    """Build transformed-shape Upstox and Dhan frames with BASE_ROWS * scale rows each.
+
+    A fraction `overlap` of the symbols is shared; rows are shuffled so the
+    two sources list them in different orders.
+    """
+    rng = np.random.default_rng(seed)
+    n = BASE_ROWS * scale
+    shared = int(n * overlap)
+    ids = pd.Series(np.arange(2 * n - shared)).astype(str)
+    upstox_symbols = 'SYM' + ids[:n]
+    dhan_symbols = 'SYM' + ids[n - shared:]
+    upstox_df = pd.DataFrame({
+        'exchange': 'NSE_EQ',
+        'instrument_key': 'NSE_EQ|INE' + ids[:n].str.zfill(9),
+        'symbol_name': upstox_symbols,
+        'security_id': None,
+        'short_name': None,
+        'name': upstox_symbols + ' LIMITED',
+        'isin': None,
+        'trading_symbol': upstox_symbols,
+    }).iloc[rng.permutation(n)].reset_index(drop=True)
+    dhan_df = pd.DataFrame({
+        'exchange': 'NSE',
+        'instrument_key': None,
+        'symbol_name': dhan_symbols.values + ' LTD',
+        'security_id': np.arange(len(dhan_symbols)) + 1000,
+        'short_name': None,
+        'name': None,
+        'isin': None,
+        'trading_symbol': dhan_symbols.values,
+    }).iloc[rng.permutation(n)].reset_index(drop=True)
+    return upstox_df, dhan_df
+
+def bench_reconcile(scales=(1, 10, 100)):
+    """Time compare.reconcile on synthetic masters at each scale."""
+    results = []
+    for scale in scales:
+        upstox_df, dhan_df = synthetic_transformed(scale)
+        elapsed, (common, only_upstox, only_dhan) = timed(reconcile, upstox_df, dhan_df, repeat=1 if scale >= 100 else 3)
+
+        # Cross-check against plain set arithmetic and the Dhan-side provenance
+        upstox_symbols, dhan_symbols = set(upstox_df['trading_symbol']), set(dhan_df['trading_symbol'])
+        if (set(common['trading_symbol']) != upstox_symbols & dhan_symbols
+                or set(only_upstox['trading_symbol']) != upstox_symbols - dhan_symbols
+                or set(only_dhan['trading_symbol']) != dhan_symbols - upstox_symbols
+                or not (common['symbol_name'] == common['trading_symbol'] + ' LTD').all()):
+            raise AssertionError(f"reconcile produced wrong results at {scale}x")
+
+        rows = len(upstox_df) + len(dhan_df)
+        print(f"reconcile {scale:>4}x: {rows:>9} rows in {elapsed * 1000:8.1f} ms "
+              f"({rows / elapsed:,.0f} rows/s; {len(common)} common)")
+        results.append({'scale': scale, 'rows': rows, 'seconds': elapsed})
+    return results
+
+def bench_matching(scales=(1, 10, 100), renamed_every=33):
+    """Time the name match candidates against the exact tiers on synthetic masters.
+
+    Every `renamed_every`-th Dhan symbol is renamed, so only its name can
+    pair it; every candidate pair must be the original one.
+    """
+    results = []
+    for scale in scales:
+        upstox_df, dhan_df = synthetic_transformed(scale)
+        renamed = np.arange(len(dhan_df)) % renamed_every == 0
+        original = dhan_df['trading_symbol'].copy()
+        dhan_df['trading_symbol'] = original.where(~renamed, 'DH' + original)
+        repeat = 1 if scale >= 100 else 3
+        exact, (_, only_upstox, only_dhan) = timed(reconcile, upstox_df, dhan_df, repeat=repeat)
+        by_name, candidates = timed(name_match_candidates, only_upstox, only_dhan, repeat=repeat)
+
+        if not (candidates['symbol_name'] == candidates['trading_symbol'] + ' LTD').all():
+            raise AssertionError(f"name matching paired the wrong rows at {scale}x")
+        print(f"matching  {scale:>4}x: exact tiers {exact * 1000:8.1f} ms, name candidates "
+              f"{by_name * 1000:8.1f} ms ({len(candidates)} of {renamed.sum()} renamed rows paired on name)")
+        results.append({'scale': scale, 'exact': exact, 'name_candidates': by_name,
+                        'name_matches': len(candidates)})
+    return results
+
+def bench_engines(scales=(1, 10), data_dir=BENCH_DATA_DIR):
+    """Check the Polars engine against pandas on the synthetic masters and time both.
+
+    Polars is timed on the extracted frames, like pandas, and scanning the
+    CSV files itself, which fuses the read into its query plan. Outputs are
+    compared as written CSV after the output schema is applied.
+    """
+    if not HAS_POLARS:
+        print("polars is not installed; skipping the engine benchmark.")
+        return []
+    canonical = lambda df: apply_output_schema(df).to_csv(index=False)
+    pandas_engine, polars_engine = get_engine('pandas'), get_engine('polars')
+    results = []
+    for scale in scales:
+        upstox_path, dhan_path = synthetic_master_files(scale, data_dir)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            upstox_raw, dhan_raw = extract_upstox_data(path=upstox_path), extract_dhan_data(path=dhan_path)
+            timings = {}
+
+            def transform_both(engine, upstox_source, dhan_source):
+                return engine.transform_upstox(upstox_source), engine.transform_dhan(dhan_source)
+
+            timings['pandas_transform'], expected = timed(transform_both, pandas_engine, upstox_raw, dhan_raw)
+            timings['polars_transform'], actual = timed(transform_both, polars_engine, upstox_raw, dhan_raw)
+            timings['pandas_read_transform'], _ = timed(
+                lambda: transform_both(pandas_engine, extract_upstox_data(path=upstox_path),
+                                       extract_dhan_data(path=dhan_path)))
+            timings['polars_scan_transform'], scanned = timed(transform_both, polars_engine, upstox_path, dhan_path)
+            timings['pandas_reconcile'], expected_frames = timed(pandas_engine.reconcile, *expected)
+            timings['polars_reconcile'], actual_frames = timed(polars_engine.reconcile, *expected)
+            expected_frames += (pandas_engine.name_candidates(*expected_frames[1:]),)
+            actual_frames += (polars_engine.name_candidates(*actual_frames[1:]),)
+
+        for name, left, right in [('transform', expected, actual), ('scanned transform', expected, scanned),
+                                  ('reconcile', expected_frames, actual_frames)]:
+            if any(canonical(a) != canonical(b) for a, b in zip(left, right)):
+                raise AssertionError(f"polars {name} output differs from pandas at {scale}x")
+        print(f"engines   {scale:>4}x (outputs identical): "
+              + ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in timings.items()))
+        results.append({'scale': scale, **timings})
+    return results
+
+def bench_history(scale=10, runs=30, churn=0.01, lookups=10000, seed=0):
+    """Record `runs` daily snapshots with churn in a history table and time as-of lookups.
+
+    Each run reassigns the security_id of a `churn` fraction of the common
+    rows and leaves out a random `churn` fraction of the Upstox-only rows,
+    which come back the next run. Single and bulk lookups of random
+    (symbol, time) pairs, some of them unknown, are checked against a replay
+    of the runs.
+    """
+    rng = np.random.default_rng(seed)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        common, only_upstox, only_dhan = reconcile(*synthetic_transformed(scale))
+    common = common.copy()
+    start = datetime(2026, 1, 1, 9)
+    replay, record_times = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = connect_sqlite(os.path.join(tmp, 'history.db'))
+        for run in range(runs):
+            if run:
+                rows = common.index[rng.choice(len(common), int(len(common) * churn), replace=False)]
+                common.loc[rows, 'security_id'] = common.loc[rows, 'security_id'].astype(int) + 1_000_000 * run
+            frames = {'common_stocks': common, 'only_in_dhan': only_dhan,
+                      'only_in_upstox': only_upstox[rng.random(len(only_upstox)) >= churn]}
+            elapsed, _ = timed(record_history, conn, frames, start + timedelta(days=run), repeat=1)
+            record_times.append(elapsed)
+            snapshot = history_snapshot(frames)
+            replay.append((to_timestamp(start + timedelta(days=run)),
+                           dict(zip(snapshot['trading_symbol'], snapshot['security_id']))))
+        versions = conn.execute("SELECT COUNT(*) FROM instrument_history").fetchone()[0]
+
+        symbols = list(replay[0][1]) + [f"UNKNOWN{i}" for i in range(100)]
+        queries = [symbols[i] for i in rng.integers(0, len(symbols), lookups)]
+        times = [start + timedelta(seconds=int(s)) - timedelta(days=1)
+                 for s in rng.integers(0, 86400 * (runs + 1), lookups)]
+        single_time, single = timed(lambda: [resolve_as_of(conn, q, t) for q, t in zip(queries, times)], repeat=1)
+        bulk_time, bulk = timed(resolve_as_of_many, conn, queries, times, repeat=1)
+        conn.close()
+
+    def expected(symbol, when):
+        mapping = None
+        for recorded_at, run_mapping in replay:
+            if recorded_at <= to_timestamp(when):
+                mapping = run_mapping
+        value = mapping.get(symbol) if mapping else None
+        return None if value is None or pd.isna(value) else int(value)
+
+    wanted = [expected(q, t) for q, t in zip(queries, times)]
+    if ([None if v is None else v.security_id for v in single] != wanted
+            or [None if pd.isna(v) else int(v) for v in bulk['security_id']] != wanted):
+        raise AssertionError(f"as-of lookups disagree with the replayed runs at {scale}x")
+    print(f"history   {scale:>4}x ({runs} runs, {versions} versions): record {np.median(record_times) * 1000:.1f} ms/run, "
+          f"{lookups} lookups {single_time / lookups * 1e6:.1f} us each or {bulk_time * 1000:.1f} ms in bulk")
+    return {'scale': scale, 'versions': versions, 'record': float(np.median(record_times)),
+            'single_lookup': single_time / lookups, 'bulk_lookups': bulk_time}
+
+def bench_query(scale=10, lookups=10000, csv_lookups=20, seed=0):
+    """Time symbol lookups through query.ReadPool against scanning the output CSVs.
+
+    The reconciled sets are loaded into a temporary database; lookups of
+    random symbols, some of them unknown, are checked against the frames.
+    """
+    rng = np.random.default_rng(seed)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        upstox_df, dhan_df = synthetic_transformed(scale)
+        frames = dict(zip(['common_stocks', 'only_in_upstox', 'only_in_dhan'], reconcile(upstox_df, dhan_df)))
+    symbols = pd.concat([df['trading_symbol'] for df in frames.values()]).tolist()
+    queries = [symbols[i] for i in rng.integers(0, len(symbols), lookups)] + [f"UNKNOWN{i}" for i in range(100)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'query.db')
+        conn = connect_sqlite(db_path)
+        load_time, _ = timed(upsert_reconciled, conn, frames, repeat=1)
+        conn.close()
+        for name, df in frames.items():
+            df.to_csv(os.path.join(tmp, f"{name}.csv"), index=False)
+
+        pool = ReadPool(db_path)
+        single_time, single = timed(lambda: [pool.lookup(q) for q in queries], repeat=1)
+        batch_time, batch = timed(pool.lookup_many, queries, repeat=1)
+        pool.close()
+
+        def scan_csvs(symbol):
+            tables = [pd.read_csv(os.path.join(tmp, f"{name}.csv")) for name in frames]
+            return [df[df['trading_symbol'] == symbol] for df in tables]
+        csv_time, _ = timed(lambda: [scan_csvs(q) for q in queries[:csv_lookups]], repeat=1)
+
+    sources = {symbol: source for source, df in zip(['both', 'upstox', 'dhan'], frames.values())
+               for symbol in df['trading_symbol']}
+    if ([[row.source for row in rows] for rows in single] != [[sources[q]] if q in sources else [] for q in queries]
+            or [rows for rows in batch.values()] != [single[queries.index(q)] for q in batch]):
+        raise AssertionError(f"query lookups disagree with the reconciled frames at {scale}x")
+    print(f"query     {scale:>4}x: load {load_time * 1000:.1f} ms, {len(queries)} lookups "
+          f"{single_time / len(queries) * 1e6:.1f} us each or {batch_time * 1000:.1f} ms batched; "
+          f"CSV scan {csv_time / csv_lookups * 1000:.1f} ms each")
+    return {'scale': scale, 'load': load_time, 'single_lookup': single_time / len(queries),
+            'batch_lookups': batch_time, 'csv_lookup': csv_time / csv_lookups}
+
+def _isin_is_valid(isin):
+    """Scalar reference for the ISIN check digit: Luhn over the letter-expanded digits."""
+    digits = ''.join(str(int(char, 36)) for char in isin[:11])
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        value = int(digit) * (2 if position % 2 == 0 else 1)
+        total += value - 9 if value > 9 else value
+    return (10 - total % 10) % 10 == int(isin[11])
+
+def bench_validation(scales=(1, 10, 100), sample=20000):
+    """Time validate.validate_frame on synthetic transformed frames at each scale.
+
+    The Upstox frame gets ISINs taken from its instrument keys, about 90% of
+    which have a wrong check digit; the vectorized check is cross-checked
+    against the scalar reference on a sample of them.
+    """
+    results = []
+    for scale in scales:
+        upstox_df, dhan_df = synthetic_transformed(scale)
+        upstox_df['isin'] = upstox_df['instrument_key'].str.slice(7)
+        repeat = 1 if scale >= 100 else 3
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            upstox_time, upstox_report = timed(validate_frame, upstox_df, 'upstox', max_failure_rate=1, repeat=repeat)
+            dhan_time, dhan_report = timed(validate_frame, dhan_df, 'dhan', repeat=repeat)
+
+        isins = upstox_df['isin'].head(sample)
+        _, valid = isin_check_digits(isins.to_numpy(dtype=object))
+        failed = {result['rule']: result['failed'] for result in upstox_report['rules']}
+        if (valid.tolist() != [_isin_is_valid(isin) for isin in isins]
+                or failed['isin_check_digit'] != len(upstox_df) - int(isin_check_digits(
+                    upstox_df['isin'].to_numpy(dtype=object))[1].sum())
+                or not dhan_report['passed'] or failed['instrument_key_exchange_prefix']):
+            raise AssertionError(f"validation produced wrong results at {scale}x")
+
+        rows = len(upstox_df) + len(dhan_df)
+        elapsed = upstox_time + dhan_time
+        print(f"validate  {scale:>4}x: {rows:>9} rows in {elapsed * 1000:8.1f} ms "
+              f"({elapsed / rows * 1e9:.0f} ns/row; {failed['isin_check_digit']} bad ISIN check digits)")
+        results.append({'scale': scale, 'rows': rows, 'seconds': elapsed})
+    return results
+
+def _read_fixture(mode, path=FIXTURE_PATH):
+    """Parse path in `mode`; return (seconds, peak RSS growth in MB, frame size in MB)."""
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == 'plain':
+        df = pd.read_csv(path)
+    elif mode == 'registry':
+        df = pd.read_csv(path, **read_csv_kwargs(UPSTOX_SCHEMA))
+    else:
+        with gzip.open(path) as f:
+            df, _ = read_csv_filtered(f, UPSTOX_SCHEMA, upstox_equity_mask)
+    elapsed = time.perf_counter() - start
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024
+    return elapsed, peak, df.memory_usage(deep=True).sum() / 1e6
+
+def bench_schema_registry(path=FIXTURE_PATH):
+    """Compare parse time and peak RSS of plain read_csv against the schema registry.
+
+    Each read runs in a fresh process so peak RSS is not shared between them.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for mode, label in (('plain', 'plain read_csv'), ('registry', 'schema registry'),
+                        ('streaming', 'registry + stream')):
+        with context.Pool(1) as pool:
+            elapsed, peak, frame = pool.apply(_read_fixture, (mode, path))
+        print(f"{label:>17}: {elapsed * 1000:7.1f} ms, peak RSS +{peak:6.1f} MB, frame {frame:6.1f} MB")
+        results[mode] = {'seconds': elapsed, 'peak_rss_mb': peak, 'frame_mb': frame}
+    return results
+
+def synthetic_upstox_master(scale=1, path=FIXTURE_PATH):
+    """Replicate the real Upstox fixture `scale` times with unique keys and symbols."""
+    base = pd.read_csv(path, dtype=str, keep_default_na=False)
+    copies = [base]
+    for copy in range(1, scale):
+        suffix = f"X{copy}"
+        copies.append(base.assign(
+            instrument_key=base['instrument_key'] + suffix,
+            exchange_token=base['exchange_token'] + suffix,
+            tradingsymbol=base['tradingsymbol'] + suffix,
+        ))
+    return pd.concat(copies, ignore_index=True)
+
+def synthetic_dhan_master(upstox_master, seed=0):
+    """Derive a Dhan-format scrip master from a (synthetic) Upstox master.
+
+    About 3% of the equity symbols are dropped and 3% renamed so both
+    only-in sets are populated, and some symbols carry a -EQ/-BE series
+    suffix to exercise normalization.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(upstox_master)
+    segments = upstox_master['exchange'].map(DHAN_SEGMENTS)
+    equity = (upstox_master['exchange'] == 'NSE_EQ').to_numpy()
+    symbols = upstox_master['tradingsymbol'].copy()
+
+    draw = rng.random(n)
+    renamed = equity & (draw < 0.03)
+    symbols[renamed] = 'DH' + symbols[renamed]
+    suffixed = equity & (draw > 0.9)
+    symbols[suffixed] = symbols[suffixed] + np.where(draw[suffixed] > 0.95, '-BE', '-EQ')
+    keep = ~(equity & (draw >= 0.03) & (draw < 0.06))
+
+    instrument = upstox_master['instrument_type'].replace({'': 'FUTCOM'})
+    dhan = pd.DataFrame({
+        'SEM_EXM_EXCH_ID': segments.str[0],
+        'SEM_SEGMENT': segments.str[1],
+        'SEM_SMST_SECURITY_ID': np.arange(n) + 100000,
+        'SEM_INSTRUMENT_NAME': instrument,
+        'SEM_EXPIRY_CODE': 0,
+        'SEM_TRADING_SYMBOL': symbols,
+        'SEM_LOT_UNITS': upstox_master['lot_size'],
+        'SEM_CUSTOM_SYMBOL': upstox_master['name'],
+        'SEM_EXPIRY_DATE': upstox_master['expiry'],
+        'SEM_STRIKE_PRICE': upstox_master['strike'],
+        'SEM_OPTION_TYPE': upstox_master['option_type'],
+        'SEM_TICK_SIZE': upstox_master['tick_size'],
+        'SEM_EXPIRY_FLAG': 'NA',
+        'SEM_EXCH_INSTRUMENT_TYPE': instrument,
+        'SEM_SERIES': np.where(equity, 'EQ', ''),
+        'SM_SYMBOL_NAME': upstox_master['name'].str.upper(),
+    })
+    return dhan[keep].reset_index(drop=True)
+
+def synthetic_master_files(scale, data_dir=BENCH_DATA_DIR):
+    """Write (or reuse) the synthetic Upstox .csv.gz and Dhan .csv for `scale`."""
+    os.makedirs(data_dir, exist_ok=True)
+    upstox_path = os.path.join(data_dir, f"upstox_{scale}x.csv.gz")
+    dhan_path = os.path.join(data_dir, f"dhan_{scale}x.csv")
+    if not (os.path.exists(upstox_path) and os.path.exists(dhan_path)):
+        print(f"Generating synthetic {scale}x masters in {data_dir}...")
+        upstox_master = synthetic_upstox_master(scale)
+        upstox_master.to_csv(upstox_path + '.tmp', index=False, compression='gzip')
+        synthetic_dhan_master(upstox_master).to_csv(dhan_path + '.tmp', index=False)
+        os.replace(upstox_path + '.tmp', upstox_path)
+        os.replace(dhan_path + '.tmp', dhan_path)
+    return upstox_path, dhan_path
+
+def _drop_and_rename(symbols, equity, rng, prefix):
+    """Return (renamed symbols, rows kept): about 3% of equity rows dropped and 2% renamed."""
+    draw = rng.random(len(symbols))
+    renamed = equity & (draw < 0.02)
+    symbols = symbols.copy()
+    symbols[renamed] = prefix + symbols[renamed]
+    return symbols, ~(equity & (draw >= 0.02) & (draw < 0.05))
+
+def synthetic_zerodha_master(upstox_master, seed=1):
+    """Derive a Kite-format instruments dump from a (synthetic) Upstox master.
+
+    Indices are listed in the NSE exchange as EQ instruments of the INDICES
+    segment, as Kite does, so the equity filter has to tell them apart.
+    """
+    rng = np.random.default_rng(seed)
+    exchange = upstox_master['exchange']
+    equity = (exchange == 'NSE_EQ').to_numpy()
+    cash = equity | (exchange == 'NSE_INDEX').to_numpy()
+    symbols, keep = _drop_and_rename(upstox_master['tradingsymbol'], equity, rng, 'ZR')
+    exchange_tokens = np.arange(len(upstox_master)) + 1
+    zerodha = pd.DataFrame({
+        'instrument_token': exchange_tokens * 256 + 1,
+        'exchange_token': exchange_tokens,
+        'tradingsymbol': symbols,
+        'name': upstox_master['name'].str.upper(),
+        'last_price': 0,
+        'expiry': upstox_master['expiry'],
+        'strike': upstox_master['strike'],
+        'tick_size': upstox_master['tick_size'],
+        'lot_size': upstox_master['lot_size'],
+        'instrument_type': np.where(cash, 'EQ', upstox_master['instrument_type']),
+        'segment': np.where(equity, 'NSE', np.where(cash, 'INDICES', 'NFO')),
+        'exchange': np.where(cash, 'NSE', 'NFO'),
+    })
+    return zerodha[keep].reset_index(drop=True)
+
+def synthetic_angel_master(upstox_master, seed=2):
+    """Derive an Angel-format scrip master (list of string records) from a (synthetic) Upstox master.
+
+    Equity symbols carry their series suffix (mostly -EQ, some -BE) as in
+    Angel's dump; indices have none.
+    """
+    rng = np.random.default_rng(seed)
+    exchange = upstox_master['exchange']
+    equity = (exchange == 'NSE_EQ').to_numpy()
+    cash = equity | (exchange == 'NSE_INDEX').to_numpy()
+    symbols, keep = _drop_and_rename(upstox_master['tradingsymbol'], equity, rng, 'AO')
+    symbols[equity] = symbols[equity] + np.where(rng.random(int(equity.sum())) > 0.95, '-BE', '-EQ')
+    angel = pd.DataFrame({
+        'token': (np.arange(len(upstox_master)) + 500000).astype(str),
+        'symbol': symbols,
+        'name': upstox_master['tradingsymbol'],
+        'expiry': upstox_master['expiry'],
+        'strike': upstox_master['strike'],
+        'lotsize': upstox_master['lot_size'],
+        'instrumenttype': np.where(equity, '', np.where(cash, 'AMXIDX', upstox_master['instrument_type'])),
+        'exch_seg': np.where(cash, 'NSE', 'NFO'),
+        'tick_size': upstox_master['tick_size'],
+    })
+    return angel[keep].to_dict('records')
+
+def synthetic_source_files(scale, data_dir=BENCH_DATA_DIR):
+    """Write (or reuse) synthetic dumps of every source in sources.SOURCES for `scale`.
+
+    Returns {source: path}.
+    """
+    upstox_path, dhan_path = synthetic_master_files(scale, data_dir)
+    zerodha_path = os.path.join(data_dir, f"zerodha_{scale}x.csv")
+    angel_path = os.path.join(data_dir, f"angel_{scale}x.json")
+    if not (os.path.exists(zerodha_path) and os.path.exists(angel_path)):
+        print(f"Generating synthetic {scale}x Zerodha and Angel dumps in {data_dir}...")
+        upstox_master = synthetic_upstox_master(scale)
+        synthetic_zerodha_master(upstox_master).to_csv(zerodha_path + '.tmp', index=False)
+        with open(angel_path + '.tmp', 'w') as f:
+            json.dump(synthetic_angel_master(upstox_master), f)
+        os.replace(zerodha_path + '.tmp', zerodha_path)
+        os.replace(angel_path + '.tmp', angel_path)
+    return {'upstox': upstox_path, 'dhan': dhan_path, 'zerodha': zerodha_path, 'angel': angel_path}
+
+def pairwise_presence(frames):
+    """Reference for reconcile_sources: an outer join of every pair of sources on trading_symbol."""
+    return {(left, right): pd.merge(frames[left][['trading_symbol']], frames[right][['trading_symbol']],
+                                    on='trading_symbol', how='outer', indicator=True)
+            for left, right in itertools.combinations(frames, 2)}
+
+def bench_sources(scales=(1, 10)):
+    """Time the N-way reconciliation of the four synthetic source dumps at each scale.
+
+    The presence matrix and its id columns are checked against set
+    arithmetic on the transformed frames, and the reconciliation is timed
+    against the pairwise outer joins it replaces.
+    """
+    results = []
+    for scale in scales:
+        paths = synthetic_source_files(scale)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            extract_time, frames = timed(lambda: {name: transform_source(name, extract_source(name, path))
+                                                  for name, path in paths.items()}, repeat=1)
+        ids = {name: adapter.ids for name, adapter in SOURCES.items()}
+        elapsed, matrix = timed(reconcile_sources, frames, ids)
+        pairwise_time, pairs = timed(pairwise_presence, frames)
+
+        symbols = {name: set(df['trading_symbol']) for name, df in frames.items()}
+        universe = set().union(*symbols.values())
+        if (len(matrix) != len(universe) or not matrix['trading_symbol'].is_monotonic_increasing
+                or any(set(matrix.loc[matrix[f"in_{name}"], 'trading_symbol']) != symbols[name] for name in frames)
+                or any(((pair['_merge'] == 'both').sum()
+                        != (matrix[f"in_{left}"] & matrix[f"in_{right}"]).sum()) for (left, right), pair in pairs.items())
+                or any(not matrix.loc[matrix[f"in_{name}"]].set_index('trading_symbol')[f"{name}_{column}"]
+                       .equals(frames[name].set_index('trading_symbol')[column]
+                               .reindex(matrix.loc[matrix[f"in_{name}"], 'trading_symbol']))
+                       for name in frames for column in ids[name])):
+            raise AssertionError(f"reconcile_sources produced wrong results at {scale}x")
+
+        rows = sum(len(df) for df in frames.values())
+        in_all = int((matrix['source_count'] == len(frames)).sum())
+        print(f"sources   {scale:>4}x: {rows:>9} rows of {len(frames)} sources in {elapsed * 1000:8.1f} ms "
+              f"({rows / elapsed:,.0f} rows/s; {len(matrix)} symbols, {in_all} in all); "
+              f"{len(pairs)} pairwise joins {pairwise_time * 1000:.1f} ms; extract {extract_time * 1000:.0f} ms")
+        results.append({'scale': scale, 'rows': rows, 'seconds': elapsed, 'pairwise_seconds': pairwise_time})
+    return results
+
+class MemoryCollection:
+    """Dict-backed stand-in for the pymongo collection calls made by load_to_mongodb."""
+
+    name = 'upstox_nse'
+    full_name = 'benchmark.upstox_nse'
+
+    def __init__(self):
+        self.docs = {}
+        self.key = 'instrument_key'
+
+    def create_index(self, key, unique=False):
+        self.key = key
+        return f"{key}_1"
+
+    def find(self, filter=None, projection=None):
+        fields = [field for field, on in (projection or {}).items() if on and field != '_id']
+        return ({field: doc.get(field) for field in fields} for doc in self.docs.values())
+
+    def bulk_write(self, operations, ordered=True):
+        upserted = modified = 0
+        for operation in operations:
+            doc = operation._doc['$set']
+            if doc[self.key] in self.docs:
+                self.docs[doc[self.key]].update(doc)
+                modified += 1
+            else:
+                self.docs[doc[self.key]] = dict(doc)
+                upserted += 1
+        return SimpleNamespace(upserted_count=upserted, modified_count=modified)
+
+    def delete_many(self, filter):
+        keys = filter[self.key]['$in']
+        deleted = sum(self.docs.pop(key, None) is not None for key in keys)
+        return SimpleNamespace(deleted_count=deleted)
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Static file handler with Range/If-Range/ETag support that injects faults.
+
+    Each request takes the next fault from server.faults:
+      'ok'    - serve normally (also once the list is exhausted)
+      'error' - answer 503
+      'reset' - send half of the body, then drop the connection
+      'stall' - send half of the body, then go silent for server.stall_seconds
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        fault = server.faults.pop(0) if server.faults else 'ok'
+        path = os.path.join(server.directory, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        etag = f'"{len(data)}-{int(os.path.getmtime(path))}"'
+        start = 0
+        range_header = self.headers.get('Range', '')
+        if range_header.startswith('bytes=') and self.headers.get('If-Range', etag) == etag:
+            start = int(range_header[len('bytes='):].split('-')[0])
+        server.requests.append((fault, start))
+
+        if fault == 'error':
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        if start >= len(data) > 0:
+            self.send_response(416)
+            self.send_header('Content-Range', f"bytes */{len(data)}")
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = data[start:]
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header('Content-Range', f"bytes {start}-{len(data) - 1}/{len(data)}")
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(os.path.getmtime(path), usegmt=True))
+        self.end_headers()
+        if fault == 'ok':
+            self.wfile.write(body)
+            return
+        self.wfile.write(body[:len(body) // 2])
+        self.wfile.flush()
+        if fault == 'stall':
+            time.sleep(server.stall_seconds)
+        self.close_connection = True
+
+def serve_flaky(directory, faults=(), stall_seconds=3):
+    """Serve directory on a local port with FlakyHandler; returns (server, base URL).
+
+    server.requests records (fault, range start) for every request served.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+    server.daemon_threads = True
+    server.directory = directory
+    server.faults = list(faults)
+    server.stall_seconds = stall_seconds
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def bench_download(scale=10, data_dir=BENCH_DATA_DIR):
+    """Download a synthetic Dhan master through injected faults and check it arrives intact.
+
+    The faults drop and stall transfers halfway and answer 503, so the
+    downloader has to back off, time out and resume with Range requests;
+    the result must match the source byte for byte. A wrong expected hash
+    must be rejected rather than replace the target.
+    """
+    _, dhan_path = synthetic_master_files(scale, data_dir)
+    with open(dhan_path, 'rb') as f:
+        expected = hashlib.sha256(f.read()).hexdigest()
+    faults = ['reset', 'error', 'stall', 'reset']
+    server, base_url = serve_flaky(data_dir, faults, stall_seconds=3)
+    url = f"{base_url}/{os.path.basename(dhan_path)}"
+    with tempfile.TemporaryDirectory() as tmp:
+        target = os.path.join(tmp, 'dhan.csv')
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            result = download(url, target, timeout=(1, 1), backoff_seconds=0.1)
+            elapsed = time.perf_counter() - start
+            rejected = False
+            try:
+                download(url, os.path.join(tmp, 'bad.csv'), expected_sha256='0' * 64, max_attempts=2,
+                         backoff_seconds=0.1)
+            except IntegrityError:
+                rejected = not os.path.exists(os.path.join(tmp, 'bad.csv'))
+    server.shutdown()
+    if result.sha256 != expected or not rejected:
+        raise AssertionError("downloader returned a corrupt file or accepted a wrong hash")
+    print(f"download  {scale:>4}x ({len(faults)} faults, intact): {elapsed:.2f}s, {result.attempts} attempts, "
+          f"{result.resumed_bytes} of {result.size} bytes resumed")
+    return {'scale': scale, 'seconds': elapsed, 'attempts': result.attempts, 'resumed_bytes': result.resumed_bytes,
+            'size': result.size}
+
+def run_stage(name, func, rows_in, trace_memory=True):
+    """Run func() once for wall time and, if trace_memory, once more under tracemalloc.
+
+    func must set up its own state so both runs do the same work. When
+    rows_in is None (extract stages) the rows produced are used instead.
+    Returns (result, metrics).
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        result = func()
+        wall = time.perf_counter() - start
+        peak = None
+        if trace_memory:
+            tracemalloc.start()
+            func()
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+    rows_out = len(result) if hasattr(result, '__len__') else None
+    if rows_in is None:
+        rows_in = rows_out
+    metrics = {'stage': name, 'wall_seconds': wall, 'rows_in': rows_in, 'rows_out': rows_out,
+               'rows_per_second': rows_in / wall if wall else None, 'peak_memory_mb': peak}
+    peak_text = f"{peak:8.1f} MB" if peak is not None else "       -"
+    print(f"  {name:<18} {wall * 1000:10.1f} ms {metrics['rows_per_second'] or 0:14,.0f} rows/s  peak {peak_text}")
+    return result, metrics
+
+@contextlib.contextmanager
+def sqlite_db_path(path):
+    """Point SQLITE_DB_PATH at `path` for the duration of the block, then restore it."""
+    previous = os.environ.get('SQLITE_DB_PATH')
+    os.environ['SQLITE_DB_PATH'] = path
+    try:
+        yield path
+    finally:
+        if previous is None:
+            os.environ.pop('SQLITE_DB_PATH', None)
+        else:
+            os.environ['SQLITE_DB_PATH'] = previous
+
+def bench_pipeline(scale, data_dir=BENCH_DATA_DIR, stream=False, trace_memory=True):
+    """Time every pipeline stage offline on the synthetic masters at `scale`.
+
+    Databases and outputs go to a temporary directory, removed afterwards.
+    """
+    upstox_path, dhan_path = synthetic_master_files(scale, data_dir)
+    with tempfile.TemporaryDirectory(prefix='etl_bench_') as work_dir, \
+            sqlite_db_path(os.path.join(work_dir, 'bench.db')) as db_path:
+        return _bench_pipeline_stages(scale, upstox_path, dhan_path, work_dir, db_path, stream, trace_memory)
+
+def _bench_pipeline_stages(scale, upstox_path, dhan_path, work_dir, db_path, stream, trace_memory):
+    print(f"Pipeline stages at {scale}x (stream={stream}):")
+    stages = []
+
+    def sqlite_load(df):
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        return load_to_sql(df)
+
+    upstox_raw, m = run_stage('extract_upstox', lambda: extract_upstox_data(path=upstox_path, stream=stream),
+                              None, trace_memory)
+    stages.append(m)
+    dhan_raw, m = run_stage('extract_dhan', lambda: extract_dhan_data(path=dhan_path, stream=stream),
+                            None, trace_memory)
+    stages.append(m)
+
+    upstox_df, m = run_stage('transform_upstox', lambda: transform_upstox_data(upstox_raw), len(upstox_raw), trace_memory)
+    stages.append(m)
+    dhan_df, m = run_stage('transform_dhan', lambda: transform_dhan_data(dhan_raw), len(dhan_raw), trace_memory)
+    stages.append(m)
+    _, m = run_stage('validate', lambda: validate_frames({'upstox': upstox_df, 'dhan': dhan_df},
+                                                         path=os.path.join(work_dir, 'validation_report.json'),
+                                                         raise_on_failure=False)['frames'],
+                     len(upstox_df) + len(dhan_df), trace_memory)
+    stages.append(m)
+    _, m = run_stage('load_mongodb', lambda: load_to_mongodb(upstox_df, collection=MemoryCollection(), resume=False),
+                     len(upstox_df), trace_memory)
+    stages.append(m)
+    _, m = run_stage('load_sql', lambda: sqlite_load(dhan_df), len(dhan_df), trace_memory)
+    stages.append(m)
+    _, m = run_stage('compare_and_output',
+                     lambda: compare_and_output(upstox_df, dhan_df, output_dir=os.path.join(work_dir, 'output')),
+                     len(upstox_df) + len(dhan_df), trace_memory)
+    stages.append(m)
+    return {'scale': scale, 'stream': stream, 'stages': stages}
+
+def git_commit():
+    """Return the current git commit, or None outside a repository."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def diff_results(baseline, current):
+    """Print the per-stage wall time ratio of current against a baseline results dict."""
+    base = {(run['scale'], s['stage']): s for run in baseline['runs'] for s in run['stages']}
+    print(f"Compared with {baseline.get('commit')} ({baseline.get('created_at')}):")
+    for run in current['runs']:
+        for stage in run['stages']:
+            old = base.get((run['scale'], stage['stage']))
+            if old:
+                ratio = stage['wall_seconds'] / old['wall_seconds']
+                flag = '  <-- slower' if ratio > 1.1 else ''
+                print(f"  {run['scale']:>4}x {stage['stage']:<18} {ratio:6.2f}x{flag}")
+
+def run_suite(scales=(1, 10), output=None, stream=False, trace_memory=True, baseline=None,
+              data_dir=BENCH_DATA_DIR):
+    """Run bench_pipeline at each scale and save the results as JSON."""
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'runs': [bench_pipeline(scale, data_dir, stream, trace_memory) for scale in scales],
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'nogit'}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark results saved to {output}")
+    if baseline:
+        with open(baseline) as f:
+            diff_results(json.load(f), results)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the NSE ETL pipeline.")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10], help="synthetic scale factors")
+    parser.add_argument('--output', help="results JSON path (default: benchmarks/<time>-<commit>.json)")
+    parser.add_argument('--baseline', help="earlier results JSON to compare against")
+    parser.add_argument('--stream', action='store_true', help="use streaming extraction")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass")
+    parser.add_argument('--micro', action='store_true', help="also run the normalization/reconcile/matching/engine/schema/download/history/validation/query/sources micro-benchmarks")
+    args = parser.parse_args()
+    if args.micro:
+        bench_normalization()
+        bench_reconcile()
+        bench_matching()
+        bench_engines()
+        bench_schema_registry()
+        bench_download()
+        bench_history()
+        bench_validation()
+        bench_query()
+        bench_sources()
+    run_suite(args.scales, args.output, args.stream, not args.no_memory, args.baseline)
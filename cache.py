@@ -0,0 +1,86 @@
+import json
+import os
+from datetime import datetime
+
+from download import download, file_sha256
+
+# Local copies of the instrument masters and their HTTP validators
+CACHE_DIR = 'cache'
+LAST_RUN_FILE = 'last_run.json'
+
+def _meta_path(name, cache_dir):
+    return os.path.join(cache_dir, f"{name}.meta.json")
+
+def _write_json_atomic(path, data):
+    # Written beside path and renamed over it, so a crash mid-write never leaves truncated JSON
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def load_meta(name, cache_dir=CACHE_DIR):
+    """Return the cached metadata for `name`, or None if it is not cached."""
+    meta_path = _meta_path(name, cache_dir)
+    if not os.path.exists(meta_path) or not os.path.exists(os.path.join(cache_dir, name)):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+def fetch_source(url, name, cache_dir=CACHE_DIR):
+    """Fetch `url` into the cache as `name` using a conditional request.
+
+    The stored ETag/Last-Modified are sent as If-None-Match/If-Modified-Since,
+    so an unchanged file costs a single 304 round trip. Returns the local path
+    and the SHA-256 of its content.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, name)
+    meta = load_meta(name, cache_dir)
+    headers = {}
+    if meta and meta.get('url') == url:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    # Retried and resumed by the downloader, which only replaces path once the copy is complete
+    result = download(url, path, headers=headers)
+    if result.status == 304:
+        if file_sha256(path) != meta['sha256']:
+            # The local copy was damaged after it was verified; fetch it again unconditionally
+            print(f"Cached {name} does not match its recorded sha256, downloading it again.")
+            result = download(url, path)
+        else:
+            print(f"{name} not modified since {meta.get('last_modified') or meta.get('fetched_at')}, using cached copy.")
+            return path, meta['sha256']
+    size = result.size
+    meta = {
+        'url': url,
+        'etag': result.etag,
+        'last_modified': result.last_modified,
+        'sha256': result.sha256,
+        'size': size,
+        'fetched_at': datetime.now().isoformat(timespec='seconds'),
+    }
+
+    _write_json_atomic(_meta_path(name, cache_dir), meta)
+    print(f"Downloaded {name} ({size} bytes, sha256 {meta['sha256'][:12]}).")
+    return path, meta['sha256']
+
+def last_run_hashes(cache_dir=CACHE_DIR):
+    """Return the source hashes ({name: sha256}) of the last successful run, or {}."""
+    last_run_path = os.path.join(cache_dir, LAST_RUN_FILE)
+    if not os.path.exists(last_run_path):
+        return {}
+    with open(last_run_path) as f:
+        return json.load(f).get('hashes') or {}
+
+def sources_unchanged(hashes, cache_dir=CACHE_DIR):
+    """Check whether `hashes` ({name: sha256}) match the last successful run."""
+    return last_run_hashes(cache_dir) == hashes
+
+def record_run(hashes, cache_dir=CACHE_DIR):
+    """Remember the source hashes of a successful run."""
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_json_atomic(os.path.join(cache_dir, LAST_RUN_FILE),
+                       {'hashes': hashes, 'completed_at': datetime.now().isoformat(timespec='seconds')})
@@ -0,0 +1,34 @@
+import argparse
+import runpy
+import sys
+
+# Subcommand -> (module whose command line it runs, description). A module is
+# only imported once its subcommand is chosen, so --help and light commands
+# such as lookup start without loading pandas, polars or the database drivers.
+COMMANDS = {
+    'run': ('main', "run the pipeline once"),
+    'daemon': ('daemon', "keep running and refresh incrementally when a source changes"),
+    'stream': ('streaming', "run the pipeline with streaming batches"),
+    'exchanges': ('exchanges', "run several exchange partitions in parallel"),
+    'graph': ('dag', "run the pipeline as a checkpointed stage graph"),
+    'sources': ('sources', "reconcile the instrument dumps of all brokers in one N-way pass"),
+    'lookup': ('symbol_index', "look up instruments in the symbol index"),
+    'query': ('query', "look up reconciled instruments in the SQLite database"),
+    'bench': ('benchmark', "run the offline benchmarks"),
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="NSE instruments ETL pipeline.",
+        epilog="commands:\n" + "\n".join(f"  {name:<10} {help}" for name, (_, help) in COMMANDS.items())
+               + "\n\nRun python cli.py <command> --help for the options of a command.",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=COMMANDS, metavar='command')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="options of the command")
+    args = parser.parse_args(argv)
+    module = COMMANDS[args.command][0]
+    sys.argv = [f"{module}.py", *args.args]
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
+
+if __name__ == "__main__":
+    main()
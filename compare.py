@@ -1,131 +1,306 @@
-import pandas as pd
-import os
-
-def compare_and_output(upstox_df, dhan_df):
-    """Compare Upstox and Dhan data and generate CSV outputs."""
-    print("Comparing Upstox and Dhan data...")
-    print(f"Upstox DataFrame shape: {upstox_df.shape}")
-    print(f"Dhan DataFrame shape: {dhan_df.shape}")
-    
-    # Validate inputs
-    if upstox_df.empty or dhan_df.empty:
-        print("Warning: One or both DataFrames are empty. Skipping comparison.")
-        os.makedirs('output', exist_ok=True)
-        upstox_df.to_csv('output/only_in_upstox.csv', index=False)
-        dhan_df.to_csv('output/only_in_dhan.csv', index=False)
-        pd.DataFrame().to_csv('output/common_stocks.csv', index=False)
-        return
-    
-    # Debug: Check for nulls and duplicates
-    if 'trading_symbol' in upstox_df.columns:
-        upstox_nulls = upstox_df['trading_symbol'].isna().sum()
-        upstox_duplicates = upstox_df['trading_symbol'].duplicated(keep=False).sum()
-        print(f"Upstox trading_symbol nulls: {upstox_nulls}, duplicates: {upstox_duplicates}")
-        if upstox_duplicates > 0:
-            print("Upstox duplicate trading_symbols:", upstox_df[upstox_df['trading_symbol'].duplicated(keep=False)]['trading_symbol'].unique().tolist())
-            print("Sample Upstox duplicate rows:\n", upstox_df[upstox_df['trading_symbol'].duplicated(keep=False)].head(5))
-    if 'trading_symbol' in dhan_df.columns:
-        dhan_nulls = dhan_df['trading_symbol'].isna().sum()
-        dhan_duplicates = dhan_df['trading_symbol'].duplicated(keep=False).sum()
-        print(f"Dhan trading_symbol nulls: {dhan_nulls}, duplicates: {dhan_duplicates}")
-        if dhan_duplicates > 0:
-            print("Dhan duplicate trading_symbols:", dhan_df[dhan_df['trading_symbol'].duplicated(keep=False)]['trading_symbol'].unique().tolist())
-            print("Sample Dhan duplicate rows:\n", dhan_df[dhan_df['trading_symbol'].duplicated(keep=False)].head(5))
-    
-    # Debug: Print sample trading_symbol values
-    if not upstox_df.empty:
-        print("Sample Upstox trading_symbol values:", upstox_df['trading_symbol'].head(5).tolist())
-    if not dhan_df.empty:
-        print("Sample Dhan trading_symbol values:", dhan_df['trading_symbol'].head(5).tolist())
-    
-    # Copy DataFrames
-    upstox_df = upstox_df.copy()
-    dhan_df = dhan_df.copy()
-    
-    # Remove null trading_symbol rows
-    if 'trading_symbol' in upstox_df.columns:
-        upstox_df = upstox_df.dropna(subset=['trading_symbol'])
-        print(f"Upstox DataFrame shape after removing nulls: {upstox_df.shape}")
-    if 'trading_symbol' in dhan_df.columns:
-        dhan_df = dhan_df.dropna(subset=['trading_symbol'])
-        print(f"Dhan DataFrame shape after removing nulls: {dhan_df.shape}")
-    
-    # Remove duplicates
-    if 'trading_symbol' in upstox_df.columns:
-        upstox_df = upstox_df.drop_duplicates(subset=['trading_symbol'], keep='first')
-        print(f"Upstox DataFrame shape after deduplication: {upstox_df.shape}")
-        print(f"Unique Upstox trading_symbol count: {upstox_df['trading_symbol'].nunique()}")
-    if 'trading_symbol' in dhan_df.columns:
-        dhan_df = dhan_df.drop_duplicates(subset=['trading_symbol'], keep='first')
-        print(f"Dhan DataFrame shape after deduplication: {dhan_df.shape}")
-        print(f"Unique Dhan trading_symbol count: {dhan_df['trading_symbol'].nunique()}")
-    
-    # Debug: Compare trading_symbol sets
-    upstox_symbols = set(upstox_df['trading_symbol'])
-    dhan_symbols = set(dhan_df['trading_symbol'])
-    common_symbols = upstox_symbols.intersection(dhan_symbols)
-    only_upstox_symbols = upstox_symbols - dhan_symbols
-    only_dhan_symbols = dhan_symbols - upstox_symbols
-    print(f"Total unique Upstox symbols: {len(upstox_symbols)}")
-    print(f"Total unique Dhan symbols: {len(dhan_symbols)}")
-    print(f"Common symbols: {len(common_symbols)}")
-    print(f"Only in Upstox symbols: {len(only_upstox_symbols)}")
-    print(f"Only in Dhan symbols: {len(only_dhan_symbols)}")
-    if only_upstox_symbols:
-        print("Sample only Upstox symbols:", list(only_upstox_symbols)[:5])
-    if only_dhan_symbols:
-        print("Sample only Dhan symbols:", list(only_dhan_symbols)[:5])
-    
-    # Inner join for common stocks
-    common_df = pd.merge(
-        upstox_df, dhan_df, 
-        on='trading_symbol', 
-        how='inner', 
-        suffixes=('_upstox', '_dhan')
-    )
-    print(f"Common stocks DataFrame shape: {common_df.shape}")
-    
-    # Validate common_df
-    if len(common_df) > min(len(upstox_df), len(dhan_df)):
-        print("Warning: Common stocks DataFrame larger than expected. Deduplicating...")
-        duplicates = common_df['trading_symbol'].duplicated(keep=False)
-        if duplicates.sum() > 0:
-            print("Common duplicate trading_symbols:", common_df[duplicates]['trading_symbol'].unique().tolist())
-            print("Sample common duplicate rows:\n", common_df[duplicates].head(5))
-        common_df = common_df.drop_duplicates(subset=['trading_symbol'], keep='first')
-        print(f"Common stocks DataFrame shape after deduplication: {common_df.shape}")
-    
-    # Combine fields
-    if not common_df.empty:
-        common_df['exchange'] = common_df['exchange_upstox']
-        common_df['instrument_key'] = common_df['instrument_key_upstox']
-        common_df['symbol_name'] = dhan_df['symbol_name']
-        common_df['security_id'] = common_df['security_id_dhan']
-        common_df['short_name'] = common_df['short_name_upstox']
-        common_df['name'] = common_df['name_upstox']
-        common_df['isin'] = common_df['isin_upstox']
-        
-        common_df = common_df[[
-            'exchange', 'instrument_key', 'symbol_name', 'security_id',
-            'short_name', 'name', 'isin', 'trading_symbol'
-        ]]
-    
-    # Only in Upstox
-    only_upstox_df = upstox_df[~upstox_df['trading_symbol'].isin(dhan_df['trading_symbol'])]
-    print(f"Only in Upstox DataFrame shape: {only_upstox_df.shape}")
-    if not only_upstox_df.empty:
-        print("Sample unique Upstox symbols:", only_upstox_df['trading_symbol'].head(5).tolist())
-    
-    # Only in Dhan
-    only_dhan_df = dhan_df[~dhan_df['trading_symbol'].isin(upstox_df['trading_symbol'])]
-    print(f"Only in Dhan DataFrame shape: {only_dhan_df.shape}")
-    if not only_dhan_df.empty:
-        print("Sample unique Dhan symbols:", only_dhan_df['trading_symbol'].head(5).tolist())
-    
-    # Save to CSVs
-    os.makedirs('output', exist_ok=True)
-    common_df.to_csv('output/common_stocks.csv', index=False)
-    only_upstox_df.to_csv('output/only_in_upstox.csv', index=False)
-    only_dhan_df.to_csv('output/only_in_dhan.csv', index=False)
-    
-    print("CSV files generated: output/common_stocks.csv, output/only_in_upstox.csv, output/only_in_dhan.csv")
\ No newline at end of file
+import pandas as pd
+import numpy as np
+
+import diagnostics
+from sinks import write_outputs, OUTPUT_DIR
+from symbol_index import write_symbol_index
+
+# Reconciled outputs of compare_and_output, written in each requested format
+OUTPUT_NAMES = ['common_stocks', 'only_in_upstox', 'only_in_dhan']
+
+OUTPUT_COLUMNS = ['exchange', 'instrument_key', 'symbol_name', 'security_id',
+                  'short_name', 'name', 'isin', 'trading_symbol']
+# Which source each common_stocks column is taken from
+UPSTOX_FIELDS = ['exchange', 'instrument_key', 'short_name', 'name', 'isin', 'trading_symbol']
+DHAN_FIELDS = ['symbol_name', 'security_id']
+
+# Matching tiers, tried in this order; see reconcile
+MATCH_TIERS = ['isin', 'symbol']
+# Words that do not tell companies apart. Single letters are dropped as
+# well, since Dhan truncates long names mid-word ("ENVIRO INFRA ENGINEERS L").
+NAME_STOPWORDS = {'LTD', 'LIMITED', 'THE', 'AND', 'OF', 'CO', 'COMPANY', 'CORP', 'CORPORATION',
+                  'INC', 'PVT', 'PRIVATE'}
+NAME_SEPARATOR_PATTERN = r'[^A-Z0-9]+'
+# A word used by more names than this on either side is too common to block on
+NAME_BLOCK_MAX_ROWS = 20
+# Minimum Jaccard similarity of two names' words for a name match
+NAME_MATCH_THRESHOLD = 0.6
+# Words marking a share class (differential voting rights, partly paid, SME
+# board); names differing in them are different instruments of one company
+SHARE_CLASS_TOKENS = {'DVR', 'PP', 'SME'}
+# Reconciled output of the name match candidates, see name_match_candidates
+CANDIDATES_OUTPUT = 'name_match_candidates'
+CANDIDATE_COLUMNS = ['trading_symbol', 'instrument_key', 'name', 'isin',
+                     'dhan_trading_symbol', 'security_id', 'symbol_name', 'score']
+
+def encode_join_keys(left, right):
+    """Hash-code two key Series against one shared set of codes.
+
+    Null keys get distinct negative codes on each side so they never match.
+    """
+    codes, _ = pd.factorize(pd.concat([left, right], ignore_index=True))
+    left_codes, right_codes = codes[:len(left)], codes[len(left):].copy()
+    right_codes[right_codes == -1] = -2
+    return left_codes, right_codes
+
+def unique_key_pairs(left, right):
+    """Return the (left, right) positions of rows whose keys are equal.
+
+    Null keys and keys repeated on either side never match, so every row
+    is paired at most once.
+    """
+    left_codes, right_codes = encode_join_keys(left, right)
+    left_codes[pd.Series(left_codes).duplicated(keep=False).to_numpy()] = -1
+    right_codes[pd.Series(right_codes).duplicated(keep=False).to_numpy()] = -2
+    joined = pd.merge(
+        pd.DataFrame({'_key': left_codes, '_left': np.arange(len(left))}),
+        pd.DataFrame({'_key': right_codes, '_right': np.arange(len(right))}),
+        on='_key'
+    )
+    return joined['_left'].to_numpy(dtype=np.int64), joined['_right'].to_numpy(dtype=np.int64)
+
+def name_tokens(names):
+    """Return a (row position, token) frame of the informative words of each name."""
+    tokens = (pd.Series(names.to_numpy(dtype=object)).fillna('').astype(str).str.upper()
+                .str.replace(NAME_SEPARATOR_PATTERN, ' ', regex=True)
+                .str.split().explode().dropna())
+    tokens = tokens[(tokens.str.len() > 1) & ~tokens.isin(NAME_STOPWORDS)]
+    return pd.DataFrame({'row': tokens.index.to_numpy(dtype=np.int64),
+                         'token': tokens.to_numpy(dtype=object)}).drop_duplicates()
+
+def share_classes(tokens):
+    """Return the share-class words of each row of a name_tokens frame, joined in sorted order."""
+    classes = tokens[tokens['token'].isin(SHARE_CLASS_TOKENS)]
+    return classes.sort_values('token').groupby(classes.columns[0])['token'].agg(' '.join)
+
+def name_match_pairs(left_names, right_names, threshold=NAME_MATCH_THRESHOLD, max_block_rows=NAME_BLOCK_MAX_ROWS):
+    """Return the (left, right) positions and scores of names that match on their words.
+
+    Only pairs sharing a word that at most max_block_rows names use on each
+    side are scored, so the work grows with the number of names rather than
+    with their product. A pair is scored by the Jaccard similarity of all
+    its words and kept if it reaches `threshold`, both names carry the same
+    SHARE_CLASS_TOKENS and each side is the other's single best candidate;
+    ties are left unmatched.
+    """
+    left = name_tokens(left_names).rename(columns={'row': 'left'})
+    right = name_tokens(right_names).rename(columns={'row': 'right'})
+    left_counts, right_counts = left['token'].value_counts(), right['token'].value_counts()
+    blocks = left_counts.index[left_counts <= max_block_rows].intersection(
+        right_counts.index[right_counts <= max_block_rows])
+    candidates = (left[left['token'].isin(blocks)]
+                  .merge(right[right['token'].isin(blocks)], on='token')[['left', 'right']]
+                  .drop_duplicates())
+
+    # Shared words of each candidate pair, counting the common words as well
+    scored = (candidates.merge(left, on='left').merge(right, on=['right', 'token'])
+                        .groupby(['left', 'right']).size().rename('shared').reset_index())
+    sizes = (scored['left'].map(left.groupby('left').size())
+             + scored['right'].map(right.groupby('right').size()))
+    scored['score'] = scored['shared'] / (sizes - scored['shared'])
+    same_class = (scored['left'].map(share_classes(left)).fillna('')
+                  == scored['right'].map(share_classes(right)).fillna(''))
+    scored = scored[(scored['score'] >= threshold) & same_class]
+    for side in ('left', 'right'):
+        scored = scored[scored['score'] == scored.groupby(side)['score'].transform('max')]
+        scored = scored[~scored[side].duplicated(keep=False)]
+    return (scored['left'].to_numpy(dtype=np.int64), scored['right'].to_numpy(dtype=np.int64),
+            scored['score'].to_numpy(dtype=np.float64))
+
+def name_match_candidates(only_upstox_df, only_dhan_df):
+    """Pair the unmatched Upstox and Dhan rows whose company names match, for review.
+
+    Runs name_match_pairs on the Upstox name and the Dhan symbol_name. A
+    name match is a guess, not an identity (TATA MOTORS LIMITED and TATA
+    MOTORS DVR share all their informative words), so the pairs are not
+    reconciled: both rows stay in the only_in_* sets, and the returned
+    frame of CANDIDATE_COLUMNS lists each pair, in Upstox row order, with
+    its score.
+    """
+    left, right, scores = (name_match_pairs(only_upstox_df['name'], only_dhan_df['symbol_name'])
+                           if len(only_upstox_df) and len(only_dhan_df)
+                           else (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)))
+    order = np.argsort(left, kind='stable')
+    upstox_rows = only_upstox_df.iloc[left[order]]
+    dhan_rows = only_dhan_df.iloc[right[order]]
+    diagnostics.summary("Found %d name match candidates.", len(left))
+    return pd.DataFrame({
+        'trading_symbol': upstox_rows['trading_symbol'].to_numpy(dtype=object),
+        'instrument_key': upstox_rows['instrument_key'].to_numpy(dtype=object),
+        'name': upstox_rows['name'].to_numpy(dtype=object),
+        'isin': upstox_rows['isin'].to_numpy(dtype=object),
+        'dhan_trading_symbol': dhan_rows['trading_symbol'].to_numpy(dtype=object),
+        'security_id': dhan_rows['security_id'].to_numpy(dtype=object),
+        'symbol_name': dhan_rows['symbol_name'].to_numpy(dtype=object),
+        'score': scores[order],
+    }, columns=CANDIDATE_COLUMNS)
+
+def reconcile(upstox_df, dhan_df, key='trading_symbol', tiers=MATCH_TIERS):
+    """Split two transformed sources into common, only-Upstox and only-Dhan rows.
+
+    Expects the output of transform_upstox_data/transform_dhan_data, which
+    are already free of null and duplicate keys. Rows are matched by each
+    of `tiers` in turn, each one only looking at the rows earlier tiers
+    left unmatched:
+      isin   - exact join on the ISIN, where both sources carry it
+      symbol - exact join on `key`
+    Joins run over integer-coded keys. Matching on company names is too
+    loose to reconcile rows; see name_match_candidates. Common rows take Dhan's
+    symbol_name and security_id and everything else from Upstox, and
+    record the tier that matched them in match_tier.
+    """
+    unknown = set(tiers) - set(MATCH_TIERS)
+    if unknown:
+        raise ValueError(f"Unknown match tiers: {sorted(unknown)}. Choose from {MATCH_TIERS}.")
+    upstox_left, dhan_left = np.arange(len(upstox_df)), np.arange(len(dhan_df))
+    matches = [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), None)]
+    for tier in tiers:
+        if not len(upstox_left) or not len(dhan_left):
+            break
+        column = 'isin' if tier == 'isin' else key
+        left, right = unique_key_pairs(upstox_df[column].iloc[upstox_left], dhan_df[column].iloc[dhan_left])
+        diagnostics.summary("Matched %d rows on %s.", len(left), tier)
+        matches.append((upstox_left[left], dhan_left[right], tier))
+        upstox_left, dhan_left = np.delete(upstox_left, left), np.delete(dhan_left, right)
+
+    upstox_rows = np.concatenate([rows for rows, _, _ in matches])
+    order = np.argsort(upstox_rows, kind='stable')
+    dhan_rows = np.concatenate([rows for _, rows, _ in matches])[order]
+    common_df = pd.concat([
+        upstox_df.iloc[upstox_rows[order]][UPSTOX_FIELDS].reset_index(drop=True),
+        dhan_df.iloc[dhan_rows][DHAN_FIELDS].reset_index(drop=True),
+    ], axis=1)[OUTPUT_COLUMNS]
+    common_df['match_tier'] = np.repeat(np.array([tier for _, _, tier in matches], dtype=object),
+                                        [len(rows) for rows, _, _ in matches])[order]
+
+    return common_df, upstox_df.iloc[upstox_left], dhan_df.iloc[dhan_left]
+
+def compare_and_output(upstox_df, dhan_df, formats=('csv',), output_dir=OUTPUT_DIR, symbol_index=True,
+                       tiers=MATCH_TIERS, reconciler=reconcile, name_candidates=name_match_candidates):
+    """Compare Upstox and Dhan data and write the outputs in each of `formats`.
+
+    See sinks.SINKS for the available formats (csv, parquet, feather) and
+    reconcile for the matching `tiers`. `reconciler` and `name_candidates`
+    swap in another engine's functions (see engines.py); the name match
+    candidates of the unmatched rows are written as a separate output for
+    review (name_candidates=None skips them).
+    With symbol_index=True a memory-mappable lookup index of all reconciled
+    rows is also written to output_dir/symbol_index (see symbol_index.py).
+    Returns the output frames by output name.
+    """
+    diagnostics.summary("Comparing Upstox and Dhan data...")
+    diagnostics.summary("Upstox DataFrame shape: %s", upstox_df.shape)
+    diagnostics.summary("Dhan DataFrame shape: %s", dhan_df.shape)
+
+    if upstox_df.empty or dhan_df.empty:
+        diagnostics.warning("Warning: One or both DataFrames are empty. Nothing will match.")
+
+    common_df, only_upstox_df, only_dhan_df = reconciler(upstox_df, dhan_df, tiers=tiers)
+    diagnostics.summary("Common stocks: %d, only in Upstox: %d, only in Dhan: %d",
+                        len(common_df), len(only_upstox_df), len(only_dhan_df))
+    if diagnostics.enabled('debug'):
+        if not only_upstox_df.empty:
+            diagnostics.debug("Sample only Upstox symbols: %s", only_upstox_df['trading_symbol'].head(5).tolist())
+        if not only_dhan_df.empty:
+            diagnostics.debug("Sample only Dhan symbols: %s", only_dhan_df['trading_symbol'].head(5).tolist())
+
+    frames = {
+        'common_stocks': common_df,
+        'only_in_upstox': only_upstox_df,
+        'only_in_dhan': only_dhan_df,
+    }
+    if name_candidates is not None:
+        frames[CANDIDATES_OUTPUT] = name_candidates(only_upstox_df, only_dhan_df)
+    paths = write_outputs(frames, formats=formats, output_dir=output_dir)
+    if symbol_index:
+        paths.append(write_symbol_index(common_df, only_upstox_df, only_dhan_df, output_dir))
+
+    print(f"Output files generated: {', '.join(paths)}")
+    return frames
+
+def encode_symbols(symbols):
+    """Return `symbols` as a fixed-width (UCS-4) string array, which numpy sorts and compares in C.
+
+    Converting from Python strings is one C loop, several times faster than
+    encoding each symbol to UTF-8 bytes, and sorts in the same order.
+    """
+    return np.asarray(symbols, dtype=str)
+
+def merge_sorted_runs(runs):
+    """K-way merge of sorted key arrays.
+
+    Returns (merged keys, source of each key, position of each key in its
+    run). The runs are concatenated in order and sorted stably: numpy's
+    stable sort of non-numeric keys is timsort, which finds each run
+    already sorted and only merges them, in O(n log k) for k runs.
+    """
+    keys = np.concatenate(runs)
+    sources = np.repeat(np.arange(len(runs)), [len(run) for run in runs])
+    positions = np.concatenate([np.arange(len(run)) for run in runs])
+    order = np.argsort(keys, kind='stable')
+    return keys[order], sources[order], positions[order]
+
+def _take(values, rows):
+    """Return values at rows as a Series, missing (NA) where a row is -1."""
+    return pd.Series(pd.api.extensions.take(values, rows, allow_fill=True))
+
+def reconcile_sources(frames, id_columns, key='trading_symbol', fields=('isin', 'name')):
+    """N-way reconciliation of {source: transformed frame} on `key`.
+
+    Each source's keys are encoded (encode_symbols) and sorted, and all of
+    them are merged in one k-way merge (merge_sorted_runs); a single pass
+    over the merged keys then numbers the symbols of the universe and
+    records, per symbol and source, the source row listing it. Nothing is
+    joined pairwise, so adding a source adds one sorted run rather than a
+    join against every other source.
+
+    Frames must be free of null and repeated keys (see drop_invalid_symbols).
+    Returns the presence matrix, one row per symbol in key order: `key`,
+    an in_<source> flag per source, source_count, each of `fields` from the
+    first source (in frames order) that has it, and every column of
+    id_columns[source] as <source>_<column>.
+    """
+    names = list(frames)
+    runs, run_rows, run_symbols = [], [], []
+    for name in names:
+        symbols = frames[name][key].to_numpy(dtype=object)
+        encoded = encode_symbols(symbols)
+        order = np.argsort(encoded, kind='stable')
+        runs.append(encoded[order])
+        run_rows.append(order)
+        run_symbols.append(symbols[order])
+    keys, sources, positions = merge_sorted_runs(runs)
+    # Position of each merged key in the concatenated runs
+    merged = np.cumsum([0] + [len(run) for run in runs])[:-1][sources] + positions
+    rows = np.concatenate(run_rows)[merged]
+
+    # A key differing from the one before it starts the next symbol
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = keys[1:] != keys[:-1]
+    symbol = np.cumsum(starts) - 1
+    source_rows = np.full((int(starts.sum()), len(names)), -1, dtype=np.int64)
+    source_rows[symbol, sources] = rows
+    present = source_rows >= 0
+
+    matrix = pd.DataFrame({key: np.concatenate(run_symbols)[merged][starts]})
+    for i, name in enumerate(names):
+        matrix[f"in_{name}"] = present[:, i]
+    matrix['source_count'] = present.sum(axis=1)
+    for field in fields:
+        values = pd.Series([None] * len(matrix), dtype=object)
+        for i, name in enumerate(names):
+            if field in frames[name]:
+                values = values.where(values.notna(),
+                                      _take(frames[name][field].to_numpy(dtype=object), source_rows[:, i]))
+        matrix[field] = values.where(values.notna(), None)
+    for i, name in enumerate(names):
+        for column in id_columns.get(name, []):
+            matrix[f"{name}_{column}"] = _take(frames[name][column].array, source_rows[:, i])
+
+    in_all = int((matrix['source_count'] == len(names)).sum())
+    diagnostics.summary("Reconciled %d sources into %d symbols, %d listed by all of them.",
+                        len(names), len(matrix), in_all)
+    for i, name in enumerate(names):
+        diagnostics.summary("%s lists %d symbols, %d only in %s.", name, int(present[:, i].sum()),
+                            int((present[:, i] & (matrix['source_count'] == 1)).sum()), name)
+    return matrix
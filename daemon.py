@@ -0,0 +1,198 @@
+import argparse
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from decouple import config
+from pymongo import MongoClient
+
+from extract import extract_upstox_data, extract_dhan_data, UPSTOX_URL, DHAN_URL
+from transform import load_symbol_memo, save_symbol_memo
+from load import bulk_upsert_mongodb, upsert_sqlite, upsert_reconciled, open_sqlite_db
+from compare import compare_and_output
+from cache import fetch_source, last_run_hashes, record_run
+from delta import load_snapshot, save_snapshot, compute_delta, write_changelog
+from history import record_history
+from validate import validate_frames
+from main import extract_and_transform
+from metrics import RunMetrics
+from engines import get_engine
+
+# Seconds between polls of the sources
+POLL_SECONDS = config('DAEMON_POLL_SECONDS', default=300, cast=float)
+
+# Source -> where it is fetched from and the key its rows are diffed on
+SOURCES = {
+    'upstox': {'url': UPSTOX_URL, 'cache_name': 'upstox_nse.csv.gz', 'key': 'instrument_key',
+               'extract': extract_upstox_data},
+    'dhan': {'url': DHAN_URL, 'cache_name': 'dhan_scrip.csv', 'key': 'security_id',
+             'extract': extract_dhan_data},
+}
+
+class Daemon:
+    """Long-running pipeline that refreshes incrementally whenever a source changes.
+
+    Unlike run_etl_pipeline, which starts from nothing on every run, the
+    daemon keeps one MongoDB client and one SQLite connection open, and the
+    last normalized frame of each source in memory (with its row hashes, as
+    saved by delta.save_snapshot). A poll is a conditional request per
+    source; only a source whose content changed is extracted and
+    transformed again, and only its added, modified and removed rows are
+    loaded. Outputs are rewritten from the in-memory frames, and snapshots
+    and source hashes are written to disk so one-shot runs stay in step.
+    """
+
+    def __init__(self, poll_seconds=POLL_SECONDS, output_formats=('csv',), engine=None, collection_name='upstox_nse',
+                 table='dhan_nse'):
+        self.poll_seconds = poll_seconds
+        self.output_formats = output_formats
+        self.engine = get_engine(engine)
+        self.collection_name = collection_name
+        self.table = table
+        # Warm start from the last run's state on disk, if there is any
+        self.snapshots = {name: load_snapshot(name) for name in SOURCES}
+        self.hashes = last_run_hashes()
+        self.symbol_memo = load_symbol_memo()
+        self.stopped = threading.Event()
+        self._client = self._collection = self._conn = None
+
+    def connect(self):
+        """Open the MongoDB client and SQLite connection unless they are open."""
+        if self._client is None:
+            self._client = MongoClient(config('MONGODB_URI'))
+            self._collection = self._client['market_data'][self.collection_name]
+        if self._conn is None:
+            self._conn = open_sqlite_db(self.table)
+
+    def close(self):
+        """Close the database connections; the next refresh reopens them."""
+        if self._client is not None:
+            self._client.close()
+        if self._conn is not None:
+            self._conn.close()
+        self._client = self._collection = self._conn = None
+
+    def _transform(self, name, path, metrics):
+        transform = self.engine.transform_upstox if name == 'upstox' else self.engine.transform_dhan
+        return extract_and_transform(SOURCES[name]['extract'], partial(transform, symbol_memo=self.symbol_memo),
+                                     path=path, metrics=metrics, source=name, scan=self.engine.reads_paths)
+
+    def _load(self, name, delta, metrics):
+        upserts = delta['upserts']
+        # Without a previous snapshot the frame is loaded in full
+        deleted_keys = None if delta['initial'] else delta['removed_keys']
+        if upserts.empty and not deleted_keys:
+            return
+        if name == 'upstox':
+            # Every upsert of a delta changed, so the stored hashes are only read for a full load
+            stats = metrics.run('load_mongodb', bulk_upsert_mongodb, self._collection, upserts,
+                                deleted_keys=deleted_keys, skip_unchanged=delta['initial'], rows_in=len(upserts))
+        else:
+            stats = metrics.run('load_sql', upsert_sqlite, self._conn, upserts, deleted_keys=deleted_keys,
+                                table=self.table, rows_in=len(upserts))
+        print(f"Loaded {name} changes: {stats}")
+
+    def refresh(self):
+        """Poll both sources once and apply whatever changed.
+
+        Returns the names of the sources that were refreshed.
+        """
+        metrics = RunMetrics('daemon')
+        try:
+            with ThreadPoolExecutor(max_workers=len(SOURCES)) as pool:
+                fetches = {name: pool.submit(metrics.run, f"fetch_{name}", fetch_source, spec['url'],
+                                             spec['cache_name'])
+                           for name, spec in SOURCES.items()}
+                fetched = {name: job.result() for name, job in fetches.items()}
+                hashes = {name: sha256 for name, (_, sha256) in fetched.items()}
+                changed = [name for name in SOURCES
+                           if hashes[name] != self.hashes.get(name) or self.snapshots[name] is None]
+                if not changed:
+                    metrics.finish('unchanged')
+                    return []
+
+                print(f"Refreshing {', '.join(changed)}...")
+                jobs = {name: pool.submit(self._transform, name, fetched[name][0], metrics) for name in changed}
+                current = {name: job.result() for name, job in jobs.items()}
+
+            # A source that fails validation is not loaded, and is polled again next time
+            metrics.run('validate', validate_frames, current, rows_in=sum(len(df) for df in current.values()))
+
+            with metrics.stage('delta', rows_in=sum(len(df) for df in current.values())) as record:
+                deltas = {name: compute_delta(self.snapshots[name], df, SOURCES[name]['key'])
+                          for name, df in current.items()}
+                record['rows_out'] = sum(len(delta['upserts']) for delta in deltas.values())
+
+            self.connect()
+            for name, delta in deltas.items():
+                self._load(name, delta, metrics)
+
+            frames = {name: current[name] if name in current else self.snapshots[name].drop(columns='_row_hash')
+                      for name in SOURCES}
+            with metrics.stage('compare_and_output', rows_in=sum(len(df) for df in frames.values())) as record:
+                outputs = compare_and_output(frames['upstox'], frames['dhan'], formats=self.output_formats,
+                                             reconciler=self.engine.reconcile,
+                                             name_candidates=self.engine.name_candidates)
+                record['rows_out'] = sum(len(df) for df in outputs.values())
+            metrics.run('load_reconciled', upsert_reconciled, self._conn, outputs,
+                        rows_in=sum(len(df) for df in outputs.values()))
+            with metrics.stage('history', rows_in=sum(len(df) for df in outputs.values())) as record:
+                record['rows_out'] = record_history(self._conn, outputs)['opened']
+
+            # Logged once the loads succeeded, so a failed refresh is not logged again when retried
+            write_changelog(deltas)
+            for name, df in current.items():
+                self.snapshots[name] = save_snapshot(name, df)
+            save_symbol_memo(self.symbol_memo)
+            record_run(hashes)
+            self.hashes = hashes
+        except Exception:
+            metrics.finish('failed')
+            # Reconnect on the next refresh in case a connection was the problem
+            self.close()
+            raise
+        print(f"Refresh done; run report written to {metrics.finish('success')}")
+        return changed
+
+    def run(self, once=False):
+        """Refresh every poll_seconds until stop() is called (or once).
+
+        A failed refresh is reported and retried at the next poll; the
+        daemon itself keeps running.
+        """
+        print(f"NSE ETL daemon started; polling every {self.poll_seconds:g}s.")
+        try:
+            while not self.stopped.is_set():
+                started = time.monotonic()
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Refresh failed: {e}")
+                    if once:
+                        raise
+                if once:
+                    break
+                # Polls start on a fixed cadence however long the refresh took
+                self.stopped.wait(max(0, self.poll_seconds - (time.monotonic() - started)))
+        finally:
+            self.close()
+        print("NSE ETL daemon stopped.")
+
+    def stop(self, *_):
+        """Stop after the refresh in progress, if any; usable as a signal handler."""
+        self.stopped.set()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the NSE ETL pipeline running, refreshing when a source changes.")
+    parser.add_argument('--interval', type=float, default=POLL_SECONDS,
+                        help="seconds between polls (default: DAEMON_POLL_SECONDS or 300)")
+    parser.add_argument('--once', action='store_true', help="refresh once and exit")
+    parser.add_argument('--formats', nargs='+', default=['csv'], help="output formats (csv, parquet, feather)")
+    parser.add_argument('--engine', choices=['pandas', 'polars'], help="dataframe engine (default: ETL_ENGINE)")
+    args = parser.parse_args()
+    daemon = Daemon(args.interval, args.formats, args.engine)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run(once=args.once)
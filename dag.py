@@ -0,0 +1,315 @@
+import argparse
+import hashlib
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+
+import pandas as pd
+
+from extract import extract_upstox_data, extract_dhan_data, UPSTOX_URL, DHAN_URL
+from transform import load_symbol_memo, save_symbol_memo
+from load import load_to_mongodb, load_to_sql, load_reconciled
+from compare import compare_and_output
+from cache import fetch_source
+from delta import load_snapshot, save_snapshot, compute_delta, write_changelog
+from history import load_history
+from validate import validate_frames
+from metrics import RunMetrics
+from engines import get_engine, DEFAULT_ENGINE
+
+# Checkpoints of intermediate frames and completion markers of sink stages
+CHECKPOINT_DIR = os.path.join('cache', 'checkpoints')
+# Bump when a stage's output for the same inputs changes, to invalidate checkpoints
+CHECKPOINT_VERSION = 1
+
+# A node of the stage graph.
+#   kind   - 'source': func() returns (value, content hash) and always runs
+#            'frame':  func(*inputs) returns a DataFrame (or a dict of them), checkpointed as a pickle
+#            'sink':   func(*inputs) has side effects and returns a JSON-able summary
+#            'task':   func(*inputs) always runs and records its own metrics; its value is
+#                      never checkpointed (e.g. a streaming producer, which times every batch)
+#   inputs - names of the stages whose values are passed to func, in order
+#   params - settings that change the output, folded into the checkpoint key
+Stage = namedtuple('Stage', ['name', 'kind', 'func', 'inputs', 'params'])
+
+def stage_key(stage, input_keys):
+    """Hash a stage's name, params and input keys into its checkpoint key.
+
+    Input keys chain back to the source content hashes, so a key changes
+    exactly when something upstream of the stage changed.
+    """
+    payload = json.dumps([CHECKPOINT_VERSION, stage.name, stage.params, input_keys], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:20]
+
+def downstream(stages, name):
+    """Return `name` and every stage that depends on it, directly or not."""
+    found = {name}
+    changed = True
+    while changed:
+        changed = False
+        for stage in stages:
+            if stage.name not in found and found.intersection(stage.inputs):
+                found.add(stage.name)
+                changed = True
+    return found
+
+class CheckpointStore:
+    """Content-addressed stage checkpoints in one directory.
+
+    Frames are stored as <stage>-<key>.pkl and sink completions as
+    <stage>-<key>.json; only the latest key of each stage is kept. The last
+    result of each source is remembered in <stage>.latest.json so a resumed
+    run can skip the download.
+    """
+
+    def __init__(self, checkpoint_dir=CHECKPOINT_DIR):
+        self.checkpoint_dir = checkpoint_dir
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def _path(self, name, key, ext):
+        return os.path.join(self.checkpoint_dir, f"{name}-{key}{ext}")
+
+    def _replace(self, name, key, ext, write):
+        path = self._path(name, key, ext)
+        write(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        # Older checkpoints of this stage can no longer be asked for by key
+        for entry in os.listdir(self.checkpoint_dir):
+            if entry.startswith(f"{name}-") and entry.endswith(ext) and entry != os.path.basename(path):
+                os.remove(os.path.join(self.checkpoint_dir, entry))
+
+    def load(self, stage, key):
+        """Return (True, result) if stage has a checkpoint for key, else (False, None)."""
+        if stage.kind == 'frame':
+            path = self._path(stage.name, key, '.pkl')
+            return (True, pd.read_pickle(path)) if os.path.exists(path) else (False, None)
+        path = self._path(stage.name, key, '.json')
+        if not os.path.exists(path):
+            return False, None
+        with open(path) as f:
+            return True, json.load(f)
+
+    def save(self, stage, key, result):
+        if stage.kind == 'frame':
+            self._replace(stage.name, key, '.pkl', partial(pd.to_pickle, result))
+        else:
+            self._replace(stage.name, key, '.json', partial(_write_json, result))
+
+    def load_source(self, name):
+        """Return the last (value, content hash) recorded for source `name`, or None."""
+        path = os.path.join(self.checkpoint_dir, f"{name}.latest.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return tuple(json.load(f))
+
+    def save_source(self, name, result):
+        _write_json(list(result), os.path.join(self.checkpoint_dir, f"{name}.latest.json"))
+
+def _write_json(data, path):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, default=int)
+
+def _rows(value):
+    """Rows of a DataFrame or of the DataFrames in a dict, None for anything else."""
+    if hasattr(value, 'columns'):
+        return len(value)
+    if isinstance(value, dict) and any(hasattr(df, 'columns') for df in value.values()):
+        return sum(len(df) for df in value.values() if hasattr(df, 'columns'))
+    return None
+
+def run_stage(stage, inputs, input_keys, store, forced, metrics):
+    """Run or restore one stage; return (value passed downstream, key).
+
+    The key is None when the value is not checkpointed (a task, no store,
+    or an input without a key), so nothing downstream of it is either.
+    """
+    if stage.kind == 'task':
+        return stage.func(*inputs), None
+    rows_in = [rows for rows in map(_rows, inputs) if rows is not None]
+    with metrics.stage(stage.name, rows_in=sum(rows_in) if rows_in else None) as record:
+        if stage.kind == 'source':
+            result = None if store is None or stage.name in forced else store.load_source(stage.name)
+            record['checkpoint'] = 'fetched' if result is None else 'hit'
+            if result is None:
+                result = stage.func()
+                if store is not None:
+                    store.save_source(stage.name, result)
+            value, key = result
+            return value, key
+
+        key = None if store is None or None in input_keys else stage_key(stage, input_keys)
+        found, result = (False, None) if key is None or stage.name in forced else store.load(stage, key)
+        if key is None:
+            record['checkpoint'] = 'off'
+        else:
+            record['checkpoint'] = 'hit' if found else ('forced' if stage.name in forced else 'miss')
+        if found:
+            print(f"{stage.name}: reusing checkpoint {key}.")
+        else:
+            result = stage.func(*inputs)
+            if key is not None:
+                store.save(stage, key, result)
+        if _rows(result) is not None:
+            record['rows_out'] = _rows(result)
+        elif isinstance(result, dict) and not found:
+            record['db_round_trips'] = result.get('round_trips', 0)
+        return result, key
+
+def run_graph(stages, start_from=None, checkpoint_dir=CHECKPOINT_DIR, max_workers=4, metrics=None, given=None):
+    """Run a stage graph, reusing checkpoints and running independent stages concurrently.
+
+    Sources always run (a conditional fetch is cheap) and every other stage
+    is restored from its checkpoint when its inputs are unchanged. With
+    start_from, that stage and everything downstream of it are re-run,
+    and sources upstream of it reuse their last fetched copy. With
+    checkpoint_dir=None nothing is checkpointed and every stage runs, as
+    in the one-shot runners. `given` maps names to (value, key) pairs
+    computed outside the graph, e.g. sources fetched beforehand, which
+    stages may take as inputs. When a stage fails, the stages already
+    running finish, no new one starts and its exception is raised.
+    Returns {stage name: value}.
+    """
+    given = given or {}
+    names = [stage.name for stage in stages]
+    if start_from is not None and start_from not in names:
+        raise ValueError(f"Unknown stage {start_from!r}. Choose from {names}.")
+    forced = downstream(stages, start_from) if start_from else {s.name for s in stages if s.kind == 'source'}
+    store = None if checkpoint_dir is None else CheckpointStore(checkpoint_dir)
+    metrics = metrics or RunMetrics('dag')
+
+    values = {name: value for name, (value, _) in given.items()}
+    keys = {name: key for name, (_, key) in given.items()}
+    pending = list(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for stage in [s for s in pending if all(name in values for name in s.inputs)]:
+                pending.remove(stage)
+                running[pool.submit(run_stage, stage, [values[name] for name in stage.inputs],
+                                    [keys[name] for name in stage.inputs], store, forced, metrics)] = stage
+            if not running:
+                missing = {name for stage in pending for name in stage.inputs} - set(names) - set(given)
+                raise ValueError(f"Stages depend on undefined stages: {sorted(missing)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    values[stage.name], keys[stage.name] = future.result()
+                except Exception:
+                    # Let the stages already running finish, start nothing new
+                    pending.clear()
+                    raise
+    return values
+
+def _compute_deltas(upstox_df, dhan_df, report):
+    return {'upstox': compute_delta(load_snapshot('upstox'), upstox_df, 'instrument_key'),
+            'dhan': compute_delta(load_snapshot('dhan'), dhan_df, 'security_id')}
+
+def _load_mongodb_delta(deltas):
+    delta = deltas['upstox']
+    # Without a previous snapshot, fall back to a full load. Otherwise every
+    # upsert is known to have changed, so the stored hashes are not read.
+    return load_to_mongodb(delta['upserts'], deleted_keys=None if delta['initial'] else delta['removed_keys'],
+                           skip_unchanged=delta['initial'])
+
+def _load_sql_delta(deltas):
+    delta = deltas['dhan']
+    return load_to_sql(delta['upserts'], deleted_keys=None if delta['initial'] else delta['removed_keys'])
+
+def _log_changes(deltas, upstox_df, dhan_df, mongodb_stats, sql_stats):
+    # Logged once the loads succeeded, so a failed run is not logged again when retried
+    write_changelog(deltas)
+    save_snapshot('upstox', upstox_df)
+    save_snapshot('dhan', dhan_df)
+    return {source: len(delta['log']) for source, delta in deltas.items()}
+
+def nse_stages(stream=False, output_formats=('csv',), symbol_memo=None, engine=None, delta=False, scan=False):
+    """Return the stage graph of the NSE ETL pipeline.
+
+    fetch -> extract -> transform per source, then validate both frames;
+    once they pass, the MongoDB load, the SQLite load and compare run as
+    independent branches. The reconciled tables are loaded after the
+    SQLite load, and the history is recorded from them last. engine names
+    the dataframe engine (default: ETL_ENGINE; see engines.py); with
+    scan=True its transforms read the fetched files themselves and there
+    are no extract stages. With delta=True the loads only get the rows
+    changed since the last snapshot, and a changelog stage appends the
+    changes and saves the snapshots once both loads succeeded.
+    """
+    engine_name = engine or DEFAULT_ENGINE
+    engine = get_engine(engine_name)
+    stages = [
+        Stage('fetch_upstox', 'source', partial(fetch_source, UPSTOX_URL, 'upstox_nse.csv.gz'), [], {}),
+        Stage('fetch_dhan', 'source', partial(fetch_source, DHAN_URL, 'dhan_scrip.csv'), [], {}),
+    ]
+    if not scan:
+        stages += [
+            Stage('extract_upstox', 'frame', lambda path: extract_upstox_data(stream=stream, path=path),
+                  ['fetch_upstox'], {'stream': stream}),
+            Stage('extract_dhan', 'frame', lambda path: extract_dhan_data(stream=stream, path=path),
+                  ['fetch_dhan'], {'stream': stream}),
+        ]
+    stages += [
+        Stage('transform_upstox', 'frame', partial(engine.transform_upstox, symbol_memo=symbol_memo),
+              ['fetch_upstox' if scan else 'extract_upstox'], {'engine': engine_name}),
+        Stage('transform_dhan', 'frame', partial(engine.transform_dhan, symbol_memo=symbol_memo),
+              ['fetch_dhan' if scan else 'extract_dhan'], {'engine': engine_name}),
+        Stage('validate', 'sink', lambda upstox_df, dhan_df: validate_frames({'upstox': upstox_df, 'dhan': dhan_df}),
+              ['transform_upstox', 'transform_dhan'], {}),
+    ]
+    if delta:
+        stages += [
+            Stage('delta', 'frame', _compute_deltas, ['transform_upstox', 'transform_dhan', 'validate'], {}),
+            Stage('load_mongodb', 'sink', _load_mongodb_delta, ['delta'], {}),
+            Stage('load_sql', 'sink', _load_sql_delta, ['delta'], {}),
+            Stage('changelog', 'sink', _log_changes,
+                  ['delta', 'transform_upstox', 'transform_dhan', 'load_mongodb', 'load_sql'], {}),
+        ]
+    else:
+        stages += [
+            Stage('load_mongodb', 'sink', lambda df, report: load_to_mongodb(df), ['transform_upstox', 'validate'], {}),
+            Stage('load_sql', 'sink', lambda df, report: load_to_sql(df), ['transform_dhan', 'validate'], {}),
+        ]
+    return stages + [
+        Stage('compare', 'frame',
+              lambda upstox_df, dhan_df, report: compare_and_output(
+                  upstox_df, dhan_df, formats=output_formats, reconciler=engine.reconcile,
+                  name_candidates=engine.name_candidates),
+              ['transform_upstox', 'transform_dhan', 'validate'],
+              {'formats': list(output_formats), 'engine': engine_name}),
+        Stage('load_reconciled', 'sink', lambda frames, stats: load_reconciled(frames), ['compare', 'load_sql'], {}),
+        Stage('history', 'sink', lambda frames, stats: load_history(frames), ['compare', 'load_reconciled'], {}),
+    ]
+
+def run_nse_graph(start_from=None, stream=False, output_formats=('csv',), max_workers=4, profile=False,
+                  checkpoint_dir=CHECKPOINT_DIR, engine=None):
+    """Run the NSE ETL pipeline as a stage graph; see run_graph."""
+    metrics = RunMetrics('dag', profile=profile)
+    symbol_memo = load_symbol_memo()
+    try:
+        values = run_graph(nse_stages(stream, output_formats, symbol_memo, engine), start_from=start_from,
+                           checkpoint_dir=checkpoint_dir, max_workers=max_workers, metrics=metrics)
+    except Exception as e:
+        print(f"Pipeline failed: {e}")
+        metrics.finish('failed')
+        raise
+    save_symbol_memo(symbol_memo)
+    print("NSE ETL pipeline completed successfully!")
+    print(f"Run report written to {metrics.finish('success')}")
+    return values
+
+if __name__ == "__main__":
+    stage_names = [stage.name for stage in nse_stages()]
+    parser = argparse.ArgumentParser(description="Run the NSE ETL pipeline as a checkpointed stage graph.")
+    parser.add_argument('--from', dest='start_from', choices=stage_names,
+                        help="re-run this stage and everything downstream of it, reusing earlier checkpoints")
+    parser.add_argument('--stream', action='store_true', help="filter sources while downloading")
+    parser.add_argument('--formats', nargs='+', default=['csv'], help="output formats (csv, parquet, feather)")
+    parser.add_argument('--workers', type=int, default=4, help="stages run concurrently")
+    parser.add_argument('--profile', action='store_true', help="dump a cProfile file per stage")
+    parser.add_argument('--engine', choices=['pandas', 'polars'], help="dataframe engine (default: ETL_ENGINE)")
+    args = parser.parse_args()
+    run_nse_graph(args.start_from, args.stream, args.formats, args.workers, args.profile, engine=args.engine)
@@ -0,0 +1,87 @@
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from load import content_hashes
+
+# Previous run's normalized frames, one pickle per source
+SNAPSHOT_DIR = os.path.join('cache', 'snapshots')
+CHANGELOG_PATH = os.path.join('output', 'changelog.csv')
+
+def load_snapshot(name, snapshot_dir=SNAPSHOT_DIR):
+    """Return the last saved snapshot for source `name`, or None."""
+    path = os.path.join(snapshot_dir, f"{name}.pkl")
+    if not os.path.exists(path):
+        return None
+    return pd.read_pickle(path)
+
+def save_snapshot(name, df, snapshot_dir=SNAPSHOT_DIR):
+    """Save df with its per-row hashes as the snapshot for source `name`; return the snapshot."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = os.path.join(snapshot_dir, f"{name}.pkl")
+    snapshot = df.reset_index(drop=True)
+    snapshot['_row_hash'] = content_hashes(df)
+    snapshot.to_pickle(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return snapshot
+
+def compute_delta(previous, current, key):
+    """Diff current against the previous snapshot on `key`.
+
+    Rows are compared by content hash in a single outer merge. Returns a
+    dict with the added and modified rows of current ('upserts'), the keys
+    of removed rows ('removed_keys'), a change log frame ('log') and
+    whether there was no snapshot to compare against ('initial').
+    """
+    current = current.reset_index(drop=True)
+    if previous is None:
+        log = pd.DataFrame({'change': 'added', 'key': current[key],
+                            'trading_symbol': current['trading_symbol'], 'previous_trading_symbol': None})
+        return {'upserts': current, 'removed_keys': [], 'log': log, 'initial': True}
+
+    # Keys are compared as strings so int/str drift between runs is not a change
+    cur = pd.DataFrame({'key': current[key].astype(str), '_row_hash': content_hashes(current),
+                        'trading_symbol': current['trading_symbol'], 'position': current.index})
+    prev = pd.DataFrame({'key': previous[key].astype(str), '_row_hash': previous['_row_hash'].values,
+                         'trading_symbol': previous['trading_symbol'], 'prev_key': previous[key]})
+    merged = cur.merge(prev, on='key', how='outer', suffixes=('', '_prev'), indicator=True)
+
+    added = merged['_merge'] == 'left_only'
+    removed = merged['_merge'] == 'right_only'
+    modified = (merged['_merge'] == 'both') & (merged['_row_hash'] != merged['_row_hash_prev'])
+
+    change = pd.Series(None, index=merged.index, dtype=object)
+    change[added] = 'added'
+    change[removed] = 'removed'
+    change[modified] = 'modified'
+    changed = merged[added | removed | modified]
+    log = pd.DataFrame({
+        'change': change[changed.index],
+        'key': changed['key'],
+        'trading_symbol': changed['trading_symbol'],
+        'previous_trading_symbol': changed['trading_symbol_prev'],
+    }).reset_index(drop=True)
+
+    upsert_positions = merged.loc[added | modified, 'position'].astype(int)
+    return {
+        'upserts': current.loc[upsert_positions.sort_values()],
+        'removed_keys': merged.loc[removed, 'prev_key'].tolist(),
+        'log': log,
+        'initial': False,
+    }
+
+def write_changelog(deltas, path=CHANGELOG_PATH):
+    """Append the change logs of {source: delta} to the change log CSV."""
+    run_at = datetime.now().isoformat(timespec='seconds')
+    logs = [delta['log'].assign(run_at=run_at, source=source) for source, delta in deltas.items()]
+    log = pd.concat(logs, ignore_index=True)[
+        ['run_at', 'source', 'change', 'key', 'trading_symbol', 'previous_trading_symbol']]
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    log.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+    for source, delta in deltas.items():
+        counts = delta['log']['change'].value_counts()
+        print(f"{source} delta: {counts.get('added', 0)} added, {counts.get('modified', 0)} modified, "
+              f"{counts.get('removed', 0)} removed.")
+    return log
@@ -0,0 +1,65 @@
+import logging
+import sys
+
+from decouple import config
+
+# Diagnostics level -> logging level. Warnings about the data are logged at
+# every level; 'summary' adds shapes and counts, 'debug' adds column dumps,
+# unique values and sample rows.
+LEVELS = {
+    'off': logging.WARNING,
+    'summary': logging.INFO,
+    'debug': logging.DEBUG,
+}
+DEFAULT_LEVEL = config('ETL_DIAGNOSTICS', default='summary')
+
+class _StdoutHandler(logging.StreamHandler):
+    """Write to the current sys.stdout, like print, so redirect_stdout applies."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+logger = logging.getLogger('nse_etl.diagnostics')
+# Diagnostics go to stdout alongside the pipeline's progress output
+_handler = _StdoutHandler()
+_handler.setFormatter(logging.Formatter('%(message)s'))
+logger.addHandler(_handler)
+logger.propagate = False
+
+def set_level(level):
+    """Set the diagnostics level: 'off', 'summary' or 'debug'."""
+    if level not in LEVELS:
+        raise ValueError(f"Unknown diagnostics level {level!r}. Choose from {sorted(LEVELS)}.")
+    logger.setLevel(LEVELS[level])
+
+def enabled(level):
+    """Whether diagnostics at `level` ('summary' or 'debug') are being emitted.
+
+    Guard any check that costs more than a counter with this.
+    """
+    return logger.isEnabledFor(LEVELS[level])
+
+class lazy:
+    """Log argument computed by func() only if the message is actually emitted."""
+
+    def __init__(self, func):
+        self.func = func
+
+    def __str__(self):
+        return str(self.func())
+
+def warning(msg, *args):
+    logger.warning(msg, *args)
+
+def summary(msg, *args):
+    logger.info(msg, *args)
+
+def debug(msg, *args):
+    logger.debug(msg, *args)
+
+set_level(DEFAULT_LEVEL)
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import requests
+from decouple import config
+
+from metrics import record_bytes_downloaded
+
+# Partial downloads kept for resuming, named after their URL
+DOWNLOAD_DIR = os.path.join('cache', 'downloads')
+# (connect, read) timeouts in seconds; the read timeout is per socket read, so a
+# slow but live transfer is never cut off while a hung one fails fast
+CONNECT_TIMEOUT = config('DOWNLOAD_CONNECT_TIMEOUT', default=10, cast=float)
+READ_TIMEOUT = config('DOWNLOAD_READ_TIMEOUT', default=60, cast=float)
+# Attempts per download and the exponential backoff between them
+MAX_ATTEMPTS = config('DOWNLOAD_MAX_ATTEMPTS', default=5, cast=int)
+BACKOFF_SECONDS = config('DOWNLOAD_BACKOFF_SECONDS', default=1, cast=float)
+MAX_BACKOFF_SECONDS = 30
+# Connections kept alive per host
+POOL_SIZE = 8
+CHUNK_SIZE = 1 << 16
+# Statuses worth retrying; other HTTP errors fail at once
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Result of a download.
+#   status        - 200 (downloaded) or 304 (not modified, nothing written)
+#   size, sha256  - of the complete file
+#   etag, last_modified - the response's validators, for conditional requests
+#   attempts      - requests made, including failed ones
+#   resumed_bytes - bytes kept from earlier attempts instead of being downloaded again
+DownloadResult = namedtuple('DownloadResult', ['path', 'status', 'size', 'sha256', 'etag', 'last_modified',
+                                               'attempts', 'resumed_bytes'])
+
+class IntegrityError(Exception):
+    """A downloaded file does not have the expected size or SHA-256."""
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Return the process-wide keep-alive session, creating it on first use.
+
+    Requests identity encoding, so byte ranges and sizes refer to the bytes
+    stored on disk.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['Accept-Encoding'] = 'identity'
+            _session = session
+        return _session
+
+def backoff_delay(attempt, base=BACKOFF_SECONDS):
+    """Seconds to wait before retry `attempt` (1-based): exponential with full jitter."""
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, base * 2 ** (attempt - 1)))
+
+def _part_paths(path):
+    return path + '.part', path + '.part.json'
+
+def _load_part(path, url):
+    """Return (bytes on disk, validator) of a resumable partial download of url at path."""
+    part_path, state_path = _part_paths(path)
+    if not (os.path.exists(part_path) and os.path.exists(state_path)):
+        return 0, None
+    with open(state_path) as f:
+        state = json.load(f)
+    if state.get('url') != url or not state.get('validator'):
+        return 0, None
+    return os.path.getsize(part_path), state['validator']
+
+def _save_part_state(path, url, validator):
+    with open(_part_paths(path)[1], 'w') as f:
+        json.dump({'url': url, 'validator': validator, 'updated_at': datetime.now().isoformat(timespec='seconds')}, f)
+
+def _discard_part(path):
+    for part in _part_paths(path):
+        if os.path.exists(part):
+            os.remove(part)
+
+def file_sha256(path):
+    """Return the hex SHA-256 of the file at path."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def _expected_total(response):
+    """Total size of the file announced by a 200 or 206 response, or None."""
+    if response.status_code == 206:
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+def _attempt(session, url, path, headers, timeout):
+    """Make one request for url, appending to or restarting the partial file.
+
+    Returns (status, response headers, bytes resumed). Raises on transport
+    errors and bad statuses; the partial file is kept for the next attempt.
+    """
+    offset, validator = _load_part(path, url)
+    request_headers = dict(headers)
+    if offset:
+        request_headers['Range'] = f"bytes={offset}-"
+        # The server ignores the range and sends the whole file if it changed meanwhile
+        request_headers['If-Range'] = validator
+
+    with session.get(url, headers=request_headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304:
+            return 304, response.headers, 0
+        if response.status_code == 416 and offset:
+            # The range starts at the end of the file: the previous attempt had in fact finished
+            if response.headers.get('Content-Range') == f"bytes */{offset}":
+                return 200, response.headers, offset
+            # The file shrank or changed: start the next attempt from the first byte
+            _discard_part(path)
+            raise requests.ConnectionError(f"Server rejected the range request for {url}; restarting the download.")
+        response.raise_for_status()
+
+        resumed = response.status_code == 206
+        if resumed and not response.headers.get('Content-Range', '').startswith(f"bytes {offset}-"):
+            _discard_part(path)
+            raise requests.ConnectionError(f"Server answered the range request for {url} with the wrong range.")
+        if not resumed:
+            offset = 0
+        total = _expected_total(response)
+
+        # If-Range takes either validator; without one a partial file cannot be resumed safely
+        validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        if validator:
+            _save_part_state(path, url, validator)
+        elif os.path.exists(_part_paths(path)[1]):
+            os.remove(_part_paths(path)[1])
+        part_path = _part_paths(path)[0]
+        with open(part_path, 'ab' if resumed else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                record_bytes_downloaded(len(chunk))
+        size = os.path.getsize(part_path)
+        if total is not None and size != total:
+            raise requests.ConnectionError(f"Download of {url} ended at {size} of {total} bytes.")
+        return 200, response.headers, offset
+
+def download(url, path, headers=None, expected_size=None, expected_sha256=None, session=None,
+             max_attempts=MAX_ATTEMPTS, timeout=None, backoff_seconds=BACKOFF_SECONDS):
+    """Download url to path, resuming interrupted transfers, and verify it.
+
+    The body is written to <path>.part; a failed attempt (connection error,
+    timeout, truncated body or a retryable status) is retried with
+    exponential backoff, asking for the missing bytes with an HTTP Range
+    request guarded by If-Range. Partial files survive across runs, so a
+    rerun continues where the last one stopped. The file is checked against
+    the announced size and against expected_size/expected_sha256, if given,
+    before it replaces path; a file failing the checks is discarded and
+    downloaded again. `headers` may carry If-None-Match/If-Modified-Since,
+    in which case a 304 answer returns status 304 and leaves path alone.
+    """
+    session = session or get_session()
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            status, response_headers, resumed_bytes = _attempt(session, url, path, headers or {}, timeout)
+            if status == 304:
+                return DownloadResult(path, 304, None, None, response_headers.get('ETag'),
+                                      response_headers.get('Last-Modified'), attempts, 0)
+            part_path = _part_paths(path)[0]
+            size = os.path.getsize(part_path)
+            sha256 = file_sha256(part_path)
+            if expected_size is not None and size != expected_size:
+                _discard_part(path)
+                raise IntegrityError(f"{url}: expected {expected_size} bytes, got {size}.")
+            if expected_sha256 is not None and sha256 != expected_sha256:
+                _discard_part(path)
+                raise IntegrityError(f"{url}: expected sha256 {expected_sha256}, got {sha256}.")
+            os.replace(part_path, path)
+            _discard_part(path)
+            return DownloadResult(path, 200, size, sha256, response_headers.get('ETag'),
+                                  response_headers.get('Last-Modified'), attempts, resumed_bytes)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                IntegrityError, requests.HTTPError) as e:
+            retryable = not isinstance(e, requests.HTTPError) or e.response.status_code in RETRY_STATUSES
+            if not retryable or attempts >= max_attempts:
+                print(f"Error downloading {url} (attempt {attempts}): {e}")
+                raise
+            delay = backoff_delay(attempts, backoff_seconds)
+            print(f"Download of {url} failed (attempt {attempts}: {e}); retrying in {delay:.1f}s.")
+            time.sleep(delay)
+
+def download_path(url, download_dir=DOWNLOAD_DIR):
+    """Return the stable local path downloads of url are kept under."""
+    name = hashlib.sha1(url.encode()).hexdigest()[:16]
+    return os.path.join(download_dir, f"{name}-{os.path.basename(url.split('?')[0]) or 'download'}")
+
+def download_bytes(url, **kwargs):
+    """Download url with download() and return its content.
+
+    The transfer goes through a stable path under DOWNLOAD_DIR, so an
+    interrupted download is resumed by the next call for the same URL.
+    """
+    path = download_path(url)
+    download(url, path, **kwargs)
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(path)
@@ -0,0 +1,237 @@
+import importlib.util
+from collections import namedtuple
+
+import pandas as pd
+from decouple import config
+
+import diagnostics
+from transform import (transform_upstox_data, transform_dhan_data, drop_invalid_symbols, SYMBOL_SUFFIX_PATTERN,
+                       SYMBOL_INVALID_CHARS_PATTERN, INSTRUMENT_KEY_ISIN_PATTERN)
+from compare import (reconcile, name_match_candidates, MATCH_TIERS, OUTPUT_COLUMNS, UPSTOX_FIELDS, DHAN_FIELDS,
+                     NAME_STOPWORDS, NAME_SEPARATOR_PATTERN, NAME_BLOCK_MAX_ROWS, NAME_MATCH_THRESHOLD,
+                     SHARE_CLASS_TOKENS, CANDIDATE_COLUMNS)
+from schemas import UPSTOX_SCHEMA, DHAN_SCHEMA
+
+# polars takes longer to import than everything else but pandas, so it is
+# only imported once the Polars engine is actually used
+HAS_POLARS = importlib.util.find_spec('polars') is not None
+pl = None
+
+# The transform, reconcile and name matching functions of a dataframe engine. All of them
+# take and return pandas frames, so loaders and sinks work with any engine.
+# reads_paths - the transforms also accept a source CSV path and read it
+#               as part of their query plan
+Engine = namedtuple('Engine', ['transform_upstox', 'transform_dhan', 'reconcile', 'name_candidates', 'reads_paths'])
+
+DEFAULT_ENGINE = config('ETL_ENGINE', default='pandas')
+
+def _require_polars():
+    """Import polars on first use; raise a helpful error when it is not installed."""
+    global pl
+    if not HAS_POLARS:
+        raise ImportError("polars is required for the polars engine (pip install polars).")
+    if pl is None:
+        import polars
+        pl = polars
+
+def _lazy_source(source, schema):
+    """Return a LazyFrame over a pandas frame or a CSV path (optionally gzipped).
+
+    Scanning a path lets Polars push the column projection and row filter
+    down into the CSV reader.
+    """
+    if isinstance(source, pd.DataFrame):
+        return pl.from_pandas(source).lazy()
+    columns = pl.scan_csv(source, infer_schema=False).collect_schema().names()
+    wanted = [col for col in schema['usecols'] if col in columns]
+    return pl.scan_csv(source, infer_schema=False).select(wanted)
+
+def _string(column):
+    return pl.col(column).cast(pl.String)
+
+def _normalized_symbol(column):
+    """Expression form of transform.normalize_trading_symbols; empty results become null."""
+    symbol = (_string(column).str.strip_chars().str.to_uppercase()
+              .str.replace(SYMBOL_SUFFIX_PATTERN, '')
+              .str.replace_all(SYMBOL_INVALID_CHARS_PATTERN, ''))
+    return pl.when(symbol != '').then(symbol)
+
+def _null(name):
+    return pl.lit(None, dtype=pl.String).alias(name)
+
+def upstox_equity_expr():
+    """Expression form of transform.upstox_equity_mask."""
+    _require_polars()
+    return (_string('exchange').str.contains('(?i)NSE').fill_null(False)
+            & _string('instrument_type').str.contains('(?i)(EQ|EQUITY|STOCK|SHARE)').fill_null(False))
+
+def dhan_equity_expr():
+    """Expression form of transform.dhan_equity_mask."""
+    _require_polars()
+    return ((_string('SEM_EXM_EXCH_ID') == 'NSE') & (_string('SEM_INSTRUMENT_NAME') == 'EQUITY')).fill_null(False)
+
+def _collect_valid_symbols(plan, source):
+    """Collect the plan and drop null and repeated trading symbols; returns a pandas frame.
+
+    The symbols are checked by transform.drop_invalid_symbols, so both
+    engines report the same diagnostics and keep the same rows.
+    """
+    df = drop_invalid_symbols(plan.select(OUTPUT_COLUMNS).collect().to_pandas(), source).reset_index(drop=True)
+    diagnostics.summary("Final %s transformed DataFrame shape: %s", source, df.shape)
+    return df
+
+def polars_transform_upstox(source, symbol_memo=None, mask=None):
+    """Polars version of transform.transform_upstox_data.
+
+    `source` is an extracted frame or the path of the Upstox CSV. Filter,
+    projection, symbol normalization, ISIN extraction and deduplication
+    run as one lazy query plan. `mask` is a Polars expression (default:
+    NSE Equity); symbol_memo is accepted for interface parity and unused.
+    """
+    _require_polars()
+    symbol = _normalized_symbol('tradingsymbol')
+    plan = _lazy_source(source, UPSTOX_SCHEMA).filter(upstox_equity_expr() if mask is None else mask).select(
+        _string('exchange').alias('exchange'),
+        _string('instrument_key').alias('instrument_key'),
+        symbol.alias('symbol_name'),
+        _null('security_id'),
+        _null('short_name'),
+        _string('name').alias('name'),
+        _string('instrument_key').str.extract(INSTRUMENT_KEY_ISIN_PATTERN, 1).alias('isin'),
+        symbol.alias('trading_symbol'),
+    )
+    return _collect_valid_symbols(plan, 'Upstox')
+
+def polars_transform_dhan(source, symbol_memo=None, mask=None):
+    """Polars version of transform.transform_dhan_data; see polars_transform_upstox.
+
+    security_id is Int64 in both engines, also when read from a path or a
+    frame of strings; ids that are not numbers become missing.
+    """
+    _require_polars()
+    lazy = _lazy_source(source, DHAN_SCHEMA)
+    isin = _string('ISIN') if 'ISIN' in lazy.collect_schema().names() else pl.lit(None, dtype=pl.String)
+    plan = lazy.filter(dhan_equity_expr() if mask is None else mask).select(
+        _string('SEM_EXM_EXCH_ID').alias('exchange'),
+        _null('instrument_key'),
+        _string('SM_SYMBOL_NAME').alias('symbol_name'),
+        pl.col('SEM_SMST_SECURITY_ID').cast(pl.Int64, strict=False).alias('security_id'),
+        _null('short_name'),
+        _null('name'),
+        isin.alias('isin'),
+        _normalized_symbol('SEM_TRADING_SYMBOL').alias('trading_symbol'),
+    )
+    df = _collect_valid_symbols(plan, 'Dhan')
+    # Nullable like transform_dhan_data's, which to_pandas only gives when a value is missing
+    df['security_id'] = df['security_id'].astype('Int64')
+    return df
+
+def _unique_key_pairs(upstox, dhan, column):
+    """Polars version of compare.unique_key_pairs over the row-numbered frames."""
+    def keys(df, row):
+        key = pl.col('_key')
+        return df.select(row, _string(column).alias('_key')).filter(key.is_not_null() & key.is_unique())
+    return keys(upstox, '_upstox_row').join(keys(dhan, '_dhan_row'), on='_key').select('_upstox_row', '_dhan_row')
+
+def _name_tokens(df, row, column):
+    """Polars version of compare.name_tokens."""
+    return (df.select(pl.col(row), _string(column).fill_null('').str.to_uppercase()
+                                   .str.replace_all(NAME_SEPARATOR_PATTERN, ' ').str.split(' ').alias('token'))
+              .explode('token')
+              .filter((pl.col('token').str.len_chars() > 1) & ~pl.col('token').is_in(list(NAME_STOPWORDS)))
+              .unique())
+
+def _share_classes(tokens, row):
+    """Polars version of compare.share_classes."""
+    return (tokens.filter(pl.col('token').is_in(list(SHARE_CLASS_TOKENS)))
+                  .group_by(row).agg(pl.col('token').sort().str.join(' ').alias(f"{row}_class")))
+
+def _name_match_pairs(upstox, dhan):
+    """Polars version of compare.name_match_pairs over the row-numbered frames."""
+    left = _name_tokens(upstox, '_upstox_row', 'name')
+    right = _name_tokens(dhan, '_dhan_row', 'symbol_name')
+
+    def blockable(tokens):
+        counts = tokens.group_by('token').len()
+        return counts.filter(pl.col('len') <= NAME_BLOCK_MAX_ROWS).select('token')
+
+    blocks = blockable(left).join(blockable(right), on='token')
+    candidates = (left.join(blocks, on='token').join(right.join(blocks, on='token'), on='token')
+                      .select('_upstox_row', '_dhan_row').unique())
+    scored = (candidates.join(left, on='_upstox_row').join(right, on=['_dhan_row', 'token'])
+                        .group_by('_upstox_row', '_dhan_row').len('shared')
+                        .join(left.group_by('_upstox_row').len('left_size'), on='_upstox_row')
+                        .join(right.group_by('_dhan_row').len('right_size'), on='_dhan_row')
+                        .join(_share_classes(left, '_upstox_row'), on='_upstox_row', how='left')
+                        .join(_share_classes(right, '_dhan_row'), on='_dhan_row', how='left')
+                        .with_columns(score=pl.col('shared') / (pl.col('left_size') + pl.col('right_size')
+                                                                - pl.col('shared')))
+                        .filter((pl.col('score') >= NAME_MATCH_THRESHOLD)
+                                & (pl.col('_upstox_row_class').fill_null('')
+                                   == pl.col('_dhan_row_class').fill_null(''))))
+    for side in ('_upstox_row', '_dhan_row'):
+        scored = scored.filter(pl.col('score') == pl.col('score').max().over(side))
+        scored = scored.filter(pl.col(side).is_unique())
+    return scored.select('_upstox_row', '_dhan_row', 'score')
+
+def polars_name_match_candidates(only_upstox_df, only_dhan_df):
+    """Polars version of compare.name_match_candidates, with the same results."""
+    _require_polars()
+    upstox = pl.from_pandas(only_upstox_df.reset_index(drop=True)[UPSTOX_FIELDS]).with_row_index('_upstox_row')
+    dhan = (pl.from_pandas(only_dhan_df.reset_index(drop=True)[['trading_symbol', *DHAN_FIELDS]])
+              .rename({'trading_symbol': 'dhan_trading_symbol'}).with_row_index('_dhan_row'))
+    pairs = (_name_match_pairs(upstox, dhan) if upstox.height and dhan.height
+             else pl.DataFrame(schema={'_upstox_row': pl.UInt32, '_dhan_row': pl.UInt32, 'score': pl.Float64}))
+    candidates = (pairs.join(upstox, on='_upstox_row').join(dhan, on='_dhan_row')
+                       .sort('_upstox_row').select(CANDIDATE_COLUMNS).to_pandas())
+    diagnostics.summary("Found %d name match candidates.", len(candidates))
+    # Like the pandas version, columns other than the score hold Python objects
+    return candidates.astype({column: object for column in CANDIDATE_COLUMNS[:-1]})
+
+def polars_reconcile(upstox_df, dhan_df, key='trading_symbol', tiers=MATCH_TIERS):
+    """Polars version of compare.reconcile, with the same tiers and results.
+
+    Frames are returned with a fresh index; row order matches reconcile.
+    """
+    _require_polars()
+    unknown = set(tiers) - set(MATCH_TIERS)
+    if unknown:
+        raise ValueError(f"Unknown match tiers: {sorted(unknown)}. Choose from {MATCH_TIERS}.")
+    upstox = pl.from_pandas(upstox_df.reset_index(drop=True)).with_row_index('_upstox_row')
+    dhan = pl.from_pandas(dhan_df.reset_index(drop=True)).with_row_index('_dhan_row')
+    upstox_left, dhan_left = upstox, dhan
+    matches = []
+    for tier in tiers:
+        if not upstox_left.height or not dhan_left.height:
+            break
+        pairs = _unique_key_pairs(upstox_left, dhan_left, 'isin' if tier == 'isin' else key)
+        diagnostics.summary("Matched %d rows on %s.", pairs.height, tier)
+        matches.append(pairs.with_columns(match_tier=pl.lit(tier)))
+        upstox_left = upstox_left.filter(~pl.col('_upstox_row').is_in(pairs['_upstox_row'].implode()))
+        dhan_left = dhan_left.filter(~pl.col('_dhan_row').is_in(pairs['_dhan_row'].implode()))
+
+    empty = pl.DataFrame(schema={'_upstox_row': pl.UInt32, '_dhan_row': pl.UInt32, 'match_tier': pl.String})
+    common = (pl.concat([empty] + matches)
+                .join(upstox.select('_upstox_row', *UPSTOX_FIELDS), on='_upstox_row')
+                .join(dhan.select('_dhan_row', *DHAN_FIELDS), on='_dhan_row')
+                .sort('_upstox_row')
+                .select(*OUTPUT_COLUMNS, 'match_tier'))
+    # security_id keeps the source's dtype, which to_pandas loses for Int64 without nulls
+    security_id = {'security_id': dhan_df['security_id'].dtype}
+    return (common.to_pandas().astype(security_id),
+            upstox_left.drop('_upstox_row').to_pandas().astype({'security_id': upstox_df['security_id'].dtype}),
+            dhan_left.drop('_dhan_row').to_pandas().astype(security_id))
+
+ENGINES = {'pandas': Engine(transform_upstox_data, transform_dhan_data, reconcile, name_match_candidates, False)}
+if HAS_POLARS:
+    ENGINES['polars'] = Engine(polars_transform_upstox, polars_transform_dhan, polars_reconcile,
+                               polars_name_match_candidates, True)
+
+def get_engine(name=None):
+    """Return the Engine called `name` (default: the ETL_ENGINE setting, else pandas)."""
+    name = name or DEFAULT_ENGINE
+    if name == 'polars':
+        _require_polars()
+    if name not in ENGINES:
+        raise ValueError(f"Unknown engine {name!r}. Choose from ['pandas', 'polars'].")
+    return ENGINES[name]
@@ -0,0 +1,221 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from extract import open_source, read_csv_filtered, DHAN_URL
+from transform import transform_upstox_data, transform_dhan_data
+from load import load_to_mongodb, load_to_sql, load_reconciled
+from compare import compare_and_output
+from cache import fetch_source
+from schemas import UPSTOX_SCHEMA, DHAN_SCHEMA
+from sinks import OUTPUT_DIR
+from validate import validate_frames, VALIDATION_REPORT_PATH
+from history import load_history
+from dag import Stage, run_graph
+from metrics import RunMetrics
+
+# Upstox publishes one instrument file per exchange
+UPSTOX_EXCHANGE_URL = "https://assets.upstox.com/market-quote/instruments/exchange/{}.csv.gz"
+
+# Partition -> where its rows come from and where they go.
+#   upstox_file     - Upstox exchange file holding the segment
+#   upstox_segment  - Upstox `exchange` value; upstox_types optionally narrows instrument_type
+#   dhan_exchange, dhan_segment - SEM_EXM_EXCH_ID / SEM_SEGMENT in the all-exchange Dhan master;
+#                     dhan_instrument optionally narrows SEM_INSTRUMENT_NAME
+#   table, collection - per-partition SQLite table and MongoDB collection
+#   reconciled_suffix - suffix of its reconciled tables (common_stocks<suffix>, ...)
+#   history_table     - its instrument history table
+# NSE shares the tables of the one-shot runners, which load the same rows.
+# MCX and NCD are derivatives, whose trading symbols are spelled differently
+# by the two brokers, so they reconcile far fewer rows than the equity segments.
+PARTITIONS = {
+    'NSE': {'upstox_file': 'NSE', 'upstox_segment': 'NSE_EQ', 'upstox_types': ['EQUITY'],
+            'dhan_exchange': 'NSE', 'dhan_segment': 'E', 'dhan_instrument': 'EQUITY',
+            'table': 'dhan_nse', 'collection': 'upstox_nse', 'reconciled_suffix': '',
+            'history_table': 'instrument_history'},
+    'BSE': {'upstox_file': 'BSE', 'upstox_segment': 'BSE_EQ', 'upstox_types': None,
+            'dhan_exchange': 'BSE', 'dhan_segment': 'E', 'dhan_instrument': 'EQUITY',
+            'table': 'dhan_bse', 'collection': 'upstox_bse', 'reconciled_suffix': '_bse',
+            'history_table': 'instrument_history_bse'},
+    'MCX': {'upstox_file': 'MCX', 'upstox_segment': 'MCX_FO', 'upstox_types': None,
+            'dhan_exchange': 'MCX', 'dhan_segment': 'M', 'dhan_instrument': None,
+            'table': 'dhan_mcx', 'collection': 'upstox_mcx', 'reconciled_suffix': '_mcx',
+            'history_table': 'instrument_history_mcx'},
+    'NCD': {'upstox_file': 'NSE', 'upstox_segment': 'NCD_FO', 'upstox_types': None,
+            'dhan_exchange': 'NSE', 'dhan_segment': 'C', 'dhan_instrument': None,
+            'table': 'dhan_ncd', 'collection': 'upstox_ncd', 'reconciled_suffix': '_ncd',
+            'history_table': 'instrument_history_ncd'},
+}
+DEFAULT_PARTITIONS = ('NSE', 'BSE')
+
+def upstox_partition_mask(df, segment, instrument_types=None):
+    """Select the rows of an Upstox frame in `segment`, optionally of `instrument_types`."""
+    mask = df['exchange'] == segment
+    if instrument_types:
+        mask &= df['instrument_type'].isin(instrument_types)
+    return mask
+
+def dhan_partition_mask(df, exchange, segment, instrument=None):
+    """Select the rows of a Dhan frame on `exchange` in `segment`, optionally of `instrument`."""
+    mask = (df['SEM_EXM_EXCH_ID'] == exchange) & (df['SEM_SEGMENT'] == segment)
+    if instrument:
+        mask &= df['SEM_INSTRUMENT_NAME'] == instrument
+    return mask
+
+def partition_masks(name):
+    """Return the (Upstox, Dhan) row masks of partition `name`.
+
+    They are partials of module-level functions so they pickle into workers.
+    """
+    spec = PARTITIONS[name]
+    return (partial(upstox_partition_mask, segment=spec['upstox_segment'], instrument_types=spec['upstox_types']),
+            partial(dhan_partition_mask, exchange=spec['dhan_exchange'], segment=spec['dhan_segment'],
+                    instrument=spec['dhan_instrument']))
+
+def partition_dir(name, output_dir=OUTPUT_DIR):
+    """Return the Hive-style output directory of partition `name`."""
+    return os.path.join(output_dir, f"exchange={name}")
+
+def process_partition(name, upstox_path, dhan_path, output_formats=('csv',), output_dir=OUTPUT_DIR):
+    """Extract, filter, normalize and reconcile one partition; runs in a worker process.
+
+    Both sources are read chunk by chunk keeping only the partition's rows,
+    so a worker never holds another exchange's data. Returns the
+    partition's transformed frames as 'upstox' and 'dhan' and its
+    reconciled frames as 'outputs'.
+    """
+    start = time.perf_counter()
+    upstox_mask, dhan_mask = partition_masks(name)
+    with open_source(None, upstox_path, is_gzipped=True) as f:
+        upstox_raw, _ = read_csv_filtered(f, UPSTOX_SCHEMA, upstox_mask)
+    with open_source(None, dhan_path) as f:
+        dhan_raw, _ = read_csv_filtered(f, DHAN_SCHEMA, dhan_mask)
+    if upstox_raw.empty or dhan_raw.empty:
+        print(f"Warning: partition {name} has {len(upstox_raw)} Upstox and {len(dhan_raw)} Dhan rows.")
+    upstox_df = transform_upstox_data(upstox_raw, mask=upstox_mask)
+    dhan_df = transform_dhan_data(dhan_raw, mask=dhan_mask)
+    frames = compare_and_output(upstox_df, dhan_df, formats=output_formats,
+                                output_dir=partition_dir(name, output_dir))
+    counts = {output: len(df) for output, df in frames.items()}
+    print(f"Partition {name} done in {time.perf_counter() - start:.2f}s (pid {os.getpid()}): {counts}")
+    return {'upstox': upstox_df, 'dhan': dhan_df, 'outputs': frames}
+
+def fetch_partition_sources(partitions, max_workers=4):
+    """Fetch the Upstox exchange files the partitions need and the Dhan master.
+
+    Returns ({Upstox file: local path}, Dhan master path).
+    """
+    upstox_files = sorted({PARTITIONS[name]['upstox_file'] for name in partitions})
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        upstox_jobs = {upstox_file: pool.submit(fetch_source, UPSTOX_EXCHANGE_URL.format(upstox_file),
+                                                f"upstox_{upstox_file.lower()}.csv.gz")
+                       for upstox_file in upstox_files}
+        dhan_job = pool.submit(fetch_source, DHAN_URL, 'dhan_scrip.csv')
+        return ({upstox_file: job.result()[0] for upstox_file, job in upstox_jobs.items()},
+                dhan_job.result()[0])
+
+def run_partition(pool, name, fetched, output_formats=('csv',), output_dir=OUTPUT_DIR):
+    """Run process_partition for `name` on the process pool and wait for it.
+
+    fetched is the ({Upstox file: local path}, Dhan master path) pair of
+    fetch_partition_sources.
+    """
+    upstox_paths, dhan_path = fetched
+    return pool.submit(process_partition, name, upstox_paths[PARTITIONS[name]['upstox_file']], dhan_path,
+                       output_formats, output_dir).result()
+
+def validate_partition(name, result, output_dir=OUTPUT_DIR):
+    """Validate a partition's transformed frames; the report goes to its output directory."""
+    return validate_frames({'upstox': result['upstox'], 'dhan': result['dhan']},
+                           path=os.path.join(partition_dir(name, output_dir), os.path.basename(VALIDATION_REPORT_PATH)))
+
+def _load_mongodb(spec, result, report):
+    return load_to_mongodb(result['upstox'], collection_name=spec['collection'])
+
+def _load_sql(spec, result, report, *after):
+    return load_to_sql(result['dhan'], table=spec['table'])
+
+def _load_reconciled(spec, result, stats):
+    return load_reconciled(result['outputs'], suffix=spec['reconciled_suffix'])
+
+def _load_history(spec, result, stats):
+    return load_history(result['outputs'], table=spec['history_table'])
+
+def partition_stages(partitions, pool, output_formats=('csv',), output_dir=OUTPUT_DIR, load=True):
+    """Return the stage graph of run_multi_exchange.
+
+    After the fetch, each partition is processed on `pool` and validated.
+    With load, a partition that passed is loaded into its MongoDB
+    collection, its SQLite table, its reconciled tables and its history.
+    MongoDB loads run concurrently; the SQLite writes share one database
+    file, which takes one writer at a time, so a partition's SQLite writes
+    start once the previous partition's are done.
+    """
+    stages = [Stage('fetch', 'source', lambda: (fetch_partition_sources(partitions), None), [], {})]
+    previous = []
+    for name in partitions:
+        spec = PARTITIONS[name]
+        stages += [
+            Stage(f"partition_{name}", 'frame',
+                  partial(run_partition, pool, name, output_formats=output_formats, output_dir=output_dir),
+                  ['fetch'], {}),
+            Stage(f"validate_{name}", 'sink', partial(validate_partition, name, output_dir=output_dir),
+                  [f"partition_{name}"], {}),
+        ]
+        if load:
+            stages += [
+                Stage(f"load_mongodb_{name}", 'sink', partial(_load_mongodb, spec),
+                      [f"partition_{name}", f"validate_{name}"], {}),
+                Stage(f"load_sql_{name}", 'sink', partial(_load_sql, spec),
+                      [f"partition_{name}", f"validate_{name}"] + previous, {}),
+                Stage(f"load_reconciled_{name}", 'sink', partial(_load_reconciled, spec),
+                      [f"partition_{name}", f"load_sql_{name}"], {}),
+                Stage(f"history_{name}", 'sink', partial(_load_history, spec),
+                      [f"partition_{name}", f"load_reconciled_{name}"], {}),
+            ]
+            previous = [f"history_{name}"]
+    return stages
+
+def run_multi_exchange(partitions=DEFAULT_PARTITIONS, output_formats=('csv',), max_workers=None, load=True,
+                       output_dir=OUTPUT_DIR, sources=None):
+    """Run the pipeline for several exchange partitions on a process pool.
+
+    Each partition is extracted, filtered, normalized and reconciled in its
+    own worker process and written to output/exchange=<name>/, then
+    validated, and loaded into per-partition tables, collections and
+    history unless load=False; see partition_stages, which dag.run_graph
+    runs. `sources` may map Upstox files and 'dhan' to local paths instead
+    of fetching. Returns {partition: output row counts}.
+    """
+    unknown = set(partitions) - set(PARTITIONS)
+    if unknown:
+        raise ValueError(f"Unknown partitions: {sorted(unknown)}. Choose from {sorted(PARTITIONS)}.")
+    metrics = RunMetrics('exchanges')
+    given = None if sources is None else {'fetch': ((sources, sources['dhan']), None)}
+    workers = max_workers or min(len(partitions), os.cpu_count() or 1)
+    print(f"Processing partitions {', '.join(partitions)} on {workers} worker processes...")
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            stages = partition_stages(partitions, pool, output_formats, output_dir, load)
+            if given is not None:
+                stages = [stage for stage in stages if stage.name != 'fetch']
+            # Stages mostly wait on the pool or a database, so each gets a thread
+            values = run_graph(stages, checkpoint_dir=None, max_workers=len(stages), metrics=metrics, given=given)
+    except Exception as e:
+        print(f"Multi-exchange pipeline failed: {e}")
+        metrics.finish('failed')
+        raise
+    print(f"Run report written to {metrics.finish('success')}")
+    return {name: {output: len(df) for output, df in values[f"partition_{name}"]['outputs'].items()}
+            for name in partitions}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the ETL pipeline for several exchanges in parallel.")
+    parser.add_argument('--exchanges', nargs='+', default=list(DEFAULT_PARTITIONS), choices=sorted(PARTITIONS))
+    parser.add_argument('--formats', nargs='+', default=['csv'], help="output formats (csv, parquet, feather)")
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per partition, up to the CPU count)")
+    parser.add_argument('--no-load', action='store_true', help="only write the partitioned outputs")
+    args = parser.parse_args()
+    run_multi_exchange(args.exchanges, args.formats, args.workers, load=not args.no_load)
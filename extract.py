@@ -1,39 +1,144 @@
-import pandas as pd
-import requests
-import gzip
-import io
-
-def download_file(url, is_gzipped=False):
-    """Download file from URL and return content."""
-    try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        content = response.content
-        if is_gzipped:
-            content = gzip.decompress(content)
-        return content
-    except requests.RequestException as e:
-        print(f"Error downloading {url}: {e}")
-        raise
-
-def extract_upstox_data():
-    """Extract Upstox NSE instrument data."""
-    url = "https://assets.upstox.com/market-quote/instruments/exchange/NSE.csv.gz"
-    print(f"Downloading Upstox data from {url}...")
-    content = download_file(url, is_gzipped=True)
-    df = pd.read_csv(io.StringIO(content.decode('utf-8')))
-    print(f"Upstox raw data shape: {df.shape}")
-    if df.empty:
-        raise ValueError("Upstox dataset is empty.")
-    return df
-
-def extract_dhan_data():
-    """Extract Dhan scrip master data."""
-    url = "https://images.dhan.co/api-data/api-scrip-master.csv"
-    print(f"Downloading Dhan data from {url}...")
-    content = download_file(url)
-    df = pd.read_csv(io.StringIO(content.decode('utf-8')))
-    print(f"Dhan raw data shape: {df.shape}")
-    if df.empty:
-        raise ValueError("Dhan dataset is empty.")
-    return df
\ No newline at end of file
+import pandas as pd
+import requests
+import gzip
+import io
+import json
+from contextlib import contextmanager
+
+from transform import upstox_equity_mask, dhan_equity_mask
+from schemas import UPSTOX_SCHEMA, DHAN_SCHEMA, read_csv_kwargs, apply_dtypes
+from metrics import record_bytes_downloaded
+from download import download_bytes, get_session, CONNECT_TIMEOUT, READ_TIMEOUT
+
+UPSTOX_URL = "https://assets.upstox.com/market-quote/instruments/exchange/NSE.csv.gz"
+DHAN_URL = "https://images.dhan.co/api-data/api-scrip-master.csv"
+
+# Rows parsed per chunk in streaming mode
+CHUNK_SIZE = 10000
+
+def download_file(url, is_gzipped=False):
+    """Download file from URL and return content."""
+    content = download_bytes(url)
+    if is_gzipped:
+        content = gzip.decompress(content)
+    return content
+
+@contextmanager
+def open_stream(url, is_gzipped=False):
+    """Open URL as a binary file object that is decompressed incrementally.
+
+    Parsing consumes the body as it arrives, so a failed transfer is not
+    retried here; use download_file or the cache for that.
+    """
+    try:
+        with get_session().get(url, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            try:
+                if is_gzipped:
+                    with gzip.GzipFile(fileobj=response.raw) as f:
+                        yield f
+                else:
+                    yield response.raw
+            finally:
+                # Bytes read off the wire, before any Content-Encoding is undone
+                record_bytes_downloaded(response.raw.tell())
+    except requests.RequestException as e:
+        print(f"Error downloading {url}: {e}")
+        raise
+
+@contextmanager
+def open_source(url, path=None, is_gzipped=False):
+    """Open a local copy at `path` if given, otherwise stream `url`."""
+    if path is None:
+        with open_stream(url, is_gzipped=is_gzipped) as f:
+            yield f
+    elif is_gzipped:
+        with gzip.open(path, 'rb') as f:
+            yield f
+    else:
+        with open(path, 'rb') as f:
+            yield f
+
+def read_csv_filtered(fileobj, schema, row_filter=None, chunksize=CHUNK_SIZE):
+    """Parse CSV in bounded chunks with `schema`, keeping rows where `row_filter` is True.
+
+    Returns the filtered DataFrame and the number of raw rows read.
+    """
+    chunks = []
+    raw_rows = 0
+    empty = pd.DataFrame()
+    for chunk in pd.read_csv(fileobj, chunksize=chunksize, **read_csv_kwargs(schema)):
+        raw_rows += len(chunk)
+        if row_filter is not None:
+            chunk = chunk[row_filter(chunk)]
+        if chunk.empty:
+            # Keep the columns in case no chunk has matching rows
+            empty = chunk
+            continue
+        chunks.append(chunk)
+    if not chunks:
+        return apply_dtypes(empty, schema), raw_rows
+    # Chunks can carry different category sets, so restore the schema dtypes
+    return apply_dtypes(pd.concat(chunks, ignore_index=True), schema), raw_rows
+
+def read_json_records(fileobj, schema, row_filter=None):
+    """Parse a JSON array of records with `schema`, keeping rows where `row_filter` is True.
+
+    Returns the filtered DataFrame and the number of raw rows read, like
+    read_csv_filtered. Integer columns given as strings are parsed; values
+    that are not numbers become missing.
+    """
+    df = pd.DataFrame.from_records(json.load(fileobj), columns=schema['usecols'])
+    raw_rows = len(df)
+    for col, dtype in schema['dtype'].items():
+        if dtype == 'Int64' and col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    df = apply_dtypes(df, schema)
+    if row_filter is not None:
+        df = df[row_filter(df)].reset_index(drop=True)
+    return df, raw_rows
+
+def extract_upstox_data(url=UPSTOX_URL, stream=False, path=None):
+    """Extract Upstox NSE instrument data.
+
+    With stream=True only NSE Equity rows and the columns needed by
+    transform_upstox_data are kept, filtered chunk by chunk while downloading.
+    If `path` is given the data is read from that local copy instead of `url`.
+    """
+    print(f"Reading Upstox data from {path}..." if path else f"Downloading Upstox data from {url}...")
+    if stream:
+        with open_source(url, path, is_gzipped=True) as f:
+            df, raw_rows = read_csv_filtered(f, UPSTOX_SCHEMA, upstox_equity_mask)
+        print(f"Upstox streamed {raw_rows} rows, kept {len(df)} NSE Equity rows")
+    elif path:
+        df = pd.read_csv(path, compression='gzip', **read_csv_kwargs(UPSTOX_SCHEMA))
+    else:
+        content = download_file(url, is_gzipped=True)
+        df = pd.read_csv(io.BytesIO(content), **read_csv_kwargs(UPSTOX_SCHEMA))
+    print(f"Upstox raw data shape: {df.shape}")
+    if df.empty:
+        raise ValueError("Upstox dataset is empty.")
+    return df
+
+def extract_dhan_data(url=DHAN_URL, stream=False, path=None):
+    """Extract Dhan scrip master data.
+
+    With stream=True only NSE Equity rows and the columns needed by
+    transform_dhan_data are kept, filtered chunk by chunk while downloading.
+    If `path` is given the data is read from that local copy instead of `url`.
+    """
+    print(f"Reading Dhan data from {path}..." if path else f"Downloading Dhan data from {url}...")
+    if stream:
+        with open_source(url, path) as f:
+            df, raw_rows = read_csv_filtered(f, DHAN_SCHEMA, dhan_equity_mask)
+        print(f"Dhan streamed {raw_rows} rows, kept {len(df)} NSE Equity rows")
+    elif path:
+        df = pd.read_csv(path, **read_csv_kwargs(DHAN_SCHEMA))
+    else:
+        content = download_file(url)
+        df = pd.read_csv(io.BytesIO(content), **read_csv_kwargs(DHAN_SCHEMA))
+    print(f"Dhan raw data shape: {df.shape}")
+    if df.empty:
+        raise ValueError("Dhan dataset is empty.")
+    return df
@@ -0,0 +1,233 @@
+import re
+from collections import namedtuple
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from decouple import config
+
+from load import content_hashes, connect_sqlite
+
+HISTORY_TABLE = 'instrument_history'
+# Columns of a version of an instrument's mapping; a version is in effect
+# from valid_from (inclusive) to valid_to (exclusive, NULL while current)
+HISTORY_COLUMNS = ['trading_symbol', 'instrument_key', 'security_id', 'isin', 'name', 'source']
+# The clustered primary key makes an as-of lookup by symbol one seek into
+# the symbol's versions; the ISIN index does the same for ISINs, in the
+# order _in_effect returns shared ISINs and with valid_to covered, so no
+# sort is needed and ended versions are skipped without reading their rows.
+# The partial unique index finds (and guards) the one current version of a symbol.
+# {table} is the history table, HISTORY_TABLE unless a partition keeps its own.
+HISTORY_DDL = [
+    """CREATE TABLE IF NOT EXISTS {table} (
+        trading_symbol TEXT NOT NULL,
+        instrument_key TEXT,
+        security_id INTEGER,
+        isin TEXT,
+        name TEXT,
+        source TEXT NOT NULL,
+        row_hash INTEGER NOT NULL,
+        valid_from TEXT NOT NULL,
+        valid_to TEXT,
+        PRIMARY KEY (trading_symbol, valid_from)
+    ) WITHOUT ROWID""",
+    # Replaced by {table}_isin_in_effect
+    "DROP INDEX IF EXISTS {table}_isin_asof",
+    "CREATE INDEX IF NOT EXISTS {table}_isin_in_effect ON {table} (isin, valid_from DESC, trading_symbol, valid_to)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS {table}_current ON {table} (trading_symbol) WHERE valid_to IS NULL",
+    # One row per recorded run; runs must be recorded in time order
+    """CREATE TABLE IF NOT EXISTS {table}_runs (
+        as_of TEXT PRIMARY KEY,
+        opened INTEGER NOT NULL,
+        closed INTEGER NOT NULL
+    )""",
+]
+LOOKUP_KEYS = ['trading_symbol', 'isin']
+DATE_PATTERN = r'\d{4}-\d{2}-\d{2}'
+# Time of day a bare date stands for
+END_OF_DAY = 'T23:59:59.999999'
+# Reconciled frames in order of precedence, with the source recorded for their rows
+SOURCE_FRAMES = [('common_stocks', 'both'), ('only_in_upstox', 'upstox'), ('only_in_dhan', 'dhan')]
+
+InstrumentVersion = namedtuple('InstrumentVersion', HISTORY_COLUMNS + ['valid_from', 'valid_to'])
+
+def ensure_history_schema(conn, table=HISTORY_TABLE):
+    """Create the history table and its indexes unless they exist."""
+    for statement in HISTORY_DDL:
+        conn.execute(statement.format(table=table))
+
+def _is_date(value):
+    return ((isinstance(value, date) and not isinstance(value, datetime))
+            or (isinstance(value, str) and re.fullmatch(DATE_PATTERN, value) is not None))
+
+def to_timestamp(value):
+    """Normalize a date/datetime or ISO string to the 'YYYY-MM-DDTHH:MM:SS[.ffffff]' form stored in the table.
+
+    Microseconds are kept when there are any, so runs recorded within the
+    same second still get increasing times; either form sorts correctly
+    as text. A bare date stands for the end of that day, so an as-of
+    lookup for a day sees the versions recorded during it.
+    """
+    if _is_date(value):
+        return f"{str(value)[:10]}{END_OF_DAY}"
+    stamp = pd.Timestamp(value)
+    return stamp.strftime('%Y-%m-%dT%H:%M:%S.%f' if stamp.microsecond else '%Y-%m-%dT%H:%M:%S')
+
+def to_timestamps(values):
+    """Vectorized to_timestamp over a sequence of times; returns a list."""
+    values = list(values)
+    stamps = np.datetime_as_string(
+        pd.to_datetime(pd.Series(values, dtype=object), format='mixed').to_numpy().astype('datetime64[us]')).tolist()
+    return [f"{stamp[:10]}{END_OF_DAY}" if _is_date(value) else stamp.removesuffix('.000000')
+            for stamp, value in zip(stamps, values)]
+
+def history_snapshot(frames):
+    """Return the versioned columns of the reconciled frames, one row per trading symbol.
+
+    `frames` is the {output name: frame} dict returned by compare_and_output.
+    A symbol listed in more than one frame keeps the row of the first one
+    in SOURCE_FRAMES order.
+    """
+    parts = []
+    for output, source in SOURCE_FRAMES:
+        # A column a frame lacks (etl_pipeline's only_in_upstox has no security_id) is null
+        df = frames[output].reindex(columns=HISTORY_COLUMNS[:-2] + ['name', 'symbol_name'])
+        # Object columns throughout, so all-null columns (e.g. instrument_key of
+        # Dhan-only rows) concatenate without dtype changes
+        parts.append(pd.DataFrame({
+            'trading_symbol': df['trading_symbol'].astype(object),
+            'instrument_key': df['instrument_key'].astype(object),
+            'security_id': pd.to_numeric(df['security_id'], errors='coerce').astype('Int64'),
+            'isin': df['isin'].astype(object),
+            # Dhan-only rows have no Upstox name; fall back to Dhan's symbol name
+            'name': df['name'].where(df['name'].notna(), df['symbol_name']).astype(object),
+            'source': source,
+        }))
+    snapshot = pd.concat(parts, ignore_index=True)
+    snapshot = snapshot[snapshot['trading_symbol'].notna() & ~snapshot['trading_symbol'].duplicated()]
+    return snapshot.reset_index(drop=True)
+
+def record_history(conn, frames, as_of=None, table=HISTORY_TABLE):
+    """Apply the reconciled frames of a run to the history as of `as_of` (default: now, to the microsecond).
+
+    The run's snapshot is compared with the current versions by row hash:
+    the current version of a symbol that changed or disappeared gets
+    valid_to = as_of, and new or changed symbols get a new version from
+    as_of. Unchanged symbols are not touched, so a run costs one scan of
+    the current versions plus a write per change. Runs must be recorded in
+    time order. Returns counts of versions opened and closed and of
+    unchanged symbols.
+    """
+    as_of = to_timestamp(as_of or datetime.now())
+    snapshot = history_snapshot(frames)
+    snapshot['row_hash'] = content_hashes(snapshot)
+    columns = HISTORY_COLUMNS + ['row_hash']
+
+    ensure_history_schema(conn, table)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        latest = conn.execute(f"SELECT MAX(as_of) FROM {table}_runs").fetchone()[0]
+        if latest is not None and as_of <= latest:
+            raise ValueError(f"History is recorded up to {latest}; as_of {as_of} must be later.")
+        current = pd.DataFrame(
+            conn.execute(f"SELECT trading_symbol, row_hash FROM {table} WHERE valid_to IS NULL").fetchall(),
+            columns=['trading_symbol', 'row_hash'])
+        merged = snapshot[['trading_symbol', 'row_hash']].merge(
+            current, on='trading_symbol', how='outer', suffixes=('', '_current'), indicator=True)
+        changed = (merged['_merge'] == 'both') & (merged['row_hash'] != merged['row_hash_current'])
+        closing = merged.loc[(merged['_merge'] == 'right_only') | changed, 'trading_symbol']
+        opening = snapshot[snapshot['trading_symbol'].isin(
+            merged.loc[(merged['_merge'] == 'left_only') | changed, 'trading_symbol'])]
+
+        conn.executemany(f"UPDATE {table} SET valid_to = ? WHERE trading_symbol = ? AND valid_to IS NULL",
+                         [(as_of, symbol) for symbol in closing])
+        rows = opening[columns].astype(object).where(opening[columns].notna(), None)
+        rows['security_id'] = rows['security_id'].map(lambda value: None if value is None else int(value))
+        rows['row_hash'] = rows['row_hash'].map(int)
+        conn.executemany(f"INSERT INTO {table} ({', '.join(columns)}, valid_from) "
+                         f"VALUES ({', '.join('?' for _ in columns)}, ?)",
+                         [(*row, as_of) for row in rows.itertuples(index=False, name=None)])
+        conn.execute(f"INSERT INTO {table}_runs VALUES (?, ?, ?)", (as_of, len(opening), len(closing)))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return {'opened': len(opening), 'closed': len(closing), 'unchanged': len(snapshot) - len(opening)}
+
+def load_history(frames, as_of=None, db_path=None, table=HISTORY_TABLE):
+    """Record the reconciled frames of a run in the history of the SQLITE_DB_PATH database (or db_path)."""
+    conn = connect_sqlite(db_path or config('SQLITE_DB_PATH', default='nse.db'))
+    try:
+        stats = record_history(conn, frames, as_of, table)
+    finally:
+        conn.close()
+    print(f"Recorded instrument history in {table}: {stats['opened']} versions opened, {stats['closed']} closed, "
+          f"{stats['unchanged']} unchanged.")
+    return stats
+
+def _check_key(key):
+    if key not in LOOKUP_KEYS:
+        raise ValueError(f"Unknown lookup key {key!r}. Choose from {LOOKUP_KEYS}.")
+
+def _in_effect(key, value, when, table=HISTORY_TABLE):
+    """SQL selecting the versions whose `key` is `value` and that are in effect at `when`.
+
+    When several are (one ISIN held by several symbols), the most recently
+    started comes first, then the one with the lowest trading_symbol.
+    """
+    return (f"FROM {table} WHERE {key} = {value} AND valid_from <= {when} "
+            f"AND (valid_to IS NULL OR valid_to > {when}) ORDER BY valid_from DESC, trading_symbol")
+
+def resolve_as_of(conn, value, when, key='trading_symbol', table=HISTORY_TABLE):
+    """Return the InstrumentVersion whose `key` was `value` at time `when`, or None.
+
+    The (key, valid_from) index is walked back from `when` to the first
+    version still in effect then; a symbol's versions never overlap, so a
+    symbol that resolves does so on the first step. An ISIN can be held by
+    several symbols at once: the version that started most recently is
+    returned, and of versions that started together the one with the
+    lowest trading_symbol, so the answer does not depend on storage order.
+    """
+    _check_key(key)
+    when = to_timestamp(when)
+    row = conn.execute(f"SELECT {', '.join(HISTORY_COLUMNS)}, valid_from, valid_to "
+                       f"{_in_effect(key, '?', '?', table)} LIMIT 1", (value, when, when)).fetchone()
+    return None if row is None else InstrumentVersion(*row)
+
+def resolve_as_of_many(conn, values, when, key='trading_symbol', table=HISTORY_TABLE):
+    """Resolve many (value, time) pairs in one query; returns a frame aligned with `values`.
+
+    `when` is one time for all values or a sequence of times, one per
+    value. The pairs are loaded into a temp table and joined against the
+    history, one index seek per pair. Each pair resolves to the version
+    resolve_as_of returns for it, with the same tie-breaking for shared
+    ISINs. Unresolved pairs have null columns.
+    """
+    _check_key(key)
+    values = list(values)
+    if isinstance(when, (str, date, pd.Timestamp)) or np.isscalar(when):
+        times = [to_timestamp(when)] * len(values)
+    else:
+        times = to_timestamps(when)
+        if len(times) != len(values):
+            raise ValueError(f"Got {len(values)} values but {len(times)} times.")
+    # Keyed on (value, time), so the join walks the history in index order
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS asof_query (value TEXT, as_of TEXT, position INTEGER, "
+                 "PRIMARY KEY (value, as_of, position)) WITHOUT ROWID")
+    conn.execute("DELETE FROM asof_query")
+    conn.executemany("INSERT INTO asof_query VALUES (?, ?, ?)", zip(values, times, range(len(values))))
+    rows = conn.execute(
+        f"SELECT q.position, q.value, q.as_of, {', '.join(f'h.{col}' for col in HISTORY_COLUMNS)}, "
+        f"h.valid_from, h.valid_to "
+        f"FROM asof_query q LEFT JOIN {table} h "
+        f"ON (h.trading_symbol, h.valid_from) = ("
+        f"    SELECT trading_symbol, valid_from {_in_effect(key, 'q.value', 'q.as_of', table)} LIMIT 1)").fetchall()
+    conn.execute("DELETE FROM asof_query")
+    result = pd.DataFrame(rows, columns=['position', f"{key}_query", 'as_of'] + HISTORY_COLUMNS
+                          + ['valid_from', 'valid_to'])
+    # Rows come back in key order; putting them back by position is a scatter rather than a sort
+    order = np.empty(len(result), dtype=np.int64)
+    order[result['position'].to_numpy(dtype=np.int64)] = np.arange(len(result))
+    result = result.iloc[order].drop(columns='position').reset_index(drop=True)
+    result['security_id'] = result['security_id'].astype('Int64')
+    return result
@@ -1,88 +1,448 @@
-from pymongo import MongoClient
-from sqlalchemy import create_engine
-from decouple import config
-import pandas as pd
-import sqlite3
-import os
-
-def load_to_mongodb(df):
-    """Load Upstox data to MongoDB."""
-    print("Loading Upstox data to MongoDB...")
-    if df.empty:
-        print("Warning: Upstox DataFrame is empty. No data will be loaded to MongoDB.")
-        return
-    
-    client = MongoClient(config('MONGODB_URI'))
-    db = client['market_data']
-    collection = db['upstox_nse']
-    
-    # Convert DataFrame to list of dictionaries
-    records = df.to_dict('records')
-    
-    # Upsert based on instrument_key
-    for record in records:
-        collection.update_one(
-            {'instrument_key': record['instrument_key']},
-            {'$set': record},
-            upsert=True
-        )
-    print(f"Loaded {len(records)} records to MongoDB upstox_nse collection.")
-    client.close()
-
-def load_to_sql(df):
-    """Load Dhan data to SQLite."""
-    print("Loading Dhan data to SQLite...")
-    if df.empty:
-        print("Warning: Dhan DataFrame is empty. No data will be loaded to SQLite.")
-        return
-    
-    # Define SQLite database path
-    db_path = config('SQLITE_DB_PATH', default='nse.db')
-    
-    # Validate db_path
-    if not db_path:
-        raise ValueError("SQLITE_DB_PATH is empty. Please set a valid path in .env file.")
-    
-    # Debug: Print database path and current working directory
-    print(f"SQLite DB Path: {os.path.abspath(db_path)}")
-    print(f"Current Working Directory: {os.getcwd()}")
-    
-    # Create directory if db_path includes a directory component
-    db_dir = os.path.dirname(db_path)
-    if db_dir:
-        os.makedirs(db_dir, exist_ok=True)
-    
-    # Check if file exists and is a valid SQLite database
-    if os.path.exists(db_path):
-        try:
-            with sqlite3.connect(db_path) as conn:
-                conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        except sqlite3.DatabaseError:
-            print(f"Warning: {db_path} is not a valid SQLite database. Deleting and recreating.")
-            os.remove(db_path)
-    
-    # Create SQLAlchemy engine for SQLite
-    engine = create_engine(f'sqlite:///{db_path}')
-    
-    # Load data to SQLite, replacing the table if it exists
-    df.to_sql('dhan_nse', engine, if_exists='replace', index=False, chunksize=1000)
-    
-    # Ensure table schema
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS dhan_nse (
-                exchange TEXT,
-                instrument_key TEXT,
-                symbol_name TEXT,
-                security_id TEXT PRIMARY KEY,
-                short_name TEXT,
-                name TEXT,
-                isin TEXT,
-                trading_symbol TEXT UNIQUE
-            )
-        """)
-        conn.commit()
-    
-    print(f"Loaded {len(df)} records to SQLite dhan_nse table.")
-    engine.dispose()
\ No newline at end of file
+from decouple import config
+import pandas as pd
+import hashlib
+import json
+import re
+import sqlite3
+import os
+
+# Upserts sent per bulk_write call
+MONGO_BATCH_SIZE = 1000
+# Directory holding per-collection checkpoints of committed batches
+MONGO_CHECKPOINT_DIR = 'cache'
+
+# Canonical SQLite schema, shared with etl_pipeline.py
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql_schemas.sql')
+SQL_COLUMNS = ['exchange', 'instrument_key', 'symbol_name', 'security_id',
+               'short_name', 'name', 'isin', 'trading_symbol']
+# Reconciled outputs of compare_and_output, loaded as tables of the same name
+RECONCILED_TABLES = {
+    'common_stocks': SQL_COLUMNS + ['match_tier'],
+    'only_in_upstox': SQL_COLUMNS,
+    'only_in_dhan': SQL_COLUMNS,
+}
+# STRICT tables need SQLite 3.37; older builds create the same tables without it
+STRICT_TABLES = sqlite3.sqlite_version_info >= (3, 37, 0)
+# Rows per executemany call when staging
+SQLITE_BATCH_SIZE = 5000
+# WAL lets readers keep reading the last committed snapshot while a load runs
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',
+]
+
+def content_hashes(df):
+    """Return a signed 64-bit content hash per row of df."""
+    return pd.util.hash_pandas_object(df, index=False).values.view('int64')
+
+def stored_hashes(collection, key='instrument_key'):
+    """Return {key: _content_hash} of every document in collection, in one round trip."""
+    return {doc[key]: doc.get('_content_hash')
+            for doc in collection.find({}, {key: 1, '_content_hash': 1, '_id': 0})}
+
+def bulk_upsert_mongodb(collection, df, key='instrument_key', batch_size=MONGO_BATCH_SIZE,
+                        skip_unchanged=True, resume=True, deleted_keys=None, existing=None):
+    """Upsert df into collection with batched, unordered bulk writes.
+
+    Ensures a unique index on `key`. Each document carries a `_content_hash`;
+    with skip_unchanged=True documents whose hash already matches the stored
+    one are not sent. With resume=True committed batches are checkpointed, so
+    a rerun over the same data after a failure continues from the first
+    uncommitted batch. Documents whose key is in deleted_keys are removed.
+    Callers upserting several frames into one collection can pass the
+    stored_hashes `existing` once instead of having them fetched per call.
+    Returns counts of upserted, modified, skipped and deleted documents and
+    of round trips to the server.
+    """
+    # pymongo is only imported by the runs that load into MongoDB
+    from pymongo import UpdateOne
+
+    collection.create_index(key, unique=True)
+    stats = {'upserted': 0, 'modified': 0, 'skipped': 0, 'deleted': 0, 'batches': 0, 'round_trips': 1}
+
+    hashes = content_hashes(df)
+    # Missing values of any dtype (NaN, pd.NA) are stored as null
+    records = df.astype(object).where(df.notna(), None).to_dict('records')
+    for record, content_hash in zip(records, hashes):
+        record['_content_hash'] = int(content_hash)
+
+    # Checkpoints are only reused for exactly the same input
+    checkpoint_path = os.path.join(MONGO_CHECKPOINT_DIR, f"mongo_checkpoint_{collection.full_name}.json")
+    dataset_hash = hashlib.sha256(hashes.tobytes()).hexdigest()
+    start_batch = 0
+    if resume and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('dataset') == dataset_hash and checkpoint.get('batch_size') == batch_size:
+            start_batch = checkpoint['committed_batches']
+            print(f"Resuming MongoDB load from batch {start_batch}.")
+
+    if not skip_unchanged:
+        existing = {}
+    elif existing is None and records:
+        existing = stored_hashes(collection, key)
+        stats['round_trips'] += 1
+    existing = existing or {}
+
+    for batch_no, start in enumerate(range(0, len(records), batch_size)):
+        if batch_no < start_batch:
+            continue
+        batch = records[start:start + batch_size]
+        operations = [
+            UpdateOne({key: record[key]}, {'$set': record}, upsert=True)
+            for record in batch
+            if existing.get(record[key]) != record['_content_hash']
+        ]
+        stats['skipped'] += len(batch) - len(operations)
+        if operations:
+            result = collection.bulk_write(operations, ordered=False)
+            stats['upserted'] += result.upserted_count
+            stats['modified'] += result.modified_count
+            stats['round_trips'] += 1
+        stats['batches'] += 1
+        if resume:
+            os.makedirs(MONGO_CHECKPOINT_DIR, exist_ok=True)
+            with open(checkpoint_path, 'w') as f:
+                json.dump({'dataset': dataset_hash, 'batch_size': batch_size,
+                           'committed_batches': batch_no + 1}, f)
+
+    if resume and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    if deleted_keys:
+        stats['deleted'] = collection.delete_many({key: {'$in': list(deleted_keys)}}).deleted_count
+        stats['round_trips'] += 1
+    return stats
+
+def load_to_mongodb(df, collection=None, batch_size=MONGO_BATCH_SIZE, skip_unchanged=True, resume=True,
+                    deleted_keys=None, collection_name='upstox_nse'):
+    """Load Upstox data to MongoDB.
+
+    Uses the market_data.<collection_name> collection at MONGODB_URI unless
+    a collection is passed in. See bulk_upsert_mongodb for the options.
+    """
+    print("Loading Upstox data to MongoDB...")
+    if df.empty and not deleted_keys:
+        print("Warning: Upstox DataFrame is empty. No data will be loaded to MongoDB.")
+        return
+    
+    client = None
+    if collection is None:
+        from pymongo import MongoClient
+        client = MongoClient(config('MONGODB_URI'))
+        collection = client['market_data'][collection_name]
+    
+    try:
+        stats = bulk_upsert_mongodb(collection, df, batch_size=batch_size,
+                                    skip_unchanged=skip_unchanged, resume=resume, deleted_keys=deleted_keys)
+    finally:
+        if client is not None:
+            client.close()
+    print(f"Loaded {len(df)} records to MongoDB {collection.name} collection: "
+          f"{stats['upserted']} inserted, {stats['modified']} updated, {stats['skipped']} unchanged, "
+          f"{stats['deleted']} deleted "
+          f"({stats['round_trips']} round trips).")
+    return stats
+
+def _schema_statements(table='dhan_nse', template='dhan_nse'):
+    """Return the DDL statements of `template` in sql_schemas.sql, for `table` instead."""
+    with open(SCHEMA_PATH) as f:
+        statements = [stmt.strip() for stmt in f.read().split(';') if stmt.strip()]
+    if not STRICT_TABLES:
+        statements = [re.sub(r'\)\s*STRICT$', ')', stmt) for stmt in statements]
+    # Per-exchange tables share the dhan_nse definition
+    return [stmt.replace(template, table) for stmt in statements if re.search(rf'\b{template}\b', stmt)]
+
+def is_strict(conn, table):
+    """Whether `table` exists and is a STRICT table."""
+    if not STRICT_TABLES:
+        return False
+    row = conn.execute("SELECT strict FROM pragma_table_list WHERE schema = 'main' AND name = ?", (table,)).fetchone()
+    return bool(row and row[0])
+
+def connect_sqlite(db_path):
+    """Open db_path in autocommit mode with WAL and the loader pragmas applied."""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def ensure_sqlite_schema(conn, table='dhan_nse'):
+    """Create `table` from sql_schemas.sql, migrating a legacy table.
+
+    Tables written by DataFrame.to_sql have no primary key and cannot be
+    upserted, and tables created before the schema was STRICT store values
+    with whatever type they came in; both are rebuilt with their rows kept.
+    """
+    columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    legacy = columns and (not any(col[1] == 'security_id' and col[5] for col in columns)
+                          or (STRICT_TABLES and not is_strict(conn, table)))
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if legacy:
+            print(f"Migrating legacy {table} table to the typed, keyed schema...")
+            conn.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+        for statement in _schema_statements(table):
+            conn.execute(statement)
+        if legacy:
+            shared = [col[1] for col in columns if col[1] in SQL_COLUMNS]
+            # TEXT-affinity ids such as '1333' become integers
+            values = [f"CAST({col} AS INTEGER)" if col == 'security_id' else col for col in shared]
+            conn.execute(f"INSERT OR IGNORE INTO {table} ({', '.join(shared)}) "
+                         f"SELECT {', '.join(values)} FROM {table}_legacy "
+                         f"WHERE security_id IS NOT NULL AND trading_symbol IS NOT NULL")
+            conn.execute(f"DROP TABLE {table}_legacy")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def _sql_values(df, columns):
+    """Return df's `columns` as row tuples with None for missing values and int security ids."""
+    df = df.reindex(columns=columns).astype(object)
+    df = df.where(df.notna(), None)
+    df['security_id'] = df['security_id'].map(lambda value: None if value is None else int(value))
+    return list(df.itertuples(index=False, name=None))
+
+def sqlite_rows(df):
+    """Convert df to row tuples in SQL_COLUMNS order with None for missing values.
+
+    Rows without a security_id are skipped. A null or repeated
+    trading_symbol raises ValueError: the transform is what drops those,
+    and the loader does not guess which of the repeated rows to keep.
+    """
+    df = df.reindex(columns=SQL_COLUMNS)
+    missing_ids = df['security_id'].isna()
+    if missing_ids.any():
+        print(f"Warning: Skipping {missing_ids.sum()} rows without security_id.")
+        df = df[~missing_ids]
+    null_symbols = int(df['trading_symbol'].isna().sum())
+    duplicates = int(df['trading_symbol'].duplicated().sum())
+    if null_symbols or duplicates:
+        raise ValueError(f"Cannot load {null_symbols} rows without trading_symbol and {duplicates} rows with a "
+                         f"repeated trading_symbol into the UNIQUE trading_symbol column; drop them in the transform.")
+    return _sql_values(df, SQL_COLUMNS)
+
+class StatementCounter:
+    """Connection wrapper counting the statements sent through execute and executemany."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.statements = 0
+
+    def execute(self, sql, parameters=()):
+        self.statements += 1
+        return self.conn.execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.statements += 1
+        return self.conn.executemany(sql, seq_of_parameters)
+
+def _stage_table(table):
+    return f"{table}_stage"
+
+def begin_sqlite_stage(conn, table='dhan_nse'):
+    """Open the load transaction of `table` and an empty temp stage table for it.
+
+    Returns the number of statements sent.
+    """
+    counter = StatementCounter(conn)
+    counter.execute("BEGIN IMMEDIATE")
+    try:
+        counter.execute(f"CREATE TEMP TABLE IF NOT EXISTS {_stage_table(table)} AS SELECT * FROM main.{table} WHERE 0")
+        counter.execute(f"DELETE FROM {_stage_table(table)}")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return counter.statements
+
+def stage_sqlite_rows(conn, df, batch_size=SQLITE_BATCH_SIZE, table='dhan_nse'):
+    """Stage df's rows for `table` with batched executemany; return the number of statements sent."""
+    counter = StatementCounter(conn)
+    columns = ', '.join(SQL_COLUMNS)
+    placeholders = ', '.join('?' for _ in SQL_COLUMNS)
+    rows = sqlite_rows(df)
+    for start in range(0, len(rows), batch_size):
+        counter.executemany(f"INSERT INTO {_stage_table(table)} ({columns}) VALUES ({placeholders})",
+                            rows[start:start + batch_size])
+    return counter.statements
+
+def merge_sqlite_stage(conn, deleted_keys=None, table='dhan_nse', commit=True):
+    """Upsert the staged rows into `table` and commit the load transaction.
+
+    With commit=False the transaction is left open for the caller to
+    commit or roll back. Returns counts of rows inserted, updated and
+    deleted (see upsert_sqlite) and of the statements sent.
+    """
+    conn = StatementCounter(conn)
+    columns = ', '.join(SQL_COLUMNS)
+    changed = ' OR '.join(f"{table}.{col} IS NOT excluded.{col}" for col in SQL_COLUMNS if col != 'security_id')
+    stage = _stage_table(table)
+    assignments = ', '.join(f"{col} = excluded.{col}" for col in SQL_COLUMNS if col != 'security_id')
+    differs = ' OR '.join(f"s.{col} IS NOT t.{col}" for col in SQL_COLUMNS if col != 'security_id')
+    stats = {
+        'inserted': conn.execute(
+            f"SELECT COUNT(*) FROM {stage} s "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.security_id = s.security_id)").fetchone()[0],
+        'updated': conn.execute(
+            f"SELECT COUNT(*) FROM {stage} s JOIN {table} t ON t.security_id = s.security_id "
+            f"WHERE {differs}").fetchone()[0],
+    }
+    if deleted_keys is None:
+        stats['deleted'] = conn.execute(
+            f"DELETE FROM {table} WHERE security_id NOT IN (SELECT security_id FROM {stage})").rowcount
+    else:
+        stats['deleted'] = conn.executemany(
+            f"DELETE FROM {table} WHERE security_id = ?", [(int(k),) for k in deleted_keys]).rowcount
+    # A symbol that moved to another security_id would trip UNIQUE(trading_symbol) mid-upsert.
+    # The row it moved from is deleted; unless that security_id is staged too and so
+    # reinserted (counted as updated above), the row is gone and counts as deleted.
+    moved = (f"trading_symbol IN (SELECT s.trading_symbol FROM {stage} s "
+             f"JOIN {table} t ON t.trading_symbol = s.trading_symbol WHERE t.security_id != s.security_id)")
+    stats['deleted'] += conn.execute(
+        f"DELETE FROM {table} WHERE {moved} AND security_id NOT IN (SELECT security_id FROM {stage})").rowcount
+    conn.execute(f"DELETE FROM {table} WHERE {moved}")
+    conn.execute(
+        f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage} WHERE true "
+        f"ON CONFLICT(security_id) DO UPDATE SET {assignments} WHERE {changed}")
+    conn.execute(f"DELETE FROM {stage}")
+    if commit:
+        conn.execute("COMMIT")
+    stats['round_trips'] = conn.statements
+    return stats
+
+def upsert_sqlite(conn, df, batch_size=SQLITE_BATCH_SIZE, deleted_keys=None, table='dhan_nse'):
+    """Synchronize `table` (dhan_nse by default) with df in a single transaction.
+
+    Rows are staged with batched executemany into a temp table, then
+    upserted on security_id. By default rows missing from df are deleted;
+    if deleted_keys is given, df is treated as a delta and only those keys
+    are deleted. Either way a row whose trading_symbol moved to a new
+    security_id in df is deleted too. Readers keep seeing the previous
+    snapshot until the commit. Returns counts of rows inserted, updated
+    and deleted, and the number of statements sent to SQLite.
+    """
+    statements = begin_sqlite_stage(conn, table)
+    try:
+        statements += stage_sqlite_rows(conn, df, batch_size, table)
+        stats = merge_sqlite_stage(conn, deleted_keys, table)
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    stats['round_trips'] += statements
+    return stats
+
+def open_sqlite_db(table='dhan_nse'):
+    """Connect to the SQLITE_DB_PATH database and make sure `table` exists."""
+    # Define SQLite database path
+    db_path = config('SQLITE_DB_PATH', default='nse.db')
+    
+    # Validate db_path
+    if not db_path:
+        raise ValueError("SQLITE_DB_PATH is empty. Please set a valid path in .env file.")
+    
+    # Debug: Print database path and current working directory
+    print(f"SQLite DB Path: {os.path.abspath(db_path)}")
+    print(f"Current Working Directory: {os.getcwd()}")
+    
+    # Create directory if db_path includes a directory component
+    db_dir = os.path.dirname(db_path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    
+    # Check if file exists and is a valid SQLite database
+    if os.path.exists(db_path):
+        try:
+            with sqlite3.connect(db_path) as conn:
+                conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        except sqlite3.DatabaseError:
+            print(f"Warning: {db_path} is not a valid SQLite database. Deleting and recreating.")
+            os.remove(db_path)
+    
+    conn = connect_sqlite(db_path)
+    try:
+        ensure_sqlite_schema(conn, table)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+def load_to_sql(df, deleted_keys=None, table='dhan_nse'):
+    """Load Dhan data to SQLite into `table`.
+
+    If deleted_keys is given, df is applied as a delta; see upsert_sqlite.
+    """
+    print("Loading Dhan data to SQLite...")
+    if df.empty and not deleted_keys:
+        print("Warning: Dhan DataFrame is empty. No data will be loaded to SQLite.")
+        return
+    
+    conn = open_sqlite_db(table)
+    try:
+        stats = upsert_sqlite(conn, df, deleted_keys=deleted_keys, table=table)
+    finally:
+        conn.close()
+    
+    print(f"Loaded {len(df)} records to SQLite {table} table: "
+          f"{stats['inserted']} inserted, {stats['updated']} updated, {stats['deleted']} deleted.")
+    return stats
+
+def ensure_reconciled_schema(conn, suffix=''):
+    """Create the reconciled tables (named <table><suffix>) from sql_schemas.sql.
+
+    Their rows are replaced on every run, so a table from before the schema
+    was STRICT is simply dropped and recreated.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for template in RECONCILED_TABLES:
+            table = f"{template}{suffix}"
+            exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+            if exists and STRICT_TABLES and not is_strict(conn, table):
+                conn.execute(f"DROP TABLE {table}")
+            for statement in _schema_statements(table, template):
+                conn.execute(statement)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def upsert_reconciled(conn, frames, batch_size=SQLITE_BATCH_SIZE, suffix=''):
+    """Replace the reconciled tables with the frames returned by compare_and_output.
+
+    All tables are replaced in one transaction, so readers see either the
+    previous run's sets or this run's. `suffix` names another set of the
+    tables, e.g. an exchange partition's. Returns rows loaded per frame
+    and the number of statements sent to SQLite.
+    """
+    ensure_reconciled_schema(conn, suffix)
+    stats = {'round_trips': 2}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table, columns in RECONCILED_TABLES.items():
+            rows = _sql_values(frames[table], columns)
+            conn.execute(f"DELETE FROM {table}{suffix}")
+            for start in range(0, len(rows), batch_size):
+                conn.executemany(f"INSERT INTO {table}{suffix} ({', '.join(columns)}) "
+                                 f"VALUES ({', '.join('?' for _ in columns)})", rows[start:start + batch_size])
+                stats['round_trips'] += 1
+            stats[table] = len(rows)
+            stats['round_trips'] += 1
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return stats
+
+def load_reconciled(frames, db_path=None, suffix=''):
+    """Load the reconciled frames into the SQLITE_DB_PATH database (or db_path); see upsert_reconciled."""
+    conn = connect_sqlite(db_path or config('SQLITE_DB_PATH', default='nse.db'))
+    try:
+        stats = upsert_reconciled(conn, frames, suffix=suffix)
+    finally:
+        conn.close()
+    print("Loaded reconciled tables to SQLite: "
+          + ', '.join(f"{table}{suffix} ({stats[table]})" for table in RECONCILED_TABLES) + ".")
+    return stats
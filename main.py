@@ -1,32 +1,107 @@
-from extract import extract_upstox_data, extract_dhan_data
-from transform import transform_upstox_data, transform_dhan_data
-from load import load_to_mongodb, load_to_sql
-from compare import compare_and_output
-
-def run_etl_pipeline():
-    """Run the NSE ETL pipeline."""
-    try:
-        print("Starting NSE ETL pipeline...")
-        
-        print("Step 1: Extracting data...")
-        upstox_df = extract_upstox_data()
-        dhan_df = extract_dhan_data()
-        
-        print("Step 2: Transforming data...")
-        upstox_transformed = transform_upstox_data(upstox_df)
-        dhan_transformed = transform_dhan_data(dhan_df)
-        
-        print("Step 3: Loading data...")
-        load_to_mongodb(upstox_transformed)
-        load_to_sql(dhan_transformed)
-        
-        print("Step 4: Comparing and generating outputs...")
-        compare_and_output(upstox_transformed, dhan_transformed)
-        
-        print("NSE ETL pipeline completed successfully!")
-    except Exception as e:
-        print(f"Pipeline failed: {e}")
-        raise
-
-if __name__ == "__main__":
-    run_etl_pipeline()
\ No newline at end of file
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from transform import load_symbol_memo, save_symbol_memo
+from compare import OUTPUT_NAMES
+from sinks import output_paths
+from cache import sources_unchanged, record_run
+from dag import nse_stages, run_graph
+from metrics import RunMetrics
+from engines import get_engine
+import diagnostics
+
+def extract_and_transform(extract, transform, stream=False, path=None, metrics=None, source='source', scan=False):
+    """Extract one source and transform it as soon as it is available.
+
+    Both steps are recorded as stages extract_<source> and
+    transform_<source> of `metrics`. With scan=True the transform reads
+    the local file at `path` itself and there is no extract stage.
+    """
+    metrics = metrics or RunMetrics(source)
+    if scan:
+        return metrics.run(f"transform_{source}", transform, path)
+    raw = metrics.run(f"extract_{source}", extract, stream=stream, path=path)
+    return metrics.run(f"transform_{source}", transform, raw, rows_in=len(raw))
+
+def run_etl_pipeline(stream=False, use_cache=True, concurrent=True, delta=False, output_formats=('csv',),
+                     profile=False, diagnostics_level=None, engine=None):
+    """Run the NSE ETL pipeline.
+
+    The pipeline is the stage graph of dag.nse_stages, run without
+    checkpoints by dag.run_graph.
+    With stream=True the sources are filtered to NSE Equity while downloading.
+    With use_cache=True the sources are fetched through the local source cache,
+    and the run stops early when neither changed since the last successful run.
+    With concurrent=True independent stages (each source's extract and
+    transform, then the loads and compare) run in parallel threads;
+    otherwise one stage runs at a time.
+    With delta=True only rows added, modified or removed since the previous
+    run's snapshot are loaded, and the changes are appended to
+    output/changelog.csv.
+    Both transformed frames are checked against validate.RULES before
+    anything is loaded; a frame that fails stops the run, and the report is
+    written to output/validation_report.json either way.
+    The reconciled sets are also loaded as the common_stocks, only_in_upstox
+    and only_in_dhan tables of the SQLite database; see query.py.
+    Every run's reconciled mapping is versioned in the instrument_history
+    table for as-of lookups; see history.py.
+    output_formats lists the sinks the reconciled outputs are written to
+    (csv, parquet, feather).
+    Per-stage metrics are written to a JSON run report and a Prometheus
+    textfile in metrics.METRICS_DIR; with profile=True every stage is also
+    dumped as a cProfile .prof file.
+    diagnostics_level ('off', 'summary' or 'debug') overrides the
+    ETL_DIAGNOSTICS setting for transform and compare diagnostics.
+    engine ('pandas' or 'polars') picks the dataframe engine transform and
+    compare run on, overriding the ETL_ENGINE setting; see engines.py.
+    """
+    if diagnostics_level is not None:
+        diagnostics.set_level(diagnostics_level)
+    metrics = RunMetrics('main', profile=profile)
+    try:
+        print("Starting NSE ETL pipeline...")
+        symbol_memo = load_symbol_memo()
+        # Engines that read files themselves fuse the read into their query plan
+        scan = get_engine(engine).reads_paths and use_cache and not stream
+        stages = nse_stages(stream, output_formats, symbol_memo, engine, delta, scan)
+        sources = [stage for stage in stages if stage.kind == 'source']
+        # Without the cache each source is downloaded by its extract stage
+        fetched = {stage.name: (None, None) for stage in sources}
+        if use_cache:
+            with ThreadPoolExecutor(max_workers=2 if concurrent else 1) as pool:
+                jobs = {stage.name: pool.submit(metrics.run, stage.name, stage.func) for stage in sources}
+                fetched = {name: job.result() for name, job in jobs.items()}
+            source_hashes = {'upstox': fetched['fetch_upstox'][1], 'dhan': fetched['fetch_dhan'][1]}
+            # Outputs in a format the previous run did not write still need the run
+            if sources_unchanged(source_hashes) and all(
+                    os.path.exists(path) for path in output_paths(OUTPUT_NAMES, output_formats)):
+                print("Sources unchanged since last run; reusing previous outputs.")
+                metrics.finish('unchanged')
+                return
+
+        run_graph([stage for stage in stages if stage.kind != 'source'], checkpoint_dir=None,
+                  max_workers=4 if concurrent else 1, metrics=metrics, given=fetched)
+        save_symbol_memo(symbol_memo)
+        if use_cache:
+            record_run(source_hashes)
+        print("NSE ETL pipeline completed successfully!")
+        print(f"Run report written to {metrics.finish('success')}")
+    except Exception as e:
+        print(f"Pipeline failed: {e}")
+        metrics.finish('failed')
+        raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the NSE ETL pipeline once.")
+    parser.add_argument('--stream', action='store_true', help="filter sources while downloading")
+    parser.add_argument('--no-cache', action='store_true', help="download both sources even if unchanged")
+    parser.add_argument('--sequential', action='store_true', help="process Upstox fully before Dhan")
+    parser.add_argument('--delta', action='store_true', help="only load rows changed since the previous run")
+    parser.add_argument('--formats', nargs='+', default=['csv'], help="output formats (csv, parquet, feather)")
+    parser.add_argument('--profile', action='store_true', help="dump a cProfile file per stage")
+    parser.add_argument('--diagnostics', choices=['off', 'summary', 'debug'], help="diagnostics level")
+    parser.add_argument('--engine', choices=['pandas', 'polars'], help="dataframe engine (default: ETL_ENGINE)")
+    args = parser.parse_args()
+    run_etl_pipeline(args.stream, not args.no_cache, not args.sequential, args.delta, args.formats, args.profile,
+                     args.diagnostics, args.engine)
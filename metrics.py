@@ -0,0 +1,182 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from decouple import config
+
+try:
+    import resource
+except ImportError:
+    # Windows has no getrusage; peak RSS is then reported as None
+    resource = None
+
+# Run reports, Prometheus textfiles and profiles; point METRICS_DIR at the
+# node_exporter textfile collector directory to have the .prom files scraped
+METRICS_DIR = config('METRICS_DIR', default=os.path.join('output', 'metrics'))
+
+# (metric name, stage record field, help text) exported per stage
+STAGE_GAUGES = [
+    ('etl_stage_wall_seconds', 'wall_seconds', 'Wall-clock time of the stage.'),
+    ('etl_stage_cpu_seconds', 'cpu_seconds', 'Process CPU time spent during the stage.'),
+    ('etl_stage_rows_in', 'rows_in', 'Rows passed into the stage.'),
+    ('etl_stage_rows_out', 'rows_out', 'Rows produced by the stage.'),
+    ('etl_stage_bytes_downloaded', 'bytes_downloaded', 'Bytes downloaded by the stage.'),
+    ('etl_stage_peak_rss_bytes', 'peak_rss_bytes', 'Process peak RSS at the end of the stage.'),
+    ('etl_stage_db_round_trips', 'db_round_trips', 'Database round trips made by the stage.'),
+]
+
+# The stage record of the stage running on each thread
+_active = threading.local()
+
+def peak_rss_bytes():
+    """Return the peak resident set size of this process so far, or None where it is unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def record_bytes_downloaded(size):
+    """Add `size` downloaded bytes to the stage running on this thread, if any."""
+    record = getattr(_active, 'stage', None)
+    if record is not None:
+        record['bytes_downloaded'] += size
+
+class RunMetrics:
+    """Per-stage metrics of one pipeline run.
+
+    Stages may run concurrently from several threads. CPU time and peak RSS
+    are process-wide, so overlapping stages share them. With profile=True
+    each stage is also run under cProfile and dumped to
+    <metrics_dir>/profiles/<pipeline>-<run id>/<stage>.prof.
+    """
+
+    def __init__(self, pipeline, profile=False, metrics_dir=METRICS_DIR):
+        self.pipeline = pipeline
+        self.profile = profile
+        self.metrics_dir = metrics_dir
+        self.run_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.started_at = time.time()
+        self.stages = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Time the enclosed block as stage `name` and yield its record.
+
+        The block may fill in rows_out and db_round_trips; downloads made on
+        this thread are counted through record_bytes_downloaded.
+        """
+        record = {'stage': name, 'status': 'running', 'wall_seconds': None, 'cpu_seconds': None,
+                  'rows_in': rows_in, 'rows_out': None, 'bytes_downloaded': 0, 'peak_rss_bytes': None,
+                  'db_round_trips': 0}
+        with self._lock:
+            self.stages.append(record)
+        outer, _active.stage = getattr(_active, 'stage', None), record
+        profiler = self._start_profiler(name)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+            record['status'] = 'success'
+        except BaseException:
+            record['status'] = 'failed'
+            raise
+        finally:
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+            record['peak_rss_bytes'] = peak_rss_bytes()
+            _active.stage = outer
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+
+    def run(self, name, func, *args, rows_in=None, **kwargs):
+        """Call func(*args, **kwargs) as stage `name` and return its result.
+
+        rows_out is taken from a DataFrame result and db_round_trips from a
+        loader stats dict.
+        """
+        with self.stage(name, rows_in=rows_in) as record:
+            result = func(*args, **kwargs)
+            if hasattr(result, 'columns'):
+                record['rows_out'] = len(result)
+            elif isinstance(result, dict) and 'round_trips' in result:
+                record['db_round_trips'] = result['round_trips']
+        return result
+
+    @property
+    def profile_dir(self):
+        return os.path.join(self.metrics_dir, 'profiles', f"{self.pipeline}-{self.run_id}")
+
+    def _start_profiler(self, name):
+        if not self.profile:
+            return None
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler per process
+            print(f"Warning: another stage is being profiled; not profiling {name}.")
+            return None
+        return profiler
+
+    def report(self, status):
+        """Return the run report as a dict."""
+        with self._lock:
+            stages = [dict(record) for record in self.stages]
+        return {
+            'pipeline': self.pipeline,
+            'run_id': self.run_id,
+            'status': status,
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            'duration_seconds': time.time() - self.started_at,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'stages': stages,
+        }
+
+    def finish(self, status='success'):
+        """Write the JSON run report and Prometheus textfile; return the report path.
+
+        Both files are replaced atomically so a collector never reads a
+        partial file.
+        """
+        report = self.report(status)
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        report_path = os.path.join(self.metrics_dir, f"{self.pipeline}_run_report.json")
+        _write_atomic(report_path, json.dumps(report, indent=2))
+        _write_atomic(os.path.join(self.metrics_dir, f"{self.pipeline}.prom"), prometheus_text(report))
+        return report_path
+
+def prometheus_text(report):
+    """Render a run report in the Prometheus text exposition format."""
+    pipeline = report['pipeline']
+    lines = [
+        '# HELP etl_run_success Whether the last run succeeded (1) or failed (0).',
+        '# TYPE etl_run_success gauge',
+        f'etl_run_success{{pipeline="{pipeline}"}} {0 if report["status"] == "failed" else 1}',
+        '# HELP etl_run_duration_seconds Wall-clock time of the last run.',
+        '# TYPE etl_run_duration_seconds gauge',
+        f'etl_run_duration_seconds{{pipeline="{pipeline}"}} {report["duration_seconds"]:.6f}',
+        '# HELP etl_run_timestamp_seconds Start time of the last run.',
+        '# TYPE etl_run_timestamp_seconds gauge',
+        f'etl_run_timestamp_seconds{{pipeline="{pipeline}"}} '
+        f'{datetime.fromisoformat(report["started_at"]).timestamp():.0f}',
+    ]
+    for metric, field, help_text in STAGE_GAUGES:
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} gauge']
+        for record in report['stages']:
+            if record[field] is not None:
+                lines.append(f'{metric}{{pipeline="{pipeline}",stage="{record["stage"]}"}} {record[field]}')
+    return '\n'.join(lines) + '\n'
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
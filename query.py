@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from decouple import config
+
+from load import RECONCILED_TABLES, SQL_COLUMNS
+
+# Read connections kept open per pool
+POOL_SIZE = config('SQLITE_READ_POOL_SIZE', default=4, cast=int)
+# Prepared statements cached per connection; executing the same SQL text
+# again reuses its compiled statement instead of parsing it anew
+STATEMENT_CACHE_SIZE = 64
+LOOKUP_KEYS = ['trading_symbol', 'isin', 'security_id']
+
+Reconciled = namedtuple('Reconciled', SQL_COLUMNS + ['match_tier', 'source'])
+# Reconciled table -> source recorded for its rows, as in symbol_index.SOURCES
+TABLE_SOURCES = {'common_stocks': 'both', 'only_in_upstox': 'upstox', 'only_in_dhan': 'dhan'}
+
+def _reconciled_sql(condition):
+    """Return one query over all reconciled tables, each part an index search on `condition`."""
+    columns = ', '.join(SQL_COLUMNS)
+    return ' UNION ALL '.join(
+        f"SELECT {columns}, {'match_tier' if 'match_tier' in table_columns else 'NULL'}, '{TABLE_SOURCES[table]}' "
+        f"FROM {table} WHERE {condition}"
+        for table, table_columns in RECONCILED_TABLES.items())
+
+# The SQL of every query is built once, so each connection prepares it once.
+# Batches pass their values as one JSON array, so a batch of any size is
+# the same statement.
+QUERIES = {
+    **{('one', key): _reconciled_sql(f"{key} = :value") for key in LOOKUP_KEYS},
+    **{('many', key): _reconciled_sql(f"{key} IN (SELECT value FROM json_each(:values))") for key in LOOKUP_KEYS},
+    ('dhan', 'trading_symbol'): f"SELECT {', '.join(SQL_COLUMNS)} FROM dhan_nse WHERE trading_symbol = :value",
+    ('dhan', 'isin'): f"SELECT {', '.join(SQL_COLUMNS)} FROM dhan_nse WHERE isin = :value",
+    ('dhan', 'security_id'): f"SELECT {', '.join(SQL_COLUMNS)} FROM dhan_nse WHERE security_id = :value",
+}
+
+def _check_key(key):
+    if key not in LOOKUP_KEYS:
+        raise ValueError(f"Unknown lookup key {key!r}. Choose from {LOOKUP_KEYS}.")
+
+class ReadPool:
+    """Pool of read-only connections to the SQLite database for lookups.
+
+    Connections open lazily, up to `size`, and are shared by threads; a
+    thread borrows one per query. They are opened read-only, so a service
+    cannot write through them, and with WAL they keep reading the last
+    committed load while a new one runs.
+    """
+
+    def __init__(self, db_path=None, size=POOL_SIZE):
+        self.db_path = db_path or config('SQLITE_DB_PATH', default='nse.db')
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if not os.path.exists(self.db_path):
+            raise FileNotFoundError(f"SQLite database {self.db_path} does not exist; run the pipeline first.")
+        uri = pathlib.Path(os.path.abspath(self.db_path)).as_uri() + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, opening one if fewer than `size` are open."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                opening = self._opened < self.size
+                if opening:
+                    self._opened += 1
+            if opening:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        """Close the idle connections; borrowed ones close when returned and closed again."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+    def _fetch(self, query, params):
+        with self.connection() as conn:
+            return conn.execute(QUERIES[query], params).fetchall()
+
+    def lookup(self, value, key='trading_symbol'):
+        """Return the reconciled rows whose `key` is `value`, from any of the three sets.
+
+        A symbol is in exactly one set; an ISIN can be listed by several
+        symbols.
+        """
+        _check_key(key)
+        return [Reconciled(*row) for row in self._fetch(('one', key), {'value': value})]
+
+    def lookup_many(self, values, key='trading_symbol'):
+        """Return {value: [Reconciled]} for many values in one query; unknown values map to []."""
+        _check_key(key)
+        values = list(dict.fromkeys(values))
+        found = {value: [] for value in values}
+        rows = self._fetch(('many', key), {'values': json.dumps(values)})
+        position = SQL_COLUMNS.index(key)
+        for row in rows:
+            found[row[position]].append(Reconciled(*row))
+        return found
+
+    def dhan_instrument(self, value, key='trading_symbol'):
+        """Return the dhan_nse row whose `key` is `value` as a dict, or None."""
+        _check_key(key)
+        rows = self._fetch(('dhan', key), {'value': value})
+        return dict(zip(SQL_COLUMNS, rows[0])) if rows else None
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide ReadPool of the SQLITE_DB_PATH database."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ReadPool()
+        return _pool
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look up reconciled instruments in the SQLite database.")
+    parser.add_argument('values', nargs='+', help="symbols (or other keys, see --by) to look up")
+    parser.add_argument('--by', choices=LOOKUP_KEYS, default='trading_symbol', help="lookup key")
+    parser.add_argument('--db', help="database path (default: SQLITE_DB_PATH)")
+    args = parser.parse_args()
+    pool = ReadPool(args.db)
+    values = [int(value) for value in args.values] if args.by == 'security_id' else args.values
+    for value, rows in pool.lookup_many(values, args.by).items():
+        print(f"{value}: {rows if rows else 'not found'}")
+    pool.close()
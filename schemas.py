@@ -0,0 +1,89 @@
+try:
+    import pyarrow  # noqa: F401 - enables Arrow-backed string columns
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    STRING_DTYPE = 'object'
+
+# Per-source read schema shared by every extract path:
+#   usecols - columns read from the raw file (absent optional ones are skipped)
+#   dtype   - compact dtypes; low-cardinality columns are categorical
+#   rename  - raw column -> canonical output column
+UPSTOX_SCHEMA = {
+    'usecols': ['instrument_key', 'tradingsymbol', 'name', 'tick_size', 'instrument_type',
+                'exchange', 'isin', 'short_name'],
+    'dtype': {
+        'instrument_key': STRING_DTYPE,
+        'tradingsymbol': STRING_DTYPE,
+        'name': STRING_DTYPE,
+        'isin': STRING_DTYPE,
+        'short_name': STRING_DTYPE,
+        'tick_size': 'float64',
+        'exchange': 'category',
+        'instrument_type': 'category',
+        'option_type': 'category',
+    },
+    'rename': {'tradingsymbol': 'trading_symbol'},
+}
+
+DHAN_SCHEMA = {
+    'usecols': ['SEM_EXM_EXCH_ID', 'SEM_SEGMENT', 'SEM_INSTRUMENT_NAME', 'SEM_SMST_SECURITY_ID',
+                'SEM_TRADING_SYMBOL', 'SEM_SERIES', 'SM_SYMBOL_NAME', 'ISIN'],
+    'dtype': {
+        'SEM_EXM_EXCH_ID': 'category',
+        'SEM_SEGMENT': 'category',
+        'SEM_INSTRUMENT_NAME': 'category',
+        'SEM_EXCH_INSTRUMENT_TYPE': 'category',
+        'SEM_OPTION_TYPE': 'category',
+        'SEM_SERIES': 'category',
+        'SEM_SMST_SECURITY_ID': 'Int64',
+        'SEM_TRADING_SYMBOL': STRING_DTYPE,
+        'SM_SYMBOL_NAME': STRING_DTYPE,
+        'ISIN': STRING_DTYPE,
+    },
+    'rename': {
+        'SEM_EXM_EXCH_ID': 'exchange',
+        'SM_SYMBOL_NAME': 'symbol_name',
+        'SEM_SMST_SECURITY_ID': 'security_id',
+        'SEM_TRADING_SYMBOL': 'trading_symbol',
+        'ISIN': 'isin',
+    },
+}
+
+# Kite instruments dump (CSV)
+ZERODHA_SCHEMA = {
+    'usecols': ['instrument_token', 'exchange_token', 'tradingsymbol', 'name', 'instrument_type',
+                'segment', 'exchange'],
+    'dtype': {
+        'instrument_token': 'Int64',
+        'exchange_token': 'Int64',
+        'tradingsymbol': STRING_DTYPE,
+        'name': STRING_DTYPE,
+        'instrument_type': 'category',
+        'segment': 'category',
+        'exchange': 'category',
+    },
+    'rename': {'tradingsymbol': 'trading_symbol'},
+}
+
+# Angel One SmartAPI scrip master (a JSON array of records, all values strings)
+ANGEL_SCHEMA = {
+    'usecols': ['token', 'symbol', 'name', 'instrumenttype', 'exch_seg'],
+    'dtype': {
+        'token': 'Int64',
+        'symbol': STRING_DTYPE,
+        'name': STRING_DTYPE,
+        'instrumenttype': 'category',
+        'exch_seg': 'category',
+    },
+    'rename': {'symbol': 'trading_symbol'},
+}
+
+def read_csv_kwargs(schema):
+    """Return pd.read_csv keyword arguments applying `schema`."""
+    wanted = set(schema['usecols'])
+    return {'usecols': lambda col: col in wanted, 'dtype': schema['dtype']}
+
+def apply_dtypes(df, schema):
+    """Re-apply the schema dtypes to df, e.g. after concatenating chunks."""
+    dtypes = {col: dtype for col, dtype in schema['dtype'].items() if col in df.columns}
+    return df.astype(dtypes)
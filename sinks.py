@@ -0,0 +1,114 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as parquet
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+OUTPUT_DIR = 'output'
+
+# Explicit dtypes of the reconciled output columns; other columns keep theirs
+OUTPUT_SCHEMA = {
+    'exchange': 'string',
+    'instrument_key': 'string',
+    'symbol_name': 'string',
+    'security_id': 'Int64',
+    'short_name': 'string',
+    'name': 'string',
+    'isin': 'string',
+    'trading_symbol': 'string',
+    'match_tier': 'string',
+}
+
+# Parquet is compressed for storage; Feather stays uncompressed so readers can memory-map it
+PARQUET_COMPRESSION = 'zstd'
+FEATHER_COMPRESSION = 'uncompressed'
+
+def apply_output_schema(df):
+    """Cast the known output columns of df to OUTPUT_SCHEMA dtypes."""
+    df = df.copy()
+    for col, dtype in OUTPUT_SCHEMA.items():
+        if col not in df.columns:
+            continue
+        if dtype == 'Int64':
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+        else:
+            df[col] = df[col].astype(object).where(df[col].notna(), None).astype(dtype)
+    return df
+
+def _require_pyarrow(fmt):
+    """Raise a helpful error when a pyarrow-backed sink is requested without pyarrow."""
+    if not HAS_PYARROW:
+        raise ImportError(f"pyarrow is required for the {fmt} output sink (pip install pyarrow).")
+
+def write_csv(df, path):
+    """Write df as CSV."""
+    df.to_csv(path, index=False)
+
+def write_parquet(df, path):
+    """Write df as Parquet with the output schema applied."""
+    _require_pyarrow('parquet')
+    table = pa.Table.from_pandas(apply_output_schema(df), preserve_index=False)
+    parquet.write_table(table, path, compression=PARQUET_COMPRESSION)
+
+def write_feather(df, path):
+    """Write df as Arrow Feather with the output schema applied."""
+    _require_pyarrow('feather')
+    table = pa.Table.from_pandas(apply_output_schema(df), preserve_index=False)
+    feather.write_feather(table, path, compression=FEATHER_COMPRESSION)
+
+# Output format -> (file extension, writer)
+SINKS = {
+    'csv': ('.csv', write_csv),
+    'parquet': ('.parquet', write_parquet),
+    'feather': ('.feather', write_feather),
+}
+
+def output_paths(names, formats=('csv',), output_dir=OUTPUT_DIR):
+    """Return the paths write_outputs writes each of `names` to in every format."""
+    unknown = set(formats) - set(SINKS)
+    if unknown:
+        raise ValueError(f"Unknown output formats: {sorted(unknown)}. Choose from {sorted(SINKS)}.")
+    return [os.path.join(output_dir, name + SINKS[fmt][0]) for fmt in formats for name in names]
+
+def write_atomic(writer, df, path):
+    """Write df through writer to a temp file next to path, then rename it into place."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        writer(df, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+def write_outputs(frames, formats=('csv',), output_dir=OUTPUT_DIR):
+    """Write each {name: DataFrame} in every format, in parallel and atomically.
+
+    Returns the written paths.
+    """
+    unknown = set(formats) - set(SINKS)
+    if unknown:
+        raise ValueError(f"Unknown output formats: {sorted(unknown)}. Choose from {sorted(SINKS)}.")
+    if not frames or not formats:
+        return []
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = []
+    with ThreadPoolExecutor(max_workers=len(frames) * len(formats)) as pool:
+        for fmt in formats:
+            ext, writer = SINKS[fmt]
+            for name, df in frames.items():
+                path = os.path.join(output_dir, name + ext)
+                jobs.append(pool.submit(write_atomic, writer, df, path))
+        return [job.result() for job in jobs]
+
+def read_feather_output(name, output_dir=OUTPUT_DIR):
+    """Memory-map a Feather output as a pyarrow Table without parsing it."""
+    _require_pyarrow('feather')
+    return feather.read_table(os.path.join(output_dir, name + '.feather'), memory_map=True)
@@ -0,0 +1,178 @@
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from cache import fetch_source
+from compare import reconcile_sources
+from extract import UPSTOX_URL, DHAN_URL, open_source, read_csv_filtered, read_json_records
+from metrics import RunMetrics
+from schemas import UPSTOX_SCHEMA, DHAN_SCHEMA, ZERODHA_SCHEMA, ANGEL_SCHEMA
+from sinks import write_outputs, OUTPUT_DIR
+from transform import (upstox_equity_mask, dhan_equity_mask, zerodha_equity_mask, angel_equity_mask,
+                       isin_from_instrument_key, normalize_trading_symbols, drop_invalid_symbols,
+                       load_symbol_memo, save_symbol_memo)
+
+ZERODHA_URL = "https://api.kite.trade/instruments/NSE"
+ANGEL_URL = "https://margincalculator.angelbroking.com/OpenAPI_File/files/OpenAPIScripMaster.json"
+
+PRESENCE_OUTPUT = 'presence_matrix'
+# Columns every adapter's normalize returns, besides the source's id columns
+SOURCE_COLUMNS = ['trading_symbol', 'isin', 'name']
+
+# A source adapter is all the N-way reconciliation knows about one broker's
+# instrument dump:
+#   label             - name used in messages
+#   url, cache_name   - where the dump is fetched from and its file in cache/
+#   is_gzipped        - whether the file is gzip-compressed
+#   schema            - read schema, as in schemas.py
+#   read              - (file object, schema, row filter) -> (frame, raw rows),
+#                       e.g. extract.read_csv_filtered
+#   filter            - raw frame -> boolean mask of its NSE Equity rows
+#   normalize         - filtered frame -> SOURCE_COLUMNS plus the id columns,
+#                       trading symbols still as the broker spells them
+#   ids               - broker-specific id columns, output as <source>_<column>
+SourceAdapter = namedtuple('SourceAdapter', ['label', 'url', 'cache_name', 'is_gzipped', 'schema', 'read',
+                                             'filter', 'normalize', 'ids'])
+
+def _column(df, column):
+    """Return df[column], or a column of None if the dump does not have it."""
+    return df[column] if column in df.columns else pd.Series(None, index=df.index, dtype=object)
+
+def normalize_upstox(df):
+    isins = _column(df, 'isin').astype(object)
+    return pd.DataFrame({
+        'trading_symbol': df['tradingsymbol'],
+        'isin': isins.where(isins.notna(), isin_from_instrument_key(df['instrument_key'])),
+        'name': df['name'],
+        'instrument_key': df['instrument_key'],
+    })
+
+def normalize_dhan(df):
+    return pd.DataFrame({
+        'trading_symbol': df['SEM_TRADING_SYMBOL'],
+        'isin': _column(df, 'ISIN'),
+        'name': _column(df, 'SM_SYMBOL_NAME'),
+        'security_id': df['SEM_SMST_SECURITY_ID'],
+    })
+
+def normalize_zerodha(df):
+    # The Kite dump carries no ISIN
+    return pd.DataFrame({
+        'trading_symbol': df['tradingsymbol'],
+        'isin': None,
+        'name': df['name'],
+        'instrument_token': df['instrument_token'],
+        'exchange_token': df['exchange_token'],
+    })
+
+def normalize_angel(df):
+    # Neither does Angel's; the series suffix of its symbols is stripped by normalize_trading_symbols
+    return pd.DataFrame({
+        'trading_symbol': df['symbol'],
+        'isin': None,
+        'name': df['name'],
+        'token': df['token'],
+    })
+
+# Source -> adapter. Upstox and Dhan share the cache files of main.py.
+SOURCES = {
+    'upstox': SourceAdapter('Upstox', UPSTOX_URL, 'upstox_nse.csv.gz', True, UPSTOX_SCHEMA, read_csv_filtered,
+                            upstox_equity_mask, normalize_upstox, ['instrument_key']),
+    'dhan': SourceAdapter('Dhan', DHAN_URL, 'dhan_scrip.csv', False, DHAN_SCHEMA, read_csv_filtered,
+                          dhan_equity_mask, normalize_dhan, ['security_id']),
+    'zerodha': SourceAdapter('Zerodha', ZERODHA_URL, 'zerodha_nse.csv', False, ZERODHA_SCHEMA, read_csv_filtered,
+                             zerodha_equity_mask, normalize_zerodha, ['instrument_token', 'exchange_token']),
+    'angel': SourceAdapter('Angel', ANGEL_URL, 'angel_scrip.json', False, ANGEL_SCHEMA, read_json_records,
+                           angel_equity_mask, normalize_angel, ['token']),
+}
+
+def _adapter(name):
+    if name not in SOURCES:
+        raise ValueError(f"Unknown source {name!r}. Choose from {sorted(SOURCES)}.")
+    return SOURCES[name]
+
+def fetch(name):
+    """Fetch the dump of source `name` through the cache; returns its local path."""
+    adapter = _adapter(name)
+    return fetch_source(adapter.url, adapter.cache_name)[0]
+
+def extract_source(name, path):
+    """Read the NSE Equity rows of source `name` from the local file at `path`."""
+    adapter = _adapter(name)
+    print(f"Reading {adapter.label} data from {path}...")
+    with open_source(adapter.url, path, is_gzipped=adapter.is_gzipped) as f:
+        df, raw_rows = adapter.read(f, adapter.schema, adapter.filter)
+    print(f"{adapter.label} read {raw_rows} rows, kept {len(df)} NSE Equity rows")
+    if not raw_rows:
+        raise ValueError(f"{adapter.label} dataset is empty.")
+    return df
+
+def transform_source(name, df, symbol_memo=None):
+    """Normalize extracted rows of source `name` to SOURCE_COLUMNS plus its id columns.
+
+    Trading symbols get the same cleanup as in the two-source pipeline,
+    and null and repeated symbols are dropped.
+    """
+    adapter = _adapter(name)
+    df = adapter.normalize(df)[SOURCE_COLUMNS + adapter.ids]
+    df['trading_symbol'] = normalize_trading_symbols(df['trading_symbol'], symbol_memo,
+                                                     label=f"{adapter.label} trading_symbol")
+    return drop_invalid_symbols(df, adapter.label).reset_index(drop=True)
+
+def run_sources(names=None, paths=None, output_formats=('csv',), output_dir=OUTPUT_DIR):
+    """Reconcile the NSE Equity universe of several brokers in one N-way pass.
+
+    Each source (default: all of SOURCES) is fetched through the cache, or
+    read from paths[name] when given (e.g. a local fixture file), then
+    extracted, filtered and normalized by its adapter. The presence matrix
+    of every symbol (see compare.reconcile_sources) is written to
+    output_dir/presence_matrix in each format. Returns the matrix.
+    """
+    names = list(names or SOURCES)
+    paths = dict(paths or {})
+    for name in [*names, *paths]:
+        _adapter(name)
+    metrics = RunMetrics('sources')
+    try:
+        remote = [name for name in names if name not in paths]
+        if remote:
+            with ThreadPoolExecutor(max_workers=len(remote)) as pool:
+                jobs = {name: pool.submit(metrics.run, f"fetch_{name}", fetch, name) for name in remote}
+                paths.update({name: job.result() for name, job in jobs.items()})
+
+        symbol_memo = load_symbol_memo()
+        frames = {}
+        for name in names:
+            raw = metrics.run(f"extract_{name}", extract_source, name, paths[name])
+            frames[name] = metrics.run(f"transform_{name}", transform_source, name, raw, symbol_memo,
+                                       rows_in=len(raw))
+        save_symbol_memo(symbol_memo)
+
+        matrix = metrics.run('reconcile', reconcile_sources, frames, {name: SOURCES[name].ids for name in names},
+                             rows_in=sum(len(df) for df in frames.values()))
+        written = metrics.run('write_outputs', write_outputs, {PRESENCE_OUTPUT: matrix}, output_formats, output_dir)
+        print(f"Output files generated: {', '.join(written)}")
+    except Exception as e:
+        print(f"Multi-source reconciliation failed: {e}")
+        metrics.finish('failed')
+        raise
+    print(f"Run report written to {metrics.finish('success')}")
+    return matrix
+
+def _source_path(value):
+    name, sep, path = value.partition('=')
+    if not sep or not path:
+        raise argparse.ArgumentTypeError(f"expected SOURCE=PATH, got {value!r}")
+    return name, path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile the instrument dumps of several brokers.")
+    parser.add_argument('--sources', nargs='+', default=list(SOURCES), choices=sorted(SOURCES))
+    parser.add_argument('--path', type=_source_path, action='append', default=[], metavar='SOURCE=PATH',
+                        help="read a source from a local file instead of fetching it (repeatable)")
+    parser.add_argument('--formats', nargs='+', default=['csv'], help="output formats (csv, parquet, feather)")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    args = parser.parse_args()
+    run_sources(args.sources, dict(args.path), args.formats, args.output_dir)
@@ -1,6 +1,60 @@
-CREATE TABLE IF NOT EXISTS dhan_nse (
-    security_id TEXT PRIMARY KEY,
-    symbol_name TEXT,
-    trading_symbol TEXT,
-    exchange TEXT
-);
\ No newline at end of file
+-- Canonical schema of the SQLite database. Tables are STRICT, so a value of
+-- the wrong type is rejected instead of being stored with TEXT affinity.
+
+-- Dhan instruments. Per-exchange tables are created from this definition.
+-- The UNIQUE constraint on trading_symbol doubles as its index.
+CREATE TABLE IF NOT EXISTS dhan_nse (
+    exchange TEXT,
+    instrument_key TEXT,
+    symbol_name TEXT,
+    security_id INTEGER PRIMARY KEY,
+    short_name TEXT,
+    name TEXT,
+    isin TEXT,
+    trading_symbol TEXT NOT NULL UNIQUE
+) STRICT;
+CREATE INDEX IF NOT EXISTS dhan_nse_isin ON dhan_nse (isin);
+
+-- Reconciled outputs of compare_and_output, replaced on every run
+CREATE TABLE IF NOT EXISTS common_stocks (
+    exchange TEXT,
+    instrument_key TEXT,
+    symbol_name TEXT,
+    security_id INTEGER,
+    short_name TEXT,
+    name TEXT,
+    isin TEXT,
+    trading_symbol TEXT NOT NULL,
+    match_tier TEXT
+) STRICT;
+CREATE INDEX IF NOT EXISTS common_stocks_trading_symbol ON common_stocks (trading_symbol);
+CREATE INDEX IF NOT EXISTS common_stocks_isin ON common_stocks (isin);
+CREATE INDEX IF NOT EXISTS common_stocks_security_id ON common_stocks (security_id);
+
+CREATE TABLE IF NOT EXISTS only_in_upstox (
+    exchange TEXT,
+    instrument_key TEXT,
+    symbol_name TEXT,
+    security_id INTEGER,
+    short_name TEXT,
+    name TEXT,
+    isin TEXT,
+    trading_symbol TEXT NOT NULL
+) STRICT;
+CREATE INDEX IF NOT EXISTS only_in_upstox_trading_symbol ON only_in_upstox (trading_symbol);
+CREATE INDEX IF NOT EXISTS only_in_upstox_isin ON only_in_upstox (isin);
+CREATE INDEX IF NOT EXISTS only_in_upstox_security_id ON only_in_upstox (security_id);
+
+CREATE TABLE IF NOT EXISTS only_in_dhan (
+    exchange TEXT,
+    instrument_key TEXT,
+    symbol_name TEXT,
+    security_id INTEGER,
+    short_name TEXT,
+    name TEXT,
+    isin TEXT,
+    trading_symbol TEXT NOT NULL
+) STRICT;
+CREATE INDEX IF NOT EXISTS only_in_dhan_trading_symbol ON only_in_dhan (trading_symbol);
+CREATE INDEX IF NOT EXISTS only_in_dhan_isin ON only_in_dhan (isin);
+CREATE INDEX IF NOT EXISTS only_in_dhan_security_id ON only_in_dhan (security_id);
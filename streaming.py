@@ -0,0 +1,350 @@
+import argparse
+import queue
+import threading
+import time
+from functools import partial
+
+import pandas as pd
+from decouple import config
+from pymongo import MongoClient
+
+import diagnostics
+from extract import open_source, UPSTOX_URL, DHAN_URL, CHUNK_SIZE
+from transform import (transform_upstox_data, transform_dhan_data, upstox_equity_mask, dhan_equity_mask,
+                       load_symbol_memo, save_symbol_memo)
+from load import (bulk_upsert_mongodb, stored_hashes, open_sqlite_db, begin_sqlite_stage, stage_sqlite_rows,
+                  merge_sqlite_stage, load_reconciled)
+from compare import compare_and_output
+from cache import fetch_source
+from schemas import UPSTOX_SCHEMA, DHAN_SCHEMA, read_csv_kwargs
+from validate import ValidationError, validate_frame, validate_frames
+from history import load_history
+from dag import Stage, run_graph
+from metrics import RunMetrics
+
+# Batches a queue holds before its producer blocks. Memory in flight is
+# bounded by about (QUEUE_BATCHES + 1) batches per queue.
+QUEUE_BATCHES = 4
+# How often blocked producers and idle consumers check for a failed peer
+POLL_SECONDS = 0.1
+
+# Source -> how its batches are read and transformed
+SOURCES = {
+    'upstox': {'url': UPSTOX_URL, 'cache_name': 'upstox_nse.csv.gz', 'is_gzipped': True,
+               'schema': UPSTOX_SCHEMA, 'mask': upstox_equity_mask, 'transform': transform_upstox_data},
+    'dhan': {'url': DHAN_URL, 'cache_name': 'dhan_scrip.csv', 'is_gzipped': False,
+             'schema': DHAN_SCHEMA, 'mask': dhan_equity_mask, 'transform': transform_dhan_data},
+}
+
+class Cancelled(Exception):
+    """Raised in a producer or consumer when another one has failed."""
+
+class BoundedQueue:
+    """A bounded queue of transformed batches whose put/get give up when the run is cancelled.
+
+    Items are (source, batch number, DataFrame, perf_counter() when queued)
+    tuples; a batch number of None marks the end of that source.
+    """
+
+    def __init__(self, name, cancelled, maxsize=QUEUE_BATCHES):
+        self.name = name
+        self.cancelled = cancelled
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, item):
+        """Put item, blocking while the queue is full; return the seconds spent blocked."""
+        start = time.perf_counter()
+        while True:
+            if self.cancelled.is_set():
+                raise Cancelled(self.name)
+            try:
+                self._queue.put(item, timeout=POLL_SECONDS)
+                return time.perf_counter() - start
+            except queue.Full:
+                continue
+
+    def get(self):
+        while True:
+            if self.cancelled.is_set():
+                raise Cancelled(self.name)
+            try:
+                return self._queue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+def _latency_summary(batches):
+    """Summarize per-batch latencies of a sink for the run report."""
+    if not batches:
+        return {}
+    latency = pd.Series([batch['latency_seconds'] for batch in batches])
+    return {'batch_count': len(batches), 'batch_latency_p50_seconds': latency.quantile(0.5),
+            'batch_latency_p95_seconds': latency.quantile(0.95), 'batch_latency_max_seconds': latency.max()}
+
+def produce(source, path, outputs, metrics, symbol_memo, batch_size=CHUNK_SIZE):
+    """Read, filter and transform one source batch by batch and queue each batch to `outputs`.
+
+    Symbols already sent in an earlier batch are dropped, as a whole-frame
+    transform keeps only the first row of a repeated symbol. A full output
+    queue blocks the producer, which stops reading the source until the
+    slowest consumer catches up. The end marker is only queued once the
+    source was read completely; if reading fails the run is cancelled
+    instead, so no sink mistakes a partial stream for the whole source.
+    """
+    spec = SOURCES[source]
+    seen = set()
+    with metrics.stage(f"stream_{source}") as record:
+        record.update({'rows_in': 0, 'rows_out': 0, 'batches': 0, 'blocked_seconds': 0.0})
+        try:
+            with open_source(spec['url'], path, is_gzipped=spec['is_gzipped']) as f:
+                for chunk in pd.read_csv(f, chunksize=batch_size, **read_csv_kwargs(spec['schema'])):
+                    record['rows_in'] += len(chunk)
+                    chunk = chunk[spec['mask'](chunk)]
+                    if chunk.empty:
+                        continue
+                    df = spec['transform'](chunk, symbol_memo=symbol_memo)
+                    repeated = df['trading_symbol'].isin(seen)
+                    if repeated.any():
+                        diagnostics.warning("Warning: %d %s trading_symbol rows repeat an earlier batch; "
+                                            "keeping the first.", repeated.sum(), source)
+                        df = df[~repeated]
+                    seen.update(df['trading_symbol'])
+                    batch = (source, record['batches'], df, time.perf_counter())
+                    for output in outputs:
+                        record['blocked_seconds'] += output.put(batch)
+                    record['batches'] += 1
+                    record['rows_out'] += len(df)
+            if not seen:
+                raise ValueError(f"No NSE Equity rows in the {source} stream.")
+        except BaseException:
+            # Cancel before any sink can see an end marker
+            for output in outputs:
+                output.cancelled.set()
+            raise
+        for output in outputs:
+            output.put((source, None, None, time.perf_counter()))
+
+def consume(name, inputs, sources, handle, metrics):
+    """Call handle(source, df, record) for every batch of `sources` arriving on `inputs` until all have ended.
+
+    Records per-batch queue wait, processing time and end-to-end latency
+    in the sink's stage record.
+    """
+    with metrics.stage(name) as record:
+        record.update({'rows_in': 0, 'batch_latencies': []})
+        ended = set()
+        while ended != set(sources):
+            source, number, df, produced_at = inputs.get()
+            if number is None:
+                ended.add(source)
+                continue
+            started = time.perf_counter()
+            handle(source, df, record)
+            finished = time.perf_counter()
+            record['rows_in'] += len(df)
+            record['batch_latencies'].append({
+                'source': source, 'batch': number, 'rows': len(df),
+                'queue_wait_seconds': started - produced_at,
+                'process_seconds': finished - started,
+                'latency_seconds': finished - produced_at,
+            })
+        record.update(_latency_summary(record['batch_latencies']))
+        return record
+
+def mongodb_sink(inputs, metrics, collection=None, collection_name='upstox_nse'):
+    """Validate every Upstox batch and upsert it into MongoDB as it arrives.
+
+    MongoDB cannot wait for the whole source to be validated, so each batch
+    is checked against RULES['upstox'] on its own first; a failing batch
+    raises ValidationError, which stops the run before it is written.
+    Failure rate limits apply per batch, which makes them stricter than on
+    the whole source. Stored content hashes are read once, so unchanged
+    documents are still skipped without a query per batch. Batches are
+    upserted, never deleted, so those written before a cancelled run stay
+    valid documents.
+    """
+    client = None
+    if collection is None:
+        client = MongoClient(config('MONGODB_URI'))
+        collection = client['market_data'][collection_name]
+    existing = stored_hashes(collection)
+    stats = {'upserted': 0, 'modified': 0, 'skipped': 0}
+
+    def handle(source, df, record):
+        report = validate_frame(df, source)
+        record['validation_seconds'] = record.get('validation_seconds', 0.0) + report['seconds']
+        if not report['passed']:
+            failed = [result['rule'] for result in report['rules'] if not result['passed']]
+            raise ValidationError(f"A {source} batch failed validation ({', '.join(failed)}); "
+                                  f"it was not written to MongoDB.", report)
+        batch_stats = bulk_upsert_mongodb(collection, df, resume=False, existing=existing)
+        for key in stats:
+            stats[key] += batch_stats[key]
+        record['db_round_trips'] += batch_stats['round_trips']
+
+    try:
+        record = consume('sink_mongodb', inputs, ['upstox'], handle, metrics)
+    finally:
+        if client is not None:
+            client.close()
+    # The stored_hashes query
+    record['db_round_trips'] += 1
+    print(f"Streamed {record['rows_in']} records to MongoDB {collection.name} collection: "
+          f"{stats['upserted']} inserted, {stats['modified']} updated, {stats['skipped']} unchanged.")
+    return stats
+
+def sqlite_sink(inputs, metrics, table='dhan_nse', validated=None):
+    """Stage every Dhan batch into SQLite as it arrives and merge them in one commit.
+
+    The whole stream is one transaction, as with load_to_sql, so readers
+    see the previous snapshot until the last batch is merged. With a
+    `validated` event the merge waits until it is set, i.e. until the whole
+    source passed validation. If the run is cancelled before the commit,
+    the transaction is rolled back rather than merging (and deleting rows
+    missing from) a partial or invalid stream.
+    """
+    conn = open_sqlite_db(table)
+    try:
+        statements = begin_sqlite_stage(conn, table)
+        try:
+            def handle(source, df, record):
+                record['db_round_trips'] += stage_sqlite_rows(conn, df, table=table)
+
+            record = consume('sink_sqlite', inputs, ['dhan'], handle, metrics)
+            while validated is not None and not validated.wait(POLL_SECONDS):
+                if inputs.cancelled.is_set():
+                    raise Cancelled(inputs.name)
+            if inputs.cancelled.is_set():
+                raise Cancelled(inputs.name)
+            stats = merge_sqlite_stage(conn, table=table, commit=False)
+            if inputs.cancelled.is_set():
+                raise Cancelled(inputs.name)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    # The statements opening the stage and the COMMIT
+    record['db_round_trips'] += statements + stats['round_trips'] + 1
+    print(f"Streamed {record['rows_in']} records to SQLite {table} table: "
+          f"{stats['inserted']} inserted, {stats['updated']} updated, {stats['deleted']} deleted.")
+    return stats
+
+def reconcile_sink(inputs, metrics):
+    """Collect both sources' batches until both streams end; return {source: whole frame}.
+
+    Validation and matching need every row of both sources (symbols, ISINs
+    and names must be unique across the whole source), so this sink only
+    buffers batches while the loaders write them, and returns nothing if
+    the run is cancelled.
+    """
+    frames = {'upstox': [], 'dhan': []}
+
+    def handle(source, df, record):
+        frames[source].append(df)
+
+    consume('sink_reconcile', inputs, ['upstox', 'dhan'], handle, metrics)
+    # A failed peer could have cancelled the run after both end markers were queued
+    if inputs.cancelled.is_set():
+        raise Cancelled(inputs.name)
+    return {source: pd.concat(batches, ignore_index=True) for source, batches in frames.items()}
+
+def cancel_on_failure(func, cancelled, failures):
+    """Wrap a stage function so that its failure cancels the run and is appended to `failures`.
+
+    Peers stopped by the cancellation raise Cancelled, which is not
+    appended, so failures[0] is the error that stopped the run.
+    """
+    def run(*args):
+        try:
+            return func(*args)
+        except Cancelled:
+            raise
+        except BaseException as e:
+            failures.append(e)
+            cancelled.set()
+            raise
+    return run
+
+def run_streaming_pipeline(use_cache=True, batch_size=CHUNK_SIZE, queue_batches=QUEUE_BATCHES,
+                           output_formats=('csv',), profile=False, collection=None, table='dhan_nse'):
+    """Run the NSE ETL pipeline with batches flowing through bounded queues.
+
+    Each source is read, filtered and transformed batch by batch on its own
+    thread. Upstox batches go to the MongoDB writer and the reconcile sink,
+    Dhan batches to the SQLite writer and the reconcile sink, each through
+    a queue of at most queue_batches batches; a full queue stalls its
+    producer. With use_cache=True the sources are read from the source
+    cache, otherwise they are streamed straight from their URLs.
+    Producers and sinks are task stages of one dag.run_graph graph, which
+    goes on to validate the whole sources, compare them, load the
+    reconciled tables and record the instrument history. The SQLite
+    commit waits for validation, so a failing source leaves the table as
+    it was; MongoDB batches are each validated on their own and upserted as
+    they arrive, so a failing batch stops the run before it is written.
+    The run report records each sink's per-batch queue wait and latency and each
+    producer's time blocked on full queues. Returns the reconciled frames.
+    """
+    metrics = RunMetrics('streaming', profile=profile)
+    cancelled = threading.Event()
+    validated = threading.Event()
+    failures = []
+    mongodb_queue = BoundedQueue('mongodb', cancelled, queue_batches)
+    sqlite_queue = BoundedQueue('sqlite', cancelled, queue_batches)
+    reconcile_queue = BoundedQueue('reconcile', cancelled, 2 * queue_batches)
+    symbol_memo = load_symbol_memo()
+
+    def stage(name, kind, func, inputs=()):
+        return Stage(name, kind, cancel_on_failure(func, cancelled, failures), list(inputs), {})
+
+    def validate(frames):
+        report = validate_frames(frames)
+        validated.set()
+        return report
+
+    # Without the cache each producer streams its source from the URL
+    given = {} if use_cache else {f"fetch_{source}": (None, None) for source in SOURCES}
+    stages = [stage(f"fetch_{source}", 'source', partial(fetch_source, spec['url'], spec['cache_name']))
+              for source, spec in SOURCES.items() if use_cache]
+    stages += [
+        stage('stream_upstox', 'task', lambda path: produce('upstox', path, [mongodb_queue, reconcile_queue],
+                                                            metrics, symbol_memo, batch_size), ['fetch_upstox']),
+        stage('stream_dhan', 'task', lambda path: produce('dhan', path, [sqlite_queue, reconcile_queue],
+                                                          metrics, symbol_memo, batch_size), ['fetch_dhan']),
+        stage('sink_mongodb', 'task', lambda: mongodb_sink(mongodb_queue, metrics, collection)),
+        stage('sink_sqlite', 'task', lambda: sqlite_sink(sqlite_queue, metrics, table, validated)),
+        stage('sink_reconcile', 'task', lambda: reconcile_sink(reconcile_queue, metrics)),
+        stage('validate', 'sink', validate, ['sink_reconcile']),
+        stage('compare_and_output', 'frame',
+              lambda frames, report: compare_and_output(frames['upstox'], frames['dhan'], formats=output_formats),
+              ['sink_reconcile', 'validate']),
+        stage('load_reconciled', 'sink', lambda frames, stats: load_reconciled(frames),
+              ['compare_and_output', 'sink_sqlite']),
+        stage('history', 'sink', lambda frames, stats: load_history(frames), ['compare_and_output', 'load_reconciled']),
+    ]
+    print(f"Starting streaming NSE ETL pipeline ({batch_size} rows per batch, "
+          f"up to {queue_batches} batches per queue)...")
+    try:
+        # A thread per stage, so every producer and sink runs at once
+        values = run_graph(stages, checkpoint_dir=None, max_workers=len(stages), metrics=metrics, given=given)
+        save_symbol_memo(symbol_memo)
+    except Exception as e:
+        cancelled.set()
+        error = failures[0] if failures else e
+        print(f"Streaming pipeline failed: {error}")
+        metrics.finish('failed')
+        raise error from None
+    print("Streaming NSE ETL pipeline completed successfully!")
+    print(f"Run report written to {metrics.finish('success')}")
+    return values['compare_and_output']
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the NSE ETL pipeline with streaming batches.")
+    parser.add_argument('--no-cache', action='store_true', help="stream the sources from their URLs")
+    parser.add_argument('--batch-size', type=int, default=CHUNK_SIZE, help="raw rows read per batch")
+    parser.add_argument('--queue-batches', type=int, default=QUEUE_BATCHES,
+                        help="batches a queue holds before its producer blocks")
+    parser.add_argument('--formats', nargs='+', default=['csv'], help="output formats (csv, parquet, feather)")
+    parser.add_argument('--profile', action='store_true', help="dump a cProfile file per stage")
+    args = parser.parse_args()
+    run_streaming_pipeline(not args.no_cache, args.batch_size, args.queue_batches, args.formats, args.profile)
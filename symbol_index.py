@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+INDEX_DIRNAME = 'symbol_index'
+# File in the index directory naming the build readers open
+CURRENT_FILE = 'CURRENT'
+BUILD_PREFIX = 'build-'
+INDEX_VERSION = 1
+# Lookup keys; rows are stored sorted by trading_symbol, the others get a
+# sorted copy of their non-null values plus the row each one belongs to
+INDEX_KEYS = ['trading_symbol', 'instrument_key', 'security_id', 'isin']
+# Arrays of a build: the per-row columns, then the sorted keys and rows of each other lookup key
+INDEX_ARRAYS = INDEX_KEYS + ['source'] + [f"{key}.{part}" for key in INDEX_KEYS[1:] for part in ('keys', 'rows')]
+# security_id of rows that only exist in Upstox
+MISSING_ID = -1
+
+Instrument = namedtuple('Instrument', ['trading_symbol', 'instrument_key', 'security_id', 'isin', 'source'])
+SOURCES = ['both', 'upstox', 'dhan']
+
+def _fixed_width(values):
+    """Encode a string Series as a fixed-width bytes array; nulls become b''."""
+    encoded = [value.encode() if isinstance(value, str) else b'' for value in values]
+    width = max(1, max(map(len, encoded), default=1))
+    return np.array(encoded, dtype=f'S{width}')
+
+def build_index_arrays(common_df, only_upstox_df, only_dhan_df):
+    """Return {file name: array} for the symbol index of the reconciled frames.
+
+    Every row of the three frames is indexed, with a source code telling
+    which broker(s) list it, so symbols missing on one side still resolve.
+    """
+    # Only building needs pandas; readers of the index get by with numpy
+    import pandas as pd
+
+    frames = [common_df, only_upstox_df, only_dhan_df]
+
+    def column(name):
+        # np.concatenate of object arrays avoids pandas' slow all-null checks
+        return np.concatenate([df[name].to_numpy(dtype=object) if name in df.columns
+                               else np.full(len(df), None, dtype=object) for df in frames])
+
+    symbols = column('trading_symbol')
+    keep = np.flatnonzero(pd.notna(symbols))
+    symbols = _fixed_width(symbols[keep])
+    order = keep[np.argsort(symbols, kind='stable')]
+    security_ids = np.concatenate([
+        pd.to_numeric(df['security_id'], errors='coerce').fillna(MISSING_ID).to_numpy(np.int64)
+        if 'security_id' in df.columns else np.full(len(df), MISSING_ID, dtype=np.int64)
+        for df in frames])
+
+    arrays = {
+        'trading_symbol': np.sort(symbols, kind='stable'),
+        'instrument_key': _fixed_width(column('instrument_key')[order]),
+        'security_id': security_ids[order],
+        'isin': _fixed_width(column('isin')[order]),
+        'source': np.repeat(np.arange(len(frames), dtype=np.int8), [len(df) for df in frames])[order],
+    }
+    for key in INDEX_KEYS[1:]:
+        values = arrays[key]
+        rows = np.flatnonzero(values != (MISSING_ID if key == 'security_id' else b''))
+        rows = rows[np.argsort(values[rows], kind='stable')]
+        arrays[f"{key}.keys"] = values[rows]
+        arrays[f"{key}.rows"] = rows.astype(np.int32)
+    return arrays
+
+def _read_current(path):
+    """Return the build directory named by path/CURRENT, or None."""
+    try:
+        with open(os.path.join(path, CURRENT_FILE)) as f:
+            return os.path.join(path, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+def write_symbol_index(common_df, only_upstox_df, only_dhan_df, output_dir):
+    """Write the symbol index of the reconciled frames to output_dir/symbol_index/.
+
+    Each build is a directory of .npy arrays plus index.json of its own,
+    and the CURRENT file names the build readers open. A new build is
+    written completely before CURRENT is atomically replaced to point at
+    it, so a reader opens either the previous build or the new one, never
+    a mix or a missing index. The previous build is kept for readers that
+    were opening it; older ones are removed. Returns the new build's path.
+    """
+    arrays = build_index_arrays(common_df, only_upstox_df, only_dhan_df)
+    path = os.path.join(output_dir, INDEX_DIRNAME)
+    os.makedirs(path, exist_ok=True)
+    build = f"{BUILD_PREFIX}{datetime.now():%Y%m%dT%H%M%S%f}-{os.getpid()}"
+    build_path = os.path.join(path, build)
+    os.makedirs(build_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(build_path, f"{name}.npy"), array)
+    with open(os.path.join(build_path, 'index.json'), 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'rows': len(arrays['trading_symbol']),
+                   'created_at': datetime.now().isoformat(timespec='seconds')}, f)
+
+    previous = _read_current(path)
+    pointer = os.path.join(path, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(pointer, 'w') as f:
+        f.write(build)
+    os.replace(pointer, os.path.join(path, CURRENT_FILE))
+
+    keep = {build, os.path.basename(previous) if previous else None}
+    for entry in os.listdir(path):
+        if entry.startswith(BUILD_PREFIX) and entry not in keep:
+            # Processes that mapped its files keep reading them; on Windows they stay until unmapped
+            shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+        elif entry == 'index.json' or entry.endswith('.npy'):
+            # Layout of indexes written before builds were versioned
+            os.remove(os.path.join(path, entry))
+    return build_path
+
+class SymbolIndex:
+    """Read-only, memory-mapped symbol index written by compare_and_output.
+
+    Opening maps the arrays of the build CURRENT names without reading
+    them, so it takes milliseconds at any size; the index stays on that
+    build until reopened. A lookup is a binary search over a mapped sorted
+    array: the value is written into a preallocated probe buffer rather
+    than encoded, so apart from the returned Instrument and its fields a
+    lookup only creates a few fixed-size temporaries, whatever the index
+    size. Each thread has its own probe buffers, so threads can share an
+    index.
+    """
+
+    def __init__(self, path):
+        while True:
+            build_path = _read_current(path) or path
+            try:
+                self._open(build_path)
+                break
+            except FileNotFoundError:
+                # CURRENT can move on and the build it named be removed while this opens
+                # it; that build is then retried on the new one, a missing index is not
+                if (_read_current(path) or path) == build_path:
+                    raise
+        self.path = path
+
+    def _open(self, build_path):
+        with open(os.path.join(build_path, 'index.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != INDEX_VERSION:
+            raise ValueError(f"Unsupported symbol index version {meta['version']} in {build_path}.")
+        self.build_path = build_path
+        self.rows = meta['rows']
+        # Opened by name, so a build removed part way through raises FileNotFoundError
+        self._arrays = {name: np.load(os.path.join(build_path, f"{name}.npy"), mmap_mode='r')
+                        for name in INDEX_ARRAYS}
+        self._keys = {key: self._arrays['trading_symbol' if key == 'trading_symbol' else f"{key}.keys"]
+                      for key in INDEX_KEYS}
+        self._local = threading.local()
+
+    def __len__(self):
+        return self.rows
+
+    def _probe(self, key):
+        """Return this thread's probe buffer of `key`."""
+        probes = getattr(self._local, 'probes', None)
+        if probes is None:
+            probes = self._local.probes = {key: np.zeros(1, dtype=keys.dtype) for key, keys in self._keys.items()}
+        return probes[key]
+
+    def _set_probe(self, key, value):
+        """Write `value` into this thread's probe buffer of `key`; False if no stored value can equal it."""
+        probe = self._probe(key)
+        if key == 'security_id':
+            if isinstance(value, (str, bytes)):
+                try:
+                    value = int(value)
+                except ValueError:
+                    return False
+            elif isinstance(value, float) and value.is_integer():
+                value = int(value)
+            elif isinstance(value, bool) or not isinstance(value, (int, np.integer)):
+                return False
+            try:
+                probe[0] = value
+            except OverflowError:
+                return False
+            return True
+        # A longer value cannot be stored in the array's width (and would be truncated)
+        if not isinstance(value, (str, bytes)) or len(value) > probe.itemsize:
+            return False
+        try:
+            probe[0] = value
+        except UnicodeEncodeError:
+            value = value.encode()
+            if len(value) > probe.itemsize:
+                return False
+            probe[0] = value
+        return True
+
+    def row_of(self, key, value):
+        """Return the row holding `value` of lookup `key`, or -1 (also for a value of the wrong type)."""
+        if key not in INDEX_KEYS:
+            raise ValueError(f"Unknown lookup key {key!r}. Choose from {INDEX_KEYS}.")
+        if not self._set_probe(key, value):
+            return -1
+        keys, probe = self._keys[key], self._probe(key)
+        position = keys.searchsorted(probe).item()
+        if position == len(keys) or keys.item(position) != probe.item(0):
+            return -1
+        return position if key == 'trading_symbol' else self._arrays[f"{key}.rows"].item(position)
+
+    def instrument(self, row):
+        """Return the Instrument stored at `row`."""
+        arrays = self._arrays
+        security_id = arrays['security_id'].item(row)
+        return Instrument(
+            arrays['trading_symbol'].item(row).decode(),
+            arrays['instrument_key'].item(row).decode() or None,
+            None if security_id == MISSING_ID else security_id,
+            arrays['isin'].item(row).decode() or None,
+            SOURCES[arrays['source'].item(row)],
+        )
+
+    def resolve(self, key, value):
+        """Return the Instrument whose `key` is `value`, or None."""
+        row = self.row_of(key, value)
+        return None if row < 0 else self.instrument(row)
+
+    def by_symbol(self, symbol):
+        return self.resolve('trading_symbol', symbol)
+
+    def by_instrument_key(self, instrument_key):
+        return self.resolve('instrument_key', instrument_key)
+
+    def by_security_id(self, security_id):
+        return self.resolve('security_id', security_id)
+
+    def by_isin(self, isin):
+        return self.resolve('isin', isin)
+
+def open_symbol_index(output_dir):
+    """Open the symbol index written to output_dir by compare_and_output."""
+    return SymbolIndex(os.path.join(output_dir, INDEX_DIRNAME))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look up instruments in the symbol index written by compare_and_output.")
+    parser.add_argument('values', nargs='+', help="symbols (or other keys, see --by) to look up")
+    parser.add_argument('--by', choices=INDEX_KEYS, default='trading_symbol', help="lookup key")
+    parser.add_argument('--output-dir', default='output', help="directory the index was written to")
+    args = parser.parse_args()
+    index = open_symbol_index(args.output_dir)
+    for value in args.values:
+        instrument = index.resolve(args.by, value)
+        print(f"{value}: {instrument if instrument else 'not found'}")
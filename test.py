@@ -1,25 +1,29 @@
-import requests
 import io
 import logging
 import gzip
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from schemas import UPSTOX_SCHEMA, DHAN_SCHEMA, read_csv_kwargs
+from download import download_bytes
 UPSTOX_URL = "https://assets.upstox.com/market-quote/instruments/exchange/NSE.csv.gz"
 DHAN_URL = "https://images.dhan.co/api-data/api-scrip-master.csv"
 
-def extract_data():
-    # Upstox
+def extract_upstox():
     logging.info(f"Downloading Upstox data from {UPSTOX_URL}")
-    response = requests.get(UPSTOX_URL)
-    response.raise_for_status()
-    with gzip.open(io.BytesIO(response.content), 'rt', encoding='utf-8') as f:
-        df_upstox = pd.read_csv(f)
+    with gzip.open(io.BytesIO(download_bytes(UPSTOX_URL)), 'rb') as f:
+        df_upstox = pd.read_csv(f, **read_csv_kwargs(UPSTOX_SCHEMA))
     logging.info(f"Loaded Upstox data with {len(df_upstox)} records")
+    return df_upstox
 
-    # Dhan
+def extract_dhan():
     logging.info(f"Downloading Dhan data from {DHAN_URL}")
-    response = requests.get(DHAN_URL)
-    response.raise_for_status()
-    df_dhan = pd.read_csv(io.StringIO(response.text), dtype={"SEM_SERIES": str, "SM_SYMBOL_NAME": str})
+    df_dhan = pd.read_csv(io.BytesIO(download_bytes(DHAN_URL)), **read_csv_kwargs(DHAN_SCHEMA))
     logging.info(f"Loaded Dhan data with {len(df_dhan)} records")
+    return df_dhan
 
-    return df_upstox, df_dhan
\ No newline at end of file
+def extract_data(concurrent=True):
+    # Upstox and Dhan are independent, so fetch and parse them side by side
+    with ThreadPoolExecutor(max_workers=2 if concurrent else 1) as pool:
+        upstox_future = pool.submit(extract_upstox)
+        dhan_future = pool.submit(extract_dhan)
+        return upstox_future.result(), dhan_future.result()
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The pipeline modules live flat in the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIXTURE_PATH = os.path.join(ROOT, 'data', 'NSE.csv.gz')
+# Small instrument dumps of every broker in sources.SOURCES, named like their cache files
+FIXTURE_DIR = os.path.join(ROOT, 'tests', 'fixtures')
@@ -0,0 +1,62 @@
+import contextlib
+import hashlib
+import io
+import os
+
+import pytest
+
+from benchmark import serve_flaky
+from cache import fetch_source, load_meta
+from conftest import FIXTURE_PATH
+
+NAME = os.path.basename(FIXTURE_PATH)
+
+@pytest.fixture
+def served():
+    server, base_url = serve_flaky(os.path.dirname(FIXTURE_PATH))
+    yield server, f"{base_url}/{NAME}"
+    server.shutdown()
+
+def quiet_fetch(url, cache_dir):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        path, sha256 = fetch_source(url, NAME, cache_dir=str(cache_dir))
+    return path, sha256, output.getvalue()
+
+def fixture_sha256():
+    with open(FIXTURE_PATH, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def test_download_populates_cache(served, tmp_path):
+    server, url = served
+    path, sha256, _ = quiet_fetch(url, tmp_path)
+    with open(path, 'rb') as f, open(FIXTURE_PATH, 'rb') as fixture:
+        assert f.read() == fixture.read()
+    meta = load_meta(NAME, str(tmp_path))
+    assert sha256 == meta['sha256'] == fixture_sha256()
+    assert meta['url'] == url and meta['etag'] and meta['last_modified']
+    # The metadata is renamed into place, leaving no temporary file behind
+    assert sorted(os.listdir(tmp_path)) == sorted([NAME, f"{NAME}.meta.json"])
+
+def test_not_modified_reuses_cached_body(served, tmp_path):
+    server, url = served
+    quiet_fetch(url, tmp_path)
+    meta = load_meta(NAME, str(tmp_path))
+    mtime = os.path.getmtime(tmp_path / NAME)
+    path, sha256, output = quiet_fetch(url, tmp_path)
+    assert 'not modified' in output and sha256 == meta['sha256']
+    assert os.path.getmtime(path) == mtime and load_meta(NAME, str(tmp_path)) == meta
+    assert len(server.requests) == 2
+
+def test_damaged_cache_is_downloaded_again(served, tmp_path):
+    server, url = served
+    quiet_fetch(url, tmp_path)
+    with open(tmp_path / NAME, 'r+b') as f:
+        f.write(b'damaged')
+    path, sha256, output = quiet_fetch(url, tmp_path)
+    assert 'does not match its recorded sha256' in output
+    assert sha256 == fixture_sha256() and load_meta(NAME, str(tmp_path))['sha256'] == sha256
+    with open(path, 'rb') as f, open(FIXTURE_PATH, 'rb') as fixture:
+        assert f.read() == fixture.read()
+    # The conditional request answered 304, then the body was fetched unconditionally
+    assert len(server.requests) == 3
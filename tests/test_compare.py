@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+
+from compare import reconcile, name_match_candidates, compare_and_output, CANDIDATES_OUTPUT, CANDIDATE_COLUMNS
+from engines import ENGINES
+from symbol_index import open_symbol_index
+
+def upstox(rows):
+    return pd.DataFrame([{'exchange': 'NSE_EQ', 'instrument_key': f"NSE_EQ|{symbol}", 'symbol_name': symbol,
+                          'security_id': None, 'short_name': None, 'name': name, 'isin': None,
+                          'trading_symbol': symbol} for symbol, name in rows])
+
+def dhan(rows):
+    return pd.DataFrame([{'exchange': 'NSE', 'instrument_key': None, 'symbol_name': name, 'security_id': i + 100,
+                          'short_name': None, 'name': None, 'isin': None, 'trading_symbol': symbol}
+                         for i, (symbol, name) in enumerate(rows)])
+
+@pytest.fixture
+def frames():
+    return (upstox([('TATAMOTORS', 'TATA MOTORS LIMITED'), ('INFY', 'INFOSYS LIMITED'),
+                    ('ACMEPAINT', 'ACME PAINTS LIMITED')]),
+            dhan([('TATAMTRDVR', 'TATA MOTORS DVR'), ('INFY', 'INFOSYS LTD'), ('ACMEPNT', 'ACME PAINTS LTD')]))
+
+def test_reconcile_only_joins_exact_keys(frames):
+    common, only_upstox, only_dhan = reconcile(*frames)
+    assert common['trading_symbol'].tolist() == ['INFY']
+    assert common['match_tier'].tolist() == ['symbol']
+    assert only_upstox['trading_symbol'].tolist() == ['TATAMOTORS', 'ACMEPAINT']
+    assert only_dhan['trading_symbol'].tolist() == ['TATAMTRDVR', 'ACMEPNT']
+
+def test_name_candidates_skip_other_share_classes(frames):
+    _, only_upstox, only_dhan = reconcile(*frames)
+    candidates = name_match_candidates(only_upstox, only_dhan)
+    assert list(candidates.columns) == CANDIDATE_COLUMNS
+    assert candidates[['trading_symbol', 'dhan_trading_symbol', 'score']].values.tolist() == [
+        ['ACMEPAINT', 'ACMEPNT', 1.0]]
+
+def test_name_candidates_leave_ties_unpaired():
+    candidates = name_match_candidates(upstox([('ACME1', 'ACME PAINTS')]),
+                                       dhan([('ACME2', 'ACME PAINTS'), ('ACME3', 'ACME PAINTS LTD')]))
+    assert candidates.empty and list(candidates.columns) == CANDIDATE_COLUMNS
+
+@pytest.mark.parametrize('engine', sorted(ENGINES))
+def test_name_candidates_match_across_engines(engine, frames):
+    _, only_upstox, only_dhan = reconcile(*frames)
+    expected = name_match_candidates(only_upstox, only_dhan)
+    pd.testing.assert_frame_equal(ENGINES[engine].name_candidates(only_upstox, only_dhan), expected)
+
+def test_candidates_stay_out_of_reconciled_outputs(frames, tmp_path):
+    outputs = compare_and_output(*frames, output_dir=tmp_path)
+    assert outputs[CANDIDATES_OUTPUT]['trading_symbol'].tolist() == ['ACMEPAINT']
+    assert 'ACMEPAINT' in outputs['only_in_upstox']['trading_symbol'].tolist()
+    assert (tmp_path / f"{CANDIDATES_OUTPUT}.csv").exists()
+    index = open_symbol_index(tmp_path)
+    assert index.by_symbol('ACMEPAINT').source == 'upstox'
+    assert index.by_symbol('ACMEPNT').source == 'dhan'
@@ -0,0 +1,67 @@
+import contextlib
+import io
+import json
+
+import pandas as pd
+import pytest
+
+import daemon
+from benchmark import MemoryCollection, synthetic_dhan_master
+from conftest import FIXTURE_PATH
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in tmp_path on local sources, with MongoDB in memory and SQLite in tmp_path."""
+    dhan_path = tmp_path / 'dhan.csv'
+    synthetic_dhan_master(pd.read_csv(FIXTURE_PATH)).to_csv(dhan_path, index=False)
+    paths = {'upstox_nse.csv.gz': FIXTURE_PATH, 'dhan_scrip.csv': str(dhan_path)}
+    fetches = []
+
+    def fetch_source(url, cache_name):
+        fetches.append(cache_name)
+        # The file name stands in for the content hash, so the sources never change
+        return paths[cache_name], cache_name
+
+    collection = MemoryCollection()
+
+    class Client(dict):
+        def __init__(self, uri):
+            super().__init__(market_data={'upstox_nse': collection})
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(daemon, 'fetch_source', fetch_source)
+    monkeypatch.setattr(daemon, 'MongoClient', Client)
+    monkeypatch.setenv('MONGODB_URI', 'mongodb://unused')
+    monkeypatch.setenv('SQLITE_DB_PATH', str(tmp_path / 'nse.db'))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path, collection, fetches
+
+def refresh(instance):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return instance.refresh()
+
+def last_report(path):
+    with open(path / 'output' / 'metrics' / 'daemon_run_report.json') as f:
+        report = json.load(f)
+    return report['status'], sorted(stage['stage'] for stage in report['stages'])
+
+def test_unchanged_cycle_is_skipped(workdir):
+    path, collection, fetches = workdir
+    instance = daemon.Daemon(poll_seconds=1)
+    assert sorted(refresh(instance)) == ['dhan', 'upstox']
+    docs = {key: dict(doc) for key, doc in collection.docs.items()}
+    assert docs and (path / 'output' / 'common_stocks.csv').exists()
+    assert last_report(path)[0] == 'success'
+    outputs = (path / 'output' / 'common_stocks.csv').stat().st_mtime_ns
+
+    assert refresh(instance) == []
+    # Only the two polls ran: nothing was extracted, loaded or written
+    assert last_report(path) == ('unchanged', ['fetch_dhan', 'fetch_upstox'])
+    assert collection.docs == docs and len(fetches) == 4
+    assert (path / 'output' / 'common_stocks.csv').stat().st_mtime_ns == outputs
+
+    # A daemon started later resumes from the state on disk and skips too
+    assert refresh(daemon.Daemon(poll_seconds=1)) == []
+    instance.close()
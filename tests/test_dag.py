@@ -0,0 +1,118 @@
+import contextlib
+import io
+import json
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import dag
+import main
+from benchmark import MemoryCollection, synthetic_dhan_master
+from conftest import FIXTURE_PATH
+from dag import Stage, run_graph
+from metrics import RunMetrics
+from validate import RULES, Rule, ValidationError
+
+def quiet(func, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+def counting_stages(calls):
+    def stage(name, kind, func, inputs):
+        def run(*args):
+            calls.append(name)
+            return func(*args)
+        return Stage(name, kind, run, inputs, {})
+    return [
+        stage('double', 'frame', lambda df: df * 2, ['numbers']),
+        stage('total', 'sink', lambda df: {'total': int(df['n'].sum())}, ['double']),
+    ]
+
+def test_checkpoints_skip_unchanged_stages(tmp_path):
+    calls = []
+    numbers = pd.DataFrame({'n': [1, 2, 3]})
+    given = {'numbers': (numbers, 'v1')}
+    for _ in range(2):
+        values = quiet(run_graph, counting_stages(calls), checkpoint_dir=tmp_path, given=given,
+                       metrics=RunMetrics('test', metrics_dir=tmp_path))
+    assert values['total'] == {'total': 12} and calls == ['double', 'total']
+    quiet(run_graph, counting_stages(calls), checkpoint_dir=tmp_path, given={'numbers': (numbers, 'v2')},
+          metrics=RunMetrics('test', metrics_dir=tmp_path))
+    assert calls == ['double', 'total'] * 2
+
+def test_without_checkpoint_dir_every_stage_runs(tmp_path):
+    calls = []
+    given = {'numbers': (pd.DataFrame({'n': [1]}), 'v1')}
+    for _ in range(2):
+        run_graph(counting_stages(calls), checkpoint_dir=None, given=given,
+                  metrics=RunMetrics('test', metrics_dir=tmp_path))
+    assert calls == ['double', 'total'] * 2
+
+def test_failed_stage_stops_downstream(tmp_path):
+    def fail(df):
+        raise RuntimeError("boom")
+
+    ran = []
+    stages = [Stage('fail', 'frame', fail, ['numbers'], {}),
+              Stage('after', 'sink', lambda df: ran.append(df), ['fail'], {})]
+    with pytest.raises(RuntimeError, match="boom"):
+        run_graph(stages, checkpoint_dir=None, given={'numbers': (pd.DataFrame({'n': [1]}), None)},
+                  metrics=RunMetrics('test', metrics_dir=tmp_path))
+    assert ran == []
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run main in tmp_path on local sources, with MongoDB in memory and SQLite in tmp_path."""
+    dhan_path = tmp_path / 'dhan.csv'
+    synthetic_dhan_master(pd.read_csv(FIXTURE_PATH)).to_csv(dhan_path, index=False)
+    paths = {'upstox_nse.csv.gz': FIXTURE_PATH, 'dhan_scrip.csv': str(dhan_path)}
+    monkeypatch.setattr(dag, 'fetch_source', lambda url, cache_name: (paths[cache_name], cache_name))
+    collection = MemoryCollection()
+    load_to_mongodb = dag.load_to_mongodb
+    monkeypatch.setattr(dag, 'load_to_mongodb',
+                        lambda df, **kwargs: load_to_mongodb(df, collection=collection, resume=False, **kwargs))
+    monkeypatch.setenv('SQLITE_DB_PATH', str(tmp_path / 'nse.db'))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path, collection
+
+def tables(workdir):
+    with sqlite3.connect(workdir / 'nse.db') as conn:
+        return {name: conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+                for name in ('dhan_nse', 'common_stocks', 'only_in_dhan', 'instrument_history')}
+
+@pytest.mark.parametrize('delta', [False, True])
+def test_main_runs_every_stage_of_the_graph(workdir, delta):
+    path, collection = workdir
+    quiet(main.run_etl_pipeline, delta=delta)
+    counts = tables(path)
+    assert counts['dhan_nse'] == counts['common_stocks'] + counts['only_in_dhan'] > 0
+    assert counts['instrument_history'] > 0 and len(collection.docs) > 0
+    assert (path / 'output' / 'validation_report.json').exists()
+    with open(path / 'output' / 'metrics' / 'main_run_report.json') as f:
+        stages = {stage['stage']: stage['status'] for stage in json.load(f)['stages']}
+    assert {'validate', 'load_mongodb', 'load_sql', 'compare', 'load_reconciled', 'history'} <= set(stages)
+    assert set(stages.values()) == {'success'}
+    assert ('changelog' in stages) == delta
+
+def test_main_stops_before_loading_an_invalid_source(workdir, monkeypatch):
+    path, collection = workdir
+    # The synthetic Dhan master has no ISINs
+    monkeypatch.setitem(RULES, 'dhan', RULES['dhan'] + [Rule('isin_not_null', 'isin', 'not_null')])
+    with pytest.raises(ValidationError):
+        quiet(main.run_etl_pipeline)
+    assert not collection.docs and not os.path.exists(path / 'nse.db')
+    assert not os.path.exists(path / 'output' / 'common_stocks.csv')
+
+def test_unchanged_sources_skip_only_when_every_requested_output_exists(workdir):
+    path, collection = workdir
+    runs = []
+    for formats in (['csv'], ['csv'], ['csv', 'parquet'], ['csv', 'parquet']):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main.run_etl_pipeline(output_formats=formats)
+        runs.append('reusing previous outputs' in output.getvalue())
+    # The first parquet run has no parquet outputs to reuse
+    assert runs == [False, True, False, True]
+    assert (path / 'output' / 'common_stocks.parquet').exists()
@@ -0,0 +1,34 @@
+import pandas as pd
+
+from delta import compute_delta, load_snapshot, save_snapshot
+
+def dhan(rows):
+    """Dhan frame of (security_id, trading_symbol, name) rows."""
+    return pd.DataFrame(rows, columns=['security_id', 'trading_symbol', 'name'])
+
+BASE = dhan([(1, 'AAA', 'A Ltd'), (2, 'BBB', 'B Ltd'), (3, 'CCC', 'C Ltd')])
+
+def changes(delta):
+    return sorted(zip(delta['log']['change'], delta['log']['key']))
+
+def test_first_run_loads_everything():
+    delta = compute_delta(None, BASE, 'security_id')
+    assert delta['initial'] and delta['removed_keys'] == []
+    pd.testing.assert_frame_equal(delta['upserts'], BASE)
+    assert changes(delta) == [('added', 1), ('added', 2), ('added', 3)]
+
+def test_added_removed_and_changed_rows(tmp_path):
+    save_snapshot('dhan', BASE, str(tmp_path))
+    # 3 is removed, 2 renamed and 4 added; 1 is unchanged but moves down
+    current = dhan([(4, 'DDD', 'D Ltd'), (2, 'BBB', 'B Industries'), (1, 'AAA', 'A Ltd')])
+    delta = compute_delta(load_snapshot('dhan', str(tmp_path)), current, 'security_id')
+    assert not delta['initial'] and delta['removed_keys'] == [3]
+    assert delta['upserts']['security_id'].tolist() == [4, 2]
+    assert changes(delta) == [('added', '4'), ('modified', '2'), ('removed', '3')]
+    renamed = delta['log'][delta['log']['change'] == 'modified'].iloc[0]
+    assert renamed['trading_symbol'] == renamed['previous_trading_symbol'] == 'BBB'
+
+def test_unchanged_snapshot_gives_empty_delta(tmp_path):
+    save_snapshot('dhan', BASE, str(tmp_path))
+    delta = compute_delta(load_snapshot('dhan', str(tmp_path)), BASE.copy(), 'security_id')
+    assert delta['upserts'].empty and delta['removed_keys'] == [] and delta['log'].empty
@@ -0,0 +1,55 @@
+import contextlib
+import io
+import json
+import os
+
+import pytest
+
+from benchmark import serve_flaky
+from download import download
+
+@pytest.fixture
+def served(tmp_path):
+    source = tmp_path / 'src'
+    source.mkdir()
+    data = os.urandom(1000)
+    (source / 'master.csv').write_bytes(data)
+    server, base_url = serve_flaky(str(source))
+    yield server, f"{base_url}/master.csv", data, tmp_path / 'master.csv'
+    server.shutdown()
+
+def leave_part(target, url, data, size):
+    """Leave a partial download of `size` bytes with the served file's validator, as a failed run would."""
+    etag = f'"{len(data)}-{int(os.path.getmtime(target.parent / "src" / "master.csv"))}"'
+    with open(f"{target}.part", 'wb') as f:
+        f.write((data * 2)[:size])
+    with open(f"{target}.part.json", 'w') as f:
+        json.dump({'url': url, 'validator': etag}, f)
+
+def quiet_download(url, target):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return download(url, str(target), backoff_seconds=0)
+
+def test_resumes_partial_download(served):
+    server, url, data, target = served
+    leave_part(target, url, data, 400)
+    result = quiet_download(url, target)
+    assert target.read_bytes() == data
+    assert result.resumed_bytes == 400 and result.attempts == 1
+    assert server.requests == [('ok', 400)]
+
+def test_finished_partial_download_is_kept(served):
+    server, url, data, target = served
+    leave_part(target, url, data, len(data))
+    result = quiet_download(url, target)
+    assert target.read_bytes() == data and result.resumed_bytes == len(data)
+
+def test_range_past_a_shrunk_file_restarts_from_first_byte(served):
+    server, url, data, target = served
+    # Longer than the file now served, so the server answers 416 for bytes */1000
+    leave_part(target, url, data, 1500)
+    result = quiet_download(url, target)
+    assert target.read_bytes() == data
+    assert result.attempts == 2 and result.resumed_bytes == 0
+    assert server.requests == [('ok', 1500), ('ok', 0)]
+    assert not os.path.exists(f"{target}.part")
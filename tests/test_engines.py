@@ -0,0 +1,111 @@
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+import diagnostics
+from benchmark import synthetic_dhan_master
+from conftest import FIXTURE_PATH
+from engines import ENGINES, HAS_POLARS
+from extract import extract_upstox_data, extract_dhan_data
+from sinks import apply_output_schema
+
+pytestmark = pytest.mark.skipif(not HAS_POLARS, reason="polars is not installed")
+
+pandas_engine, polars_engine = ENGINES['pandas'], ENGINES.get('polars')
+
+def quiet(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+def canonical(df):
+    """df with a fresh index and the output schema applied, so both engines' frames compare equal."""
+    return apply_output_schema(df.reset_index(drop=True))
+
+def assert_same(expected, actual):
+    pd.testing.assert_frame_equal(canonical(actual), canonical(expected))
+    assert actual['security_id'].dtype == expected['security_id'].dtype
+
+@pytest.fixture(scope='module')
+def dhan_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp('dhan') / 'dhan.csv'
+    synthetic_dhan_master(pd.read_csv(FIXTURE_PATH)).to_csv(path, index=False)
+    return str(path)
+
+@pytest.fixture(scope='module')
+def raw(dhan_path):
+    return quiet(extract_upstox_data, 'unused', False, FIXTURE_PATH), quiet(extract_dhan_data, 'unused', False, dhan_path)
+
+@pytest.fixture(scope='module')
+def transformed(raw):
+    upstox_raw, dhan_raw = raw
+    return quiet(pandas_engine.transform_upstox, upstox_raw), quiet(pandas_engine.transform_dhan, dhan_raw)
+
+def test_transforms_match_on_fixture(raw, transformed):
+    upstox_raw, dhan_raw = raw
+    assert len(transformed[0]) and len(transformed[1])
+    assert_same(transformed[0], quiet(polars_engine.transform_upstox, upstox_raw))
+    assert_same(transformed[1], quiet(polars_engine.transform_dhan, dhan_raw))
+
+def test_transforms_match_when_scanning_paths(transformed, dhan_path):
+    assert_same(transformed[0], quiet(polars_engine.transform_upstox, FIXTURE_PATH))
+    assert_same(transformed[1], quiet(polars_engine.transform_dhan, dhan_path))
+
+def test_security_id_is_int64_from_string_frames(transformed, dhan_path):
+    strings = pd.read_csv(dhan_path, dtype=str)
+    for engine in (pandas_engine, polars_engine):
+        assert_same(transformed[1], quiet(engine.transform_dhan, strings))
+        assert quiet(engine.transform_dhan, strings)['security_id'].dtype == 'Int64'
+
+def test_reconcile_and_candidates_match_on_fixture(transformed):
+    expected = quiet(pandas_engine.reconcile, *transformed)
+    actual = quiet(polars_engine.reconcile, *transformed)
+    for left, right in zip(expected, actual):
+        assert_same(left, right)
+    pd.testing.assert_frame_equal(quiet(polars_engine.name_candidates, *actual[1:]),
+                                  quiet(pandas_engine.name_candidates, *expected[1:]))
+
+def test_empty_frames(raw):
+    upstox_raw, dhan_raw = (df.iloc[:0] for df in raw)
+    for transform in ('transform_upstox', 'transform_dhan'):
+        source = upstox_raw if transform == 'transform_upstox' else dhan_raw
+        expected = quiet(getattr(pandas_engine, transform), source)
+        assert expected.empty
+        assert_same(expected, quiet(getattr(polars_engine, transform), source))
+    empty = quiet(pandas_engine.transform_upstox, upstox_raw), quiet(pandas_engine.transform_dhan, dhan_raw)
+    for left, right in zip(quiet(pandas_engine.reconcile, *empty), quiet(polars_engine.reconcile, *empty)):
+        assert left.empty and right.empty
+        assert list(left.columns) == list(right.columns)
+    assert quiet(polars_engine.name_candidates, *empty).empty
+
+def test_missing_isin_column(dhan_path):
+    dhan_raw = quiet(extract_dhan_data, 'unused', False, dhan_path)
+    assert 'ISIN' not in dhan_raw.columns
+    with_isin = dhan_raw.assign(ISIN='INE000000000')
+    for source in (dhan_raw, with_isin):
+        expected = quiet(pandas_engine.transform_dhan, source)
+        assert_same(expected, quiet(polars_engine.transform_dhan, source))
+    assert quiet(polars_engine.transform_dhan, dhan_raw)['isin'].isna().all()
+
+def test_name_ties_left_unpaired_by_both_engines(transformed):
+    upstox_df, dhan_df = (df.iloc[:3].reset_index(drop=True) for df in transformed)
+    upstox_df = upstox_df.assign(name='ACME PAINTS', trading_symbol=['A1', 'A2', 'A3'])
+    dhan_df = dhan_df.assign(symbol_name=['ACME PAINTS LTD', 'ACME PAINTS', 'OTHER CO'],
+                             trading_symbol=['D1', 'D2', 'D3'])
+    for engine in (pandas_engine, polars_engine):
+        assert quiet(engine.name_candidates, upstox_df, dhan_df).empty
+
+def test_polars_reports_invalid_symbols(raw):
+    # The synthetic master lists a few symbols twice once their series suffix is stripped
+    diagnostics.set_level('summary')
+    outputs = []
+    for engine in (pandas_engine, polars_engine):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            engine.transform_dhan(raw[1])
+        # Only pandas reports the symbols normalize_trading_symbols changed
+        outputs.append([line for line in out.getvalue().splitlines()
+                        if 'trading_symbol' in line and not line.startswith('Normalized')])
+    assert any('duplicate trading_symbol rows' in line for line in outputs[1])
+    assert outputs[0] == outputs[1]
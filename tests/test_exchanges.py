@@ -0,0 +1,48 @@
+import contextlib
+import io
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import exchanges
+from benchmark import MemoryCollection, synthetic_dhan_master
+from conftest import FIXTURE_PATH
+from validate import RULES, Rule, ValidationError
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in tmp_path with the NSE fixture as Upstox file, MongoDB in memory and SQLite in tmp_path."""
+    synthetic_dhan_master(pd.read_csv(FIXTURE_PATH)).to_csv(tmp_path / 'dhan.csv', index=False)
+    collections = {}
+    load_to_mongodb = exchanges.load_to_mongodb
+    monkeypatch.setattr(exchanges, 'load_to_mongodb', lambda df, collection_name: load_to_mongodb(
+        df, collection=collections.setdefault(collection_name, MemoryCollection()), resume=False))
+    monkeypatch.setenv('SQLITE_DB_PATH', str(tmp_path / 'nse.db'))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path, collections
+
+def run(workdir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return exchanges.run_multi_exchange(['NSE', 'NCD'], max_workers=1,
+                                            sources={'NSE': FIXTURE_PATH, 'dhan': str(workdir / 'dhan.csv')})
+
+def test_partitions_are_validated_and_loaded_into_their_own_tables(workdir):
+    path, collections = workdir
+    counts = run(path)
+    with sqlite3.connect(path / 'nse.db') as conn:
+        for name, suffix in (('NSE', ''), ('NCD', '_ncd')):
+            spec = exchanges.PARTITIONS[name]
+            assert conn.execute(f"SELECT COUNT(*) FROM common_stocks{suffix}").fetchone()[0] == \
+                counts[name]['common_stocks'] > 0
+            assert conn.execute(f"SELECT COUNT(*) FROM {spec['history_table']}").fetchone()[0] > 0
+            assert (path / 'output' / f"exchange={name}" / 'validation_report.json').exists()
+    assert set(collections) == {'upstox_nse', 'upstox_ncd'}
+
+def test_invalid_partition_is_not_loaded(workdir, monkeypatch):
+    path, collections = workdir
+    # The synthetic Dhan master has no ISINs
+    monkeypatch.setitem(RULES, 'dhan', RULES['dhan'] + [Rule('isin_not_null', 'isin', 'not_null')])
+    with pytest.raises(ValidationError):
+        run(path)
+    assert not collections and not (path / 'nse.db').exists()
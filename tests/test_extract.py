@@ -0,0 +1,46 @@
+import pandas as pd
+
+from conftest import FIXTURE_PATH
+from extract import open_source, read_csv_filtered, extract_upstox_data
+from schemas import UPSTOX_SCHEMA
+from transform import upstox_equity_mask
+
+FIXTURE_ROWS = 58613
+FIXTURE_EQUITY_ROWS = 8078
+# Columns of UPSTOX_SCHEMA present in the fixture; isin and short_name are not
+KEPT_COLUMNS = ['instrument_key', 'tradingsymbol', 'name', 'tick_size', 'instrument_type', 'exchange']
+
+def test_streams_fixture_keeping_nse_equity_rows():
+    with open_source(None, FIXTURE_PATH, is_gzipped=True) as f:
+        df, raw_rows = read_csv_filtered(f, UPSTOX_SCHEMA, upstox_equity_mask)
+    assert raw_rows == FIXTURE_ROWS
+    assert len(df) == FIXTURE_EQUITY_ROWS
+    assert list(df.columns) == KEPT_COLUMNS
+    assert set(df['exchange']) == {'NSE_EQ'}
+    assert set(df['instrument_type']) == {'EQUITY'}
+
+def test_chunk_size_does_not_change_result():
+    with open_source(None, FIXTURE_PATH, is_gzipped=True) as f:
+        whole, _ = read_csv_filtered(f, UPSTOX_SCHEMA, upstox_equity_mask, chunksize=100000)
+    with open_source(None, FIXTURE_PATH, is_gzipped=True) as f:
+        chunked, _ = read_csv_filtered(f, UPSTOX_SCHEMA, upstox_equity_mask, chunksize=997)
+    # Category sets depend on the rows each chunk saw, the values do not
+    categories = {'exchange': str, 'instrument_type': str}
+    pd.testing.assert_frame_equal(whole.astype(categories), chunked.astype(categories))
+    # Schema dtypes survive concatenating chunks with different category sets
+    assert isinstance(chunked['exchange'].dtype, pd.CategoricalDtype)
+    assert chunked['tick_size'].dtype == 'float64'
+
+def test_streamed_extract_matches_full_read_filtered():
+    streamed = extract_upstox_data(stream=True, path=FIXTURE_PATH)
+    full = extract_upstox_data(path=FIXTURE_PATH)
+    filtered = full[upstox_equity_mask(full)].reset_index(drop=True)
+    assert streamed['instrument_key'].tolist() == filtered['instrument_key'].tolist()
+    assert streamed['tradingsymbol'].tolist() == filtered['tradingsymbol'].tolist()
+
+def test_filter_matching_nothing_keeps_columns():
+    with open_source(None, FIXTURE_PATH, is_gzipped=True) as f:
+        df, raw_rows = read_csv_filtered(f, UPSTOX_SCHEMA, lambda chunk: chunk['exchange'] == 'BSE_EQ')
+    assert raw_rows == FIXTURE_ROWS
+    assert df.empty
+    assert list(df.columns) == KEPT_COLUMNS
@@ -0,0 +1,63 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from history import record_history, resolve_as_of, resolve_as_of_many, to_timestamp
+
+def frames(rows):
+    """Reconciled frames listing (trading_symbol, isin) rows as common stocks."""
+    common = pd.DataFrame([{'trading_symbol': symbol, 'instrument_key': f"NSE_EQ|{symbol}", 'security_id': i,
+                            'isin': isin, 'name': symbol, 'symbol_name': symbol}
+                           for i, (symbol, isin) in enumerate(rows)])
+    empty = common.iloc[:0]
+    return {'common_stocks': common, 'only_in_upstox': empty, 'only_in_dhan': empty}
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    # ISIN X is held by B and A from the first run, C also holds it during the second
+    record_history(conn, frames([('B', 'X'), ('A', 'X')]), '2026-01-01T10:00:00')
+    record_history(conn, frames([('B', 'X'), ('A', 'X'), ('C', 'X')]), '2026-01-02T10:00:00')
+    record_history(conn, frames([('B', 'X'), ('A', 'X')]), '2026-01-03T10:00:00')
+    yield conn
+    conn.close()
+
+@pytest.mark.parametrize('when, symbol', [
+    ('2026-01-01T12:00:00', 'A'),   # A and B started together: the lowest symbol wins
+    ('2026-01-02T12:00:00', 'C'),   # C started last
+    ('2026-01-03T12:00:00', 'A'),   # C ended; versions started before it are still in effect
+    ('2025-12-31T12:00:00', None),
+])
+def test_shared_isin_resolves_deterministically(conn, when, symbol):
+    version = resolve_as_of(conn, 'X', when, key='isin')
+    assert (version.trading_symbol if version else None) == symbol
+    many = resolve_as_of_many(conn, ['X', 'X'], when, key='isin')
+    assert many['trading_symbol'].tolist() == [symbol, symbol]
+
+def test_symbol_lookup(conn):
+    assert resolve_as_of(conn, 'C', '2026-01-02T12:00:00').valid_to == '2026-01-03T10:00:00'
+    assert resolve_as_of(conn, 'C', '2026-01-03T12:00:00') is None
+    many = resolve_as_of_many(conn, ['C', 'A', 'Z'], ['2026-01-02T12:00:00', '2026-01-03', '2026-01-03'])
+    assert many['trading_symbol'].tolist() == ['C', 'A', None]
+
+@pytest.mark.parametrize('key, value', [('trading_symbol', 'A'), ('isin', 'X')])
+def test_lookups_need_no_sort(conn, key, value):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    resolve_as_of(conn, value, '2026-01-02T12:00:00', key=key)
+    resolve_as_of_many(conn, [value, value], ['2026-01-03', '2026-01-02T12:00:00'], key=key)
+    conn.set_trace_callback(None)
+    queries = [sql for sql in statements if sql.startswith('SELECT')]
+    assert len(queries) == 2
+    for sql in queries:
+        plan = ' '.join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", ()))
+        assert 'TEMP B-TREE' not in plan, plan
+
+def test_runs_within_one_second_are_recorded():
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    record_history(conn, frames([('A', 'X'), ('D', 'Y')]))
+    assert record_history(conn, frames([('A', 'X')])) == {'opened': 0, 'closed': 1, 'unchanged': 1}
+    as_of, = conn.execute("SELECT valid_to FROM instrument_history WHERE trading_symbol = 'D'").fetchone()
+    assert resolve_as_of(conn, 'D', as_of) is None
+    assert resolve_as_of(conn, 'D', to_timestamp(pd.Timestamp(as_of) - pd.Timedelta(microseconds=1))).isin == 'Y'
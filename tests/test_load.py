@@ -0,0 +1,129 @@
+import contextlib
+import io
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from benchmark import MemoryCollection
+from load import STRICT_TABLES, bulk_upsert_mongodb, connect_sqlite, ensure_sqlite_schema, is_strict, upsert_sqlite
+
+def instruments(n, name='Company'):
+    return pd.DataFrame({'instrument_key': [f"NSE_EQ|{i}" for i in range(n)],
+                         'trading_symbol': [f"S{i}" for i in range(n)],
+                         'name': [f"{name} {i}" for i in range(n)]})
+
+class FailingCollection(MemoryCollection):
+    """MemoryCollection whose bulk_write fails on call number `fail_on`."""
+
+    def __init__(self, fail_on):
+        super().__init__()
+        self.fail_on = fail_on
+        self.writes = 0
+
+    def bulk_write(self, operations, ordered=True):
+        self.writes += 1
+        if self.writes == self.fail_on:
+            raise ConnectionError("connection lost")
+        return super().bulk_write(operations, ordered)
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # Checkpoints are written under cache/ in the working directory
+    monkeypatch.chdir(tmp_path)
+
+def upsert(collection, df, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return bulk_upsert_mongodb(collection, df, batch_size=10, **kwargs)
+
+def test_rerun_resumes_after_interrupted_batch():
+    df = instruments(45)
+    collection = FailingCollection(fail_on=3)
+    with pytest.raises(ConnectionError):
+        upsert(collection, df)
+    assert len(collection.docs) == 20
+    stats = upsert(collection, df, skip_unchanged=False)
+    # Only batches 3 to 5 are sent again
+    assert stats['batches'] == 3 and stats['upserted'] == 25 and stats['modified'] == 0
+    assert sorted(collection.docs) == sorted(df['instrument_key'])
+
+def test_identical_rerun_writes_nothing():
+    df = instruments(45)
+    collection = MemoryCollection()
+    assert upsert(collection, df)['upserted'] == 45
+    stats = upsert(collection, df)
+    assert stats['upserted'] == stats['modified'] == 0 and stats['skipped'] == 45
+    # One round trip for the index and one for the stored hashes
+    assert stats['round_trips'] == 2
+
+def test_changed_document_is_rewritten():
+    df = instruments(45)
+    collection = MemoryCollection()
+    upsert(collection, df)
+    changed = df.copy()
+    changed.loc[7, 'name'] = 'Renamed'
+    stats = upsert(collection, changed)
+    assert stats['modified'] == 1 and stats['upserted'] == 0 and stats['skipped'] == 44
+    assert collection.docs['NSE_EQ|7']['name'] == 'Renamed'
+    assert collection.docs['NSE_EQ|8']['name'] == 'Company 8'
+
+def dhan(rows):
+    """Dhan frame of (security_id, trading_symbol, name) rows."""
+    return pd.DataFrame([{'exchange': 'NSE', 'security_id': security_id, 'trading_symbol': symbol,
+                          'symbol_name': name, 'name': name} for security_id, symbol, name in rows])
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = connect_sqlite(str(tmp_path / 'nse.db'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        ensure_sqlite_schema(conn)
+    yield conn
+    conn.close()
+
+def stored(conn):
+    return conn.execute("SELECT security_id, trading_symbol, name FROM dhan_nse ORDER BY security_id").fetchall()
+
+def counts(stats):
+    return stats['inserted'], stats['updated'], stats['deleted']
+
+def test_sqlite_counts_inserted_updated_and_deleted_rows(conn):
+    assert counts(upsert_sqlite(conn, dhan([(1, 'AAA', 'A'), (2, 'BBB', 'B'), (3, 'CCC', 'C')]))) == (3, 0, 0)
+    assert counts(upsert_sqlite(conn, dhan([(1, 'AAA', 'A'), (2, 'BBB', 'B2'), (4, 'DDD', 'D')]))) == (1, 1, 1)
+    assert counts(upsert_sqlite(conn, dhan([(1, 'AAA', 'A'), (2, 'BBB', 'B2'), (4, 'DDD', 'D')]))) == (0, 0, 0)
+    assert stored(conn) == [(1, 'AAA', 'A'), (2, 'BBB', 'B2'), (4, 'DDD', 'D')]
+
+def test_sqlite_symbol_swap(conn):
+    upsert_sqlite(conn, dhan([(1, 'AAA', 'A'), (2, 'BBB', 'B'), (3, 'CCC', 'C')]))
+    # 1 and 2 trade their symbols; CCC moves from 3 to the new id 4
+    stats = upsert_sqlite(conn, dhan([(1, 'BBB', 'B'), (2, 'AAA', 'A'), (4, 'CCC', 'C')]))
+    assert counts(stats) == (1, 2, 1)
+    assert stored(conn) == [(1, 'BBB', 'B'), (2, 'AAA', 'A'), (4, 'CCC', 'C')]
+
+def test_sqlite_delta_counts_row_whose_symbol_moved(conn):
+    upsert_sqlite(conn, dhan([(1, 'AAA', 'A'), (2, 'BBB', 'B')]))
+    # Only the new listing is in the delta; 2 loses BBB to it without being in deleted_keys
+    stats = upsert_sqlite(conn, dhan([(3, 'BBB', 'B')]), deleted_keys=[])
+    assert counts(stats) == (1, 0, 1)
+    assert stored(conn) == [(1, 'AAA', 'A'), (3, 'BBB', 'B')]
+
+def test_legacy_table_is_migrated(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    # As written by DataFrame.to_sql: no primary key and TEXT security ids
+    with sqlite3.connect(path) as legacy:
+        pd.DataFrame({'security_id': ['1333', '11536', None], 'trading_symbol': ['HDFCBANK', 'TCS', 'NOID'],
+                      'name': ['HDFC Bank', 'TCS', 'No id'], 'extra': [1, 2, 3]}).to_sql('dhan_nse', legacy, index=False)
+    legacy.close()
+    conn = connect_sqlite(path)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            ensure_sqlite_schema(conn)
+        assert conn.execute("SELECT security_id, typeof(security_id), trading_symbol FROM dhan_nse "
+                            "ORDER BY security_id").fetchall() == [(1333, 'integer', 'HDFCBANK'),
+                                                                    (11536, 'integer', 'TCS')]
+        assert is_strict(conn, 'dhan_nse') == STRICT_TABLES
+        assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'dhan_nse_legacy'").fetchone()
+        # The migrated table is keyed, so it can be upserted; 1333 gains the exchange it lacked
+        assert counts(upsert_sqlite(conn, dhan([(1333, 'HDFCBANK', 'HDFC Bank'), (1, 'NEW', 'New')]))) == (1, 1, 1)
+        assert stored(conn) == [(1, 'NEW', 'New'), (1333, 'HDFCBANK', 'HDFC Bank')]
+    finally:
+        conn.close()
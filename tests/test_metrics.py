@@ -0,0 +1,16 @@
+import json
+
+import metrics
+from metrics import RunMetrics
+
+def test_peak_rss_is_none_without_resource(tmp_path, monkeypatch):
+    # As on Windows, where the resource module does not exist
+    monkeypatch.setattr(metrics, 'resource', None)
+    run = RunMetrics('test', metrics_dir=tmp_path)
+    assert run.run('double', lambda x: x * 2, 21) == 42
+    with open(run.finish()) as f:
+        report = json.load(f)
+    assert report['peak_rss_bytes'] is None and report['stages'][0]['peak_rss_bytes'] is None
+    prom = (tmp_path / 'test.prom').read_text()
+    assert 'etl_stage_wall_seconds{pipeline="test",stage="double"}' in prom
+    assert 'etl_stage_peak_rss_bytes{' not in prom
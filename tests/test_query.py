@@ -0,0 +1,87 @@
+import contextlib
+import io
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+
+from load import connect_sqlite, ensure_sqlite_schema, upsert_reconciled, upsert_sqlite
+from query import ReadPool
+
+def instruments(start, count, **columns):
+    return pd.DataFrame({'exchange': 'NSE', 'trading_symbol': [f"SYM{i}" for i in range(start, start + count)],
+                         'security_id': range(start, start + count),
+                         'isin': [f"INE{i:08d}0" for i in range(start, start + count)], **columns})
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'nse.db')
+    common = instruments(0, 200, match_tier='exact')
+    frames = {'common_stocks': common, 'only_in_upstox': instruments(200, 50).assign(security_id=None),
+              'only_in_dhan': instruments(250, 50)}
+    conn = connect_sqlite(path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ensure_sqlite_schema(conn)
+        upsert_sqlite(conn, pd.concat([common, frames['only_in_dhan']]))
+        upsert_reconciled(conn, frames)
+    conn.close()
+    return path
+
+@pytest.fixture
+def pool(db_path):
+    pool = ReadPool(db_path, size=2)
+    yield pool
+    pool.close()
+
+@pytest.mark.parametrize('statement', [
+    "INSERT INTO dhan_nse (security_id, trading_symbol) VALUES (999, 'NEW')",
+    "UPDATE common_stocks SET name = 'changed'",
+    "DELETE FROM only_in_dhan",
+    "CREATE TABLE scratch (x)",
+])
+def test_pool_connections_cannot_write(pool, db_path, statement):
+    with pool.connection() as conn:
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute(statement)
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM dhan_nse").fetchone()[0] == 250
+
+def test_concurrent_reads_return_their_rows(pool):
+    errors = []
+
+    def read(offset):
+        try:
+            for i in range(offset, 300, 8):
+                symbol = f"SYM{i}"
+                source = 'both' if i < 200 else 'upstox' if i < 250 else 'dhan'
+                rows = pool.lookup(symbol)
+                assert [(row.trading_symbol, row.source) for row in rows] == [(symbol, source)]
+                assert pool.lookup(f"INE{i:08d}0", key='isin') == rows
+                assert (pool.dhan_instrument(symbol) is None) == (source == 'upstox')
+                batch = [f"SYM{j}" for j in range(i, i + 20)] + ['UNKNOWN']
+                found = pool.lookup_many(batch)
+                assert list(found) == batch and found['UNKNOWN'] == []
+                assert all(rows[0].trading_symbol == value for value, rows in found.items() if rows)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read, args=(offset,)) for offset in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    # Eight threads shared the pool's two connections
+    assert pool._opened == 2
+
+def test_reads_see_last_committed_load(pool, db_path):
+    writer = connect_sqlite(db_path)
+    try:
+        writer.execute("BEGIN IMMEDIATE")
+        writer.execute("UPDATE common_stocks SET name = 'Renamed' WHERE trading_symbol = 'SYM1'")
+        assert pool.lookup('SYM1')[0].name is None
+        writer.execute("COMMIT")
+        assert pool.lookup('SYM1')[0].name == 'Renamed'
+    finally:
+        writer.close()
@@ -0,0 +1,38 @@
+import os
+
+import pandas as pd
+import pytest
+
+from sinks import SINKS, apply_output_schema, output_paths, write_outputs
+
+READERS = {'csv': pd.read_csv, 'parquet': pd.read_parquet, 'feather': pd.read_feather}
+
+def frames():
+    common = pd.DataFrame({
+        'exchange': ['NSE', 'NSE', 'NSE'],
+        'instrument_key': ['NSE_EQ|INE002A01018', 'NSE_EQ|INE467B01029', None],
+        'security_id': [2885, 11536, None],
+        'name': ['RELIANCE INDUSTRIES LTD', 'TATA CONSULTANCY SERV LT', 'Ünicode, "quoted"'],
+        'isin': ['INE002A01018', 'INE467B01029', None],
+        'trading_symbol': ['RELIANCE', 'TCS', 'UNI'],
+        'match_tier': ['exact', 'isin', 'exact'],
+    })
+    return {'common_stocks': common, 'only_in_dhan': common.iloc[:0]}
+
+@pytest.mark.parametrize('fmt', sorted(SINKS))
+def test_round_trip(tmp_path, fmt):
+    written = frames()
+    paths = write_outputs(written, formats=[fmt], output_dir=str(tmp_path))
+    assert paths == output_paths(written, [fmt], str(tmp_path))
+    for (name, df), path in zip(written.items(), paths):
+        read = READERS[fmt](path)
+        if fmt == 'csv':
+            # CSV keeps no types; the others store the output schema's
+            read = apply_output_schema(read)
+        pd.testing.assert_frame_equal(read, apply_output_schema(df).reset_index(drop=True))
+    # Written atomically: no temporary files are left behind
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(os.path.basename(p) for p in paths)
+
+def test_unknown_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match="Unknown output formats"):
+        write_outputs(frames(), formats=['xlsx'], output_dir=str(tmp_path))
@@ -0,0 +1,65 @@
+import contextlib
+import io
+import os
+
+import pandas as pd
+import pytest
+
+import sources
+from conftest import FIXTURE_DIR
+from sources import SOURCES, PRESENCE_OUTPUT, run_sources
+
+PATHS = {name: os.path.join(FIXTURE_DIR, adapter.cache_name) for name, adapter in SOURCES.items()}
+
+# Which sources list each NSE Equity symbol of the fixtures
+PRESENCE = {
+    'INFY': {'upstox', 'angel'},
+    'M&M': {'zerodha', 'angel'},
+    'RELIANCE': {'upstox', 'dhan', 'zerodha', 'angel'},
+    'TCS': {'upstox', 'dhan', 'zerodha'},
+    'UPONLY': {'upstox'},
+    'ZOMATO': {'dhan'},
+}
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # The symbol memo and run report are written relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sources, 'fetch', lambda name: pytest.fail(f"{name} was fetched"))
+    return tmp_path
+
+def run(**kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_sources(**kwargs)
+
+def test_presence_matrix_of_fixtures(workdir):
+    matrix = run(paths=PATHS, output_dir=workdir / 'output')
+    assert matrix['trading_symbol'].tolist() == sorted(PRESENCE)
+    for name in SOURCES:
+        assert matrix[f"in_{name}"].tolist() == [name in PRESENCE[symbol] for symbol in sorted(PRESENCE)]
+    assert matrix['source_count'].tolist() == [len(PRESENCE[symbol]) for symbol in sorted(PRESENCE)]
+    written = pd.read_csv(workdir / 'output' / f"{PRESENCE_OUTPUT}.csv", keep_default_na=False)
+    assert written['trading_symbol'].tolist() == sorted(PRESENCE)
+
+def test_source_id_columns(workdir):
+    matrix = run(paths=PATHS, output_dir=workdir / 'output').set_index('trading_symbol')
+    id_columns = [f"{name}_{column}" for name, adapter in SOURCES.items() for column in adapter.ids]
+    assert [column for column in matrix.columns if column in id_columns] == id_columns
+    reliance = matrix.loc['RELIANCE']
+    assert reliance['upstox_instrument_key'] == 'NSE_EQ|INE002A01018'
+    assert reliance['dhan_security_id'] == 2885
+    assert (reliance['zerodha_instrument_token'], reliance['zerodha_exchange_token']) == (738561, 2885)
+    assert reliance['angel_token'] == 2885
+    # Ids of sources not listing a symbol are missing
+    assert pd.isna(matrix.loc['ZOMATO', 'angel_token']) and pd.isna(matrix.loc['M&M', 'upstox_instrument_key'])
+    assert matrix.loc['TCS', 'isin'] == 'INE467B01029'
+
+def test_subset_of_sources(workdir):
+    matrix = run(names=['zerodha', 'angel'], paths={name: PATHS[name] for name in ('zerodha', 'angel')},
+                 output_dir=workdir / 'output')
+    assert list(matrix.columns[:5]) == ['trading_symbol', 'in_zerodha', 'in_angel', 'source_count', 'isin']
+    assert matrix['trading_symbol'].tolist() == ['INFY', 'M&M', 'RELIANCE', 'TCS']
+
+def test_unknown_source_path_is_rejected(workdir):
+    with pytest.raises(ValueError, match="Unknown source 'kite'"):
+        run(paths={'kite': PATHS['zerodha']}, output_dir=workdir / 'output')
@@ -0,0 +1,109 @@
+import contextlib
+import io
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import streaming
+from benchmark import MemoryCollection, synthetic_dhan_master
+from conftest import FIXTURE_PATH
+from load import SQL_COLUMNS
+from validate import RULES, Rule, ValidationError
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in tmp_path with the sources read from local files and SQLite in tmp_path."""
+    dhan_path = tmp_path / 'dhan.csv'
+    synthetic_dhan_master(pd.read_csv(FIXTURE_PATH)).to_csv(dhan_path, index=False)
+    paths = {'upstox_nse.csv.gz': FIXTURE_PATH, 'dhan_scrip.csv': str(dhan_path)}
+    monkeypatch.setattr(streaming, 'fetch_source', lambda url, cache_name: (paths[cache_name], None))
+    monkeypatch.setenv('SQLITE_DB_PATH', str(tmp_path / 'nse.db'))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def run(**kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return streaming.run_streaming_pipeline(collection=MemoryCollection(), batch_size=5000, **kwargs)
+
+def failing_after(transform, batches):
+    calls = []
+
+    def wrapped(df, symbol_memo=None):
+        calls.append(len(df))
+        if len(calls) > batches:
+            raise RuntimeError("source read failed")
+        return transform(df, symbol_memo=symbol_memo)
+    return wrapped
+
+def snapshot(workdir):
+    with sqlite3.connect(workdir / 'nse.db') as conn:
+        rows = conn.execute("SELECT * FROM dhan_nse ORDER BY security_id").fetchall()
+    outputs = {name: (workdir / 'output' / name).read_bytes() for name in os.listdir(workdir / 'output')
+               if name.endswith('.csv')}
+    return rows, outputs
+
+def test_complete_run_loads_and_reconciles(workdir):
+    frames = run()
+    rows, outputs = snapshot(workdir)
+    assert len(rows) == len(frames['common_stocks']) + len(frames['only_in_dhan'])
+    assert {'common_stocks.csv', 'only_in_upstox.csv', 'only_in_dhan.csv'} <= set(outputs)
+    assert (workdir / 'output' / 'validation_report.json').exists()
+    with sqlite3.connect(workdir / 'nse.db') as conn:
+        assert conn.execute("SELECT COUNT(*) FROM common_stocks").fetchone()[0] == len(frames['common_stocks'])
+        assert conn.execute("SELECT COUNT(*) FROM instrument_history").fetchone()[0] == len(rows) + len(
+            frames['only_in_upstox'])
+
+def test_invalid_source_is_not_committed(workdir, monkeypatch):
+    run()
+    before = snapshot(workdir)
+    # The synthetic Dhan master has no ISINs
+    monkeypatch.setitem(RULES, 'dhan', RULES['dhan'] + [Rule('isin_not_null', 'isin', 'not_null')])
+    with pytest.raises(ValidationError):
+        run()
+    assert snapshot(workdir) == before
+
+@pytest.mark.parametrize('source', ['upstox', 'dhan'])
+def test_failed_producer_leaves_previous_load_and_outputs(workdir, monkeypatch, source):
+    run()
+    before = snapshot(workdir)
+    # Fewer rows than before, so a partial merge would delete rows and change the outputs
+    monkeypatch.setitem(streaming.SOURCES[source], 'transform',
+                        failing_after(streaming.SOURCES[source]['transform'], 1))
+    with pytest.raises(RuntimeError, match="source read failed"):
+        run()
+    assert snapshot(workdir) == before
+
+class CancelledAfterEnd(streaming.BoundedQueue):
+    """Queue whose run is cancelled right after its last end marker is taken, as by a peer failing then."""
+
+    def get(self):
+        item = super().get()
+        if item[1] is None and self._queue.empty():
+            self.cancelled.set()
+        return item
+
+@pytest.mark.parametrize('sink', ['sqlite', 'reconcile'])
+def test_sink_cancelled_after_end_marker_writes_nothing(workdir, sink):
+    run()
+    before = snapshot(workdir)
+    inputs = CancelledAfterEnd(sink, streaming.threading.Event())
+    sources = ['dhan'] if sink == 'sqlite' else ['dhan', 'upstox']
+    for source in sources:
+        inputs.put((source, 0, pd.DataFrame(columns=SQL_COLUMNS), 0.0))
+    for source in sources:
+        inputs.put((source, None, None, 0.0))
+    with pytest.raises(streaming.Cancelled):
+        getattr(streaming, f"{sink}_sink")(inputs, streaming.RunMetrics('streaming'))
+    assert snapshot(workdir) == before
+
+def test_invalid_upstox_batch_is_not_upserted(workdir, monkeypatch):
+    collection = MemoryCollection()
+    # Fails some rows of every batch
+    monkeypatch.setitem(RULES, 'upstox', RULES['upstox'] + [
+        Rule('trading_symbol_first_half', 'trading_symbol', 'pattern', r'[A-M].*', max_failure_rate=0)])
+    with pytest.raises(ValidationError, match="upstox batch"):
+        with contextlib.redirect_stdout(io.StringIO()):
+            streaming.run_streaming_pipeline(collection=collection, batch_size=5000)
+    assert collection.docs == {}
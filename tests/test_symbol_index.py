@@ -0,0 +1,107 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from symbol_index import CURRENT_FILE, BUILD_PREFIX, Instrument, write_symbol_index, open_symbol_index
+
+def frames(suffix=''):
+    common = pd.DataFrame({
+        'trading_symbol': ['TCS', 'INFY', 'RELIANCE'],
+        'instrument_key': ['NSE_EQ|INE467B01029', 'NSE_EQ|INE009A01021', 'NSE_EQ|INE002A01018'],
+        'security_id': ['11536', '1594', '2885'],
+        'isin': ['INE467B01029', 'INE009A01021', 'INE002A01018'],
+    })
+    common['trading_symbol'] += suffix
+    only_upstox = pd.DataFrame({'trading_symbol': ['UPONLY'], 'instrument_key': ['NSE_EQ|X'], 'isin': [None]})
+    only_dhan = pd.DataFrame({'trading_symbol': ['DHONLY'], 'security_id': [42], 'isin': [None]})
+    return common, only_upstox, only_dhan
+
+@pytest.fixture
+def index(tmp_path):
+    write_symbol_index(*frames(), tmp_path)
+    return open_symbol_index(tmp_path)
+
+def test_resolves_every_key(index):
+    expected = Instrument('TCS', 'NSE_EQ|INE467B01029', 11536, 'INE467B01029', 'both')
+    assert index.by_symbol('TCS') == expected
+    assert index.by_instrument_key('NSE_EQ|INE467B01029') == expected
+    assert index.by_isin('INE467B01029') == expected
+    assert index.by_security_id(11536) == expected
+    assert index.by_security_id('11536') == expected
+    assert index.by_security_id(np.int64(11536)) == expected
+    assert index.by_symbol('UPONLY') == Instrument('UPONLY', 'NSE_EQ|X', None, None, 'upstox')
+    assert index.by_security_id(42).source == 'dhan'
+
+@pytest.mark.parametrize('value', ['12a', '', 'TCS', None, 1.5, True, 2 ** 70, 'ÄBC'])
+def test_unknown_or_malformed_security_id_is_not_found(index, value):
+    assert index.row_of('security_id', value) == -1
+
+@pytest.mark.parametrize('value', ['TC', 'TCSX', 'ÄBC', 'X' * 100, 5, None])
+def test_unknown_symbol_is_not_found(index, value):
+    assert index.row_of('trading_symbol', value) == -1
+
+def test_rebuild_swaps_builds_and_keeps_open_index_consistent(tmp_path):
+    write_symbol_index(*frames(), tmp_path)
+    old = open_symbol_index(tmp_path)
+    write_symbol_index(*frames('X'), tmp_path)
+    # The open index stays on its build; a new one sees the rebuild
+    assert old.by_symbol('TCS') is not None and old.by_symbol('TCSX') is None
+    new = open_symbol_index(tmp_path)
+    assert new.by_symbol('TCSX') is not None and new.by_symbol('TCS') is None
+    write_symbol_index(*frames(), tmp_path)
+    path = tmp_path / 'symbol_index'
+    builds = [entry for entry in os.listdir(path) if entry.startswith(BUILD_PREFIX)]
+    # The current build and the one before it
+    assert len(builds) == 2
+    assert sorted(os.listdir(path)) == sorted(builds + [CURRENT_FILE])
+
+def test_readers_never_see_a_missing_or_mixed_index(tmp_path):
+    write_symbol_index(*frames(), tmp_path)
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            try:
+                index = open_symbol_index(tmp_path)
+                found = [index.by_symbol(symbol) is not None for symbol in ('TCS', 'TCSX')]
+                assert sum(found) == 1 and len(index) == 5
+            except Exception as e:
+                errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for i in range(30):
+        write_symbol_index(*frames('X' if i % 2 else ''), tmp_path)
+    stop.set()
+    for reader in readers:
+        reader.join()
+    assert errors == []
+
+def test_threads_share_one_open_index(tmp_path):
+    common, only_upstox, only_dhan = frames()
+    write_symbol_index(common, only_upstox, only_dhan, tmp_path)
+    index = open_symbol_index(tmp_path)
+    expected = {symbol: index.by_symbol(symbol) for symbol in common['trading_symbol'].tolist() + ['UPONLY', 'DHONLY']}
+    ids = {instrument.security_id: instrument for instrument in expected.values() if instrument.security_id}
+    errors = []
+
+    def read():
+        for _ in range(2000):
+            for symbol, instrument in expected.items():
+                if index.by_symbol(symbol) != instrument:
+                    errors.append(symbol)
+            for security_id, instrument in ids.items():
+                if index.by_security_id(security_id) != instrument:
+                    errors.append(security_id)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    assert errors == []
@@ -0,0 +1,67 @@
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import FIXTURE_PATH
+from transform import normalize_trading_symbol, normalize_trading_symbols
+
+EDGE_CASES = [None, np.nan, pd.NA, '', '   ', 0, 0.0, False, True, 5, 1.5, -3,
+              ' reliance-eq ', 'M&M', 'BAJAJ-AUTO', 'ABC.BE', 'X-EQ-EQ', '-EQ', 'tcs-be', 'ÄBC', 'NIFTY 50']
+
+def reference(values):
+    return [normalize_trading_symbol(value) for value in values]
+
+@pytest.mark.parametrize('value', EDGE_CASES, ids=repr)
+def test_matches_scalar_function_on_edge_case(value):
+    assert normalize_trading_symbols(pd.Series([value], dtype=object)).tolist() == reference([value])
+
+def test_matches_scalar_function_on_mixed_series():
+    symbols = pd.Series(EDGE_CASES, dtype=object, index=np.arange(100, 100 + len(EDGE_CASES)))
+    result = normalize_trading_symbols(symbols)
+    assert result.tolist() == reference(EDGE_CASES)
+    assert result.index.equals(symbols.index)
+
+@pytest.mark.parametrize('dtype', ['int64', 'float64'])
+def test_matches_scalar_function_on_numeric_series(dtype):
+    symbols = pd.Series([0, 1, 20, 300], dtype=dtype)
+    assert normalize_trading_symbols(symbols).tolist() == reference(symbols.tolist())
+
+def test_matches_scalar_function_on_fixture():
+    symbols = pd.read_csv(FIXTURE_PATH, usecols=['tradingsymbol'], dtype={'tradingsymbol': 'string[pyarrow]'})
+    symbols = symbols['tradingsymbol']
+    assert normalize_trading_symbols(symbols).tolist() == reference(symbols.astype(object).tolist())
+
+def test_memo_gives_same_result_and_is_filled():
+    symbols = pd.Series(EDGE_CASES + ['INFY-EQ', 'INFY-EQ'], dtype=object)
+    memo = {}
+    first = normalize_trading_symbols(symbols, memo)
+    assert memo['INFY-EQ'] == 'INFY'
+    assert normalize_trading_symbols(symbols, memo).tolist() == first.tolist()
+    assert first.tolist() == reference(symbols.tolist())
+
+def test_memo_shared_between_threads():
+    memo, errors = {}, []
+
+    def normalize(thread):
+        try:
+            for batch in range(40):
+                # Half the symbols were memoized by the previous batch, the other half are new
+                series = pd.Series([f"S{thread}-{batch + i % 2}-{i}-EQ" for i in range(300)], dtype=object)
+                assert normalize_trading_symbols(series, memo).tolist() == reference(series)
+        except Exception as e:
+            errors.append(e)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        threads = [threading.Thread(target=normalize, args=(thread,)) for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from validate import RULES, ValidationError, isin_check_digits, validate_frame, validate_frames
+
+VALID_ISINS = ['INE002A01018', 'INE467B01029', 'US0378331005', 'GB0002634946', 'INF209K01YN0']
+
+def test_valid_isins_pass_the_check_digit():
+    well_formed, valid = isin_check_digits(VALID_ISINS)
+    assert well_formed.all() and valid.all()
+
+@pytest.mark.parametrize('isin, well_formed, valid', [
+    ('INE002A01019', True, False),     # wrong check digit
+    ('US0378331004', True, False),
+    ('ine002a01018', False, False),    # lowercase
+    ('INE002A0101', False, False),     # 11 characters
+    ('INE002A010188', False, False),   # 13 characters
+    ('1NE002A01018', False, False),    # digit in the country code
+    ('INE002A0101X', False, False),    # letter as check digit
+    ('', False, False),
+])
+def test_invalid_isins(isin, well_formed, valid):
+    assert isin_check_digits([isin]) == (np.array([well_formed]), np.array([valid]))
+
+def upstox_rows():
+    rows = [{'trading_symbol': f"SYM{i}", 'instrument_key': f"NSE_EQ|{isin}", 'isin': isin, 'exchange': 'NSE_EQ'}
+            for i, isin in enumerate(VALID_ISINS * 2)]
+    return pd.DataFrame(rows)
+
+# Rule -> (column, value) making one row fail only that rule
+UPSTOX_FAILURES = {
+    'trading_symbol_not_null': ('trading_symbol', None),
+    'trading_symbol_unique': ('trading_symbol', 'SYM0'),
+    'isin_format': ('isin', 'ine002a01018'),
+    'isin_check_digit': ('isin', 'INE002A01019'),
+    'instrument_key_not_null': ('instrument_key', None),
+    'instrument_key_exchange_prefix': ('instrument_key', 'BSE_EQ|INE002A01018'),
+}
+
+def test_each_upstox_rule_flags_its_row():
+    df = upstox_rows()
+    assert validate_frame(df, 'upstox')['passed']
+    rows = {}
+    for row, (rule, (column, value)) in enumerate(UPSTOX_FAILURES.items(), start=1):
+        df.loc[row, column] = value
+        rows[rule] = row
+    report = validate_frame(df, 'upstox')
+    results = {result['rule']: result for result in report['rules']}
+    assert set(results) == {rule.name for rule in RULES['upstox']} == set(UPSTOX_FAILURES)
+    for rule, row in rows.items():
+        assert results[rule]['failed'] == 1 and not results[rule]['passed']
+        assert [sample['row'] for sample in results[rule]['samples']] == [row]
+    assert not report['passed']
+
+def test_each_dhan_rule_flags_its_row():
+    df = pd.DataFrame({'trading_symbol': [f"SYM{i}" for i in range(10)], 'isin': VALID_ISINS * 2,
+                       'security_id': [str(1000 + i) for i in range(10)]})
+    assert validate_frame(df, 'dhan')['passed']
+    df.loc[1, 'security_id'] = None
+    df.loc[2, 'security_id'] = '12.5'
+    report = validate_frame(df, 'dhan')
+    failed = {result['rule']: [sample['row'] for sample in result['samples']] for result in report['rules']}
+    assert failed['security_id_not_null'] == [1] and failed['security_id_integer'] == [2]
+    assert not any(rows for rule, rows in failed.items() if not rule.startswith('security_id'))
+
+def test_missing_column_fails_its_rules():
+    report = validate_frame(upstox_rows().drop(columns='isin'), 'upstox')
+    for result in report['rules']:
+        assert (result['failed'] == 10) == (result['column'] == 'isin')
+
+def test_failure_rate_limit(tmp_path):
+    df = upstox_rows()
+    df.loc[3, 'isin'] = 'INE002A01019'
+    path = str(tmp_path / 'report.json')
+    # One bad check digit in ten rows is within a 10% limit but not the default 1%
+    assert validate_frames({'upstox': df}, path, max_failure_rate=0.1)['passed']
+    with pytest.raises(ValidationError, match="upstox: isin_check_digit"):
+        validate_frames({'upstox': df}, path)
+    with open(path) as f:
+        assert json.load(f)['passed'] is False
@@ -1,155 +1,304 @@
-import pandas as pd
-import re
-
-def normalize_trading_symbol(symbol):
-    """Normalize trading symbol by removing unwanted characters and standardizing format."""
-    if pd.isna(symbol) or not symbol:
-        print(f"Warning: Encountered null or empty trading_symbol: {symbol}")
-        return None
-    raw_symbol = str(symbol)
-    symbol = raw_symbol.strip().upper()
-    # Remove common suffixes
-    symbol = re.sub(r'-(EQ|BE|RE|SM|ST|PP|BL|BZ|IW|GS|GB|N[1-3])$', '', symbol)
-    # Keep alphanumeric and &
-    symbol = re.sub(r'[^\w&]', '', symbol)
-    if not symbol:
-        print(f"Warning: Normalized trading_symbol is empty (raw: {raw_symbol})")
-        return None
-    if symbol != raw_symbol:
-        print(f"Normalized trading_symbol: {raw_symbol} -> {symbol}")
-    return symbol
-
-def transform_upstox_data(df):
-    """Filter and transform Upstox data for NSE Equity instruments."""
-    print("Transforming Upstox data for NSE Equity...")
-    print("Raw Upstox DataFrame shape:", df.shape)
-    print("Upstox columns:", df.columns.tolist())
-    print("Unique exchange values:", df['exchange'].unique().tolist())
-    print("Unique instrument_type values:", df['instrument_type'].unique().tolist())
-    
-    # Filter for NSE Equity variations
-    df_filtered = df[(df['exchange'].str.contains('NSE', case=False, na=False)) & 
-                     (df['instrument_type'].str.contains('EQ|EQUITY|STOCK|SHARE', case=False, na=False))]
-    print(f"Filtered Upstox DataFrame shape: {df_filtered.shape}")
-    
-    if df_filtered.empty:
-        print("Warning: No NSE Equity instruments found in Upstox data.")
-        print("Sample Upstox rows (first 5):")
-        print(df.head(5))
-    
-    # Define available columns
-    available_columns = df_filtered.columns.tolist()
-    required_columns = ['exchange', 'instrument_key', 'tradingsymbol', 'name']
-    optional_columns = ['isin', 'short_name']
-    
-    # Select available required columns
-    columns_to_select = [col for col in required_columns if col in available_columns]
-    
-    # Initialize transformed DataFrame
-    df_transformed = df_filtered[columns_to_select].copy()
-    
-    # Normalize trading_symbol
-    if 'tradingsymbol' in df_transformed.columns:
-        df_transformed['tradingsymbol'] = df_transformed['tradingsymbol'].apply(normalize_trading_symbol)
-    
-    # Add symbol_name
-    df_transformed['symbol_name'] = df_transformed['tradingsymbol'] if 'tradingsymbol' in df_transformed.columns else None
-    
-    # Add security_id
-    df_transformed['security_id'] = None
-    
-    # Add optional columns
-    for col in optional_columns:
-        if col not in df_transformed.columns:
-            df_transformed[col] = None
-    
-    # Rename columns
-    df_transformed = df_transformed.rename(columns={'tradingsymbol': 'trading_symbol'})
-    
-    # Validate trading_symbol
-    if 'trading_symbol' in df_transformed.columns:
-        null_symbols = df_transformed['trading_symbol'].isna().sum()
-        if null_symbols > 0:
-            print(f"Warning: {null_symbols} null trading_symbol values in Upstox data.")
-            df_transformed = df_transformed.dropna(subset=['trading_symbol'])
-            print(f"Upstox DataFrame shape after removing nulls: {df_transformed.shape}")
-        duplicates = df_transformed['trading_symbol'].duplicated(keep=False)
-        if duplicates.sum() > 0:
-            print(f"Warning: {duplicates.sum()} duplicate trading_symbol values in Upstox data.")
-            print("Duplicate trading_symbols:", df_transformed[duplicates]['trading_symbol'].unique().tolist())
-            print("Sample duplicate rows:\n", df_transformed[duplicates].head(5))
-            df_transformed = df_transformed.drop_duplicates(subset=['trading_symbol'], keep='first')
-            print(f"After removing duplicates, Upstox DataFrame shape: {df_transformed.shape}")
-        print(f"Unique Upstox trading_symbol count: {df_transformed['trading_symbol'].nunique()}")
-    
-    # Reorder columns
-    output_columns = ['exchange', 'instrument_key', 'symbol_name', 'security_id', 
-                     'short_name', 'name', 'isin', 'trading_symbol']
-    for col in output_columns:
-        if col not in df_transformed.columns:
-            df_transformed[col] = None
-    
-    print(f"Final Upstox transformed DataFrame shape: {df_transformed.shape}")
-    if not df_transformed.empty:
-        print("Sample Upstox transformed data:\n", df_transformed.head(5))
-    return df_transformed[output_columns]
-
-def transform_dhan_data(df):
-    """Filter and transform Dhan data for NSE Equity instruments."""
-    print("Transforming Dhan data for NSE Equity...")
-    print("Raw Dhan DataFrame shape:", df.shape)
-    print("Dhan columns:", df.columns.tolist())
-    
-    # Filter for NSE Equity
-    df_filtered = df[(df['SEM_EXM_EXCH_ID'] == 'NSE') & (df['SEM_INSTRUMENT_NAME'] == 'EQUITY')]
-    print(f"Filtered Dhan DataFrame shape: {df_filtered.shape}")
-    
-    if df_filtered.empty:
-        print("Warning: No NSE Equity instruments found in Dhan data.")
-    
-    # Select and rename columns
-    df_transformed = df_filtered[[
-        'SEM_EXM_EXCH_ID', 'SM_SYMBOL_NAME', 'SEM_SMST_SECURITY_ID', 'SEM_TRADING_SYMBOL'
-    ]].copy()
-    
-    # Normalize trading_symbol
-    if 'SEM_TRADING_SYMBOL' in df_transformed.columns:
-        df_transformed['SEM_TRADING_SYMBOL'] = df_transformed['SEM_TRADING_SYMBOL'].apply(normalize_trading_symbol)
-    
-    # Add missing columns
-    df_transformed['instrument_key'] = None
-    df_transformed['short_name'] = None
-    df_transformed['name'] = None
-    df_transformed['isin'] = None
-    
-    # Rename columns
-    df_transformed = df_transformed.rename(columns={
-        'SEM_EXM_EXCH_ID': 'exchange',
-        'SM_SYMBOL_NAME': 'symbol_name',
-        'SEM_SMST_SECURITY_ID': 'security_id',
-        'SEM_TRADING_SYMBOL': 'trading_symbol'
-    })
-    
-    # Validate trading_symbol
-    if 'trading_symbol' in df_transformed.columns:
-        null_symbols = df_transformed['trading_symbol'].isna().sum()
-        if null_symbols > 0:
-            print(f"Warning: {null_symbols} null trading_symbol values in Dhan data.")
-            df_transformed = df_transformed.dropna(subset=['trading_symbol'])
-            print(f"Dhan DataFrame shape after removing nulls: {df_transformed.shape}")
-        duplicates = df_transformed['trading_symbol'].duplicated(keep=False)
-        if duplicates.sum() > 0:
-            print(f"Warning: {duplicates.sum()} duplicate trading_symbol values in Dhan data.")
-            print("Duplicate trading_symbols:", df_transformed[duplicates]['trading_symbol'].unique().tolist())
-            print("Sample duplicate rows:\n", df_transformed[duplicates].head(5))
-            df_transformed = df_transformed.drop_duplicates(subset=['trading_symbol'], keep='first')
-            print(f"After removing duplicates, Dhan DataFrame shape: {df_transformed.shape}")
-        print(f"Unique Dhan trading_symbol count: {df_transformed['trading_symbol'].nunique()}")
-    
-    # Reorder columns
-    output_columns = ['exchange', 'instrument_key', 'symbol_name', 'security_id', 
-                      'short_name', 'name', 'isin', 'trading_symbol']
-    print(f"Final Dhan transformed DataFrame shape: {df_transformed.shape}")
-    if not df_transformed.empty:
-        print("Sample Dhan transformed data:\n", df_transformed.head(5))
+import pandas as pd
+import json
+import os
+import re
+import threading
+
+import diagnostics
+from diagnostics import lazy
+from schemas import UPSTOX_SCHEMA, DHAN_SCHEMA
+
+try:
+    import pyarrow  # noqa: F401 - enables Arrow-backed string kernels
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Exchange series suffixes stripped from trading symbols
+SYMBOL_SUFFIX_PATTERN = r'-(EQ|BE|RE|SM|ST|PP|BL|BZ|IW|GS|GB|N[1-3])$'
+# Anything other than alphanumerics and &
+SYMBOL_INVALID_CHARS_PATTERN = r'[^\w&]'
+
+# ISIN embedded in Upstox equity instrument keys, e.g. NSE_EQ|INE0LLY01014
+INSTRUMENT_KEY_ISIN_PATTERN = r'^[A-Z]+_EQ\|([A-Z]{2}[A-Z0-9]{9}[0-9])$'
+
+# Persistent raw -> normalized trading symbol memo shared across runs
+SYMBOL_MEMO_PATH = os.path.join('cache', 'symbol_memo.json')
+# Held while a symbol memo is read or updated, as one memo is shared by
+# the transforms running on concurrent threads
+SYMBOL_MEMO_LOCK = threading.Lock()
+
+def upstox_equity_mask(df):
+    """Return a boolean mask selecting NSE Equity rows of an Upstox frame."""
+    return (df['exchange'].str.contains('NSE', case=False, na=False) &
+            df['instrument_type'].str.contains('EQ|EQUITY|STOCK|SHARE', case=False, na=False))
+
+def dhan_equity_mask(df):
+    """Return a boolean mask selecting NSE Equity rows of a Dhan frame."""
+    return (df['SEM_EXM_EXCH_ID'] == 'NSE') & (df['SEM_INSTRUMENT_NAME'] == 'EQUITY')
+
+def zerodha_equity_mask(df):
+    """Return a boolean mask selecting NSE Equity rows of a Zerodha frame."""
+    return (df['exchange'] == 'NSE') & (df['segment'] == 'NSE') & (df['instrument_type'] == 'EQ')
+
+def angel_equity_mask(df):
+    """Return a boolean mask selecting NSE Equity rows of an Angel frame.
+
+    Angel spells equities with their series suffix (RELIANCE-EQ) and leaves
+    instrumenttype empty, so the series is what tells them from indices.
+    """
+    return (df['exch_seg'] == 'NSE') & (df['symbol'].str.count(SYMBOL_SUFFIX_PATTERN).fillna(0) > 0)
+
+def normalize_trading_symbol(symbol):
+    """Normalize trading symbol by removing unwanted characters and standardizing format."""
+    if pd.isna(symbol) or not symbol:
+        print(f"Warning: Encountered null or empty trading_symbol: {symbol}")
+        return None
+    raw_symbol = str(symbol)
+    symbol = raw_symbol.strip().upper()
+    # Remove common suffixes
+    symbol = re.sub(SYMBOL_SUFFIX_PATTERN, '', symbol)
+    # Keep alphanumeric and &
+    symbol = re.sub(SYMBOL_INVALID_CHARS_PATTERN, '', symbol)
+    if not symbol:
+        print(f"Warning: Normalized trading_symbol is empty (raw: {raw_symbol})")
+        return None
+    if symbol != raw_symbol:
+        print(f"Normalized trading_symbol: {raw_symbol} -> {symbol}")
+    return symbol
+
+def load_symbol_memo(path=SYMBOL_MEMO_PATH):
+    """Load the persisted raw -> normalized trading symbol memo."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_symbol_memo(memo, path=SYMBOL_MEMO_PATH):
+    """Persist the raw -> normalized trading symbol memo."""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with SYMBOL_MEMO_LOCK:
+        memo = dict(memo)
+    with open(path, 'w') as f:
+        json.dump(memo, f)
+
+def normalize_trading_symbols(symbols, memo=None, label='trading_symbol'):
+    """Vectorized normalize_trading_symbol over a whole Series.
+
+    Applies the same strip/upper/suffix/charset cleanup with column string
+    operations and reports aggregated counts and samples (summary
+    diagnostics) instead of one line per symbol. If `memo` is given, symbols
+    already in it are looked up and newly normalized ones are added to it.
+    """
+    values = symbols.reset_index(drop=True)
+    raw = values[values.notna()]
+    # Like normalize_trading_symbol, treat every falsy value (0, False, '') as missing
+    if raw.dtype == object or not pd.api.types.is_string_dtype(raw.dtype):
+        raw = raw[raw.astype(bool)]
+    raw = raw.astype(str)
+    raw = raw[raw != '']
+
+    if memo:
+        # Looked up in a snapshot, so an update from another thread cannot
+        # land between reading the memo's keys and its values
+        with SYMBOL_MEMO_LOCK:
+            snapshot = dict(memo)
+        known = raw.isin(snapshot.keys())
+        cached = raw[known].map(snapshot)
+    else:
+        known = pd.Series(False, index=raw.index)
+        cached = raw.iloc[:0]
+    todo = raw[~known]
+    strings = todo
+    # Arrow's regex engine only agrees with Python's \w on ASCII input
+    if HAS_PYARROW and len(todo) and all(map(str.isascii, todo)):
+        strings = todo.astype('string[pyarrow]')
+    computed = (strings.str.strip()
+                       .str.upper()
+                       .str.replace(SYMBOL_SUFFIX_PATTERN, '', regex=True)
+                       .str.replace(SYMBOL_INVALID_CHARS_PATTERN, '', regex=True)
+                       .astype(object))
+    computed = computed.where(computed != '', None)
+    if memo is not None:
+        new = dict(zip(todo, computed))
+        with SYMBOL_MEMO_LOCK:
+            memo.update(new)
+
+    normalized = pd.concat([cached, computed]).astype(object).reindex(raw.index)
+    normalized = normalized.where(normalized.notna(), None)
+    result = pd.Series([None] * len(values), dtype=object)
+    result[raw.index] = normalized
+    result.index = symbols.index
+
+    # Aggregated change report
+    missing = len(values) - len(raw)
+    emptied = normalized.isna()
+    if missing:
+        diagnostics.warning("Warning: %d null or empty %s values.", missing, label)
+    if emptied.any():
+        diagnostics.warning("Warning: %d %s values normalized to empty, e.g. %s",
+                            emptied.sum(), label, raw[emptied].head(5).tolist())
+    # Comparing every symbol with its raw value is only worth it if reported
+    if diagnostics.enabled('summary'):
+        changed = normalized.notna() & (normalized != raw)
+        if changed.any():
+            samples = [f"{r} -> {n}" for r, n in zip(raw[changed].head(5), normalized[changed].head(5))]
+            diagnostics.summary("Normalized %d of %d %s values (%d from memo), e.g. %s",
+                                changed.sum(), len(values), label, known.sum(), samples)
+    return result
+
+def isin_from_instrument_key(instrument_keys):
+    """Extract the ISIN from Upstox equity instrument keys; None where there is none."""
+    isins = instrument_keys.astype(object).str.extract(INSTRUMENT_KEY_ISIN_PATTERN, expand=False)
+    return isins.where(isins.notna(), None)
+
+def drop_invalid_symbols(df, source):
+    """Drop rows with a null trading_symbol and all but the first row of each repeated one.
+
+    Nulls and duplicates are each computed once; the duplicate listing and
+    sample rows are only built at the debug diagnostics level.
+    """
+    nulls = df['trading_symbol'].isna()
+    null_count = nulls.sum()
+    if null_count:
+        diagnostics.warning("Warning: %d null trading_symbol values in %s data.", null_count, source)
+        df = df[~nulls]
+    duplicates = df['trading_symbol'].duplicated()
+    duplicate_count = duplicates.sum()
+    if duplicate_count:
+        repeated = df.loc[duplicates, 'trading_symbol'].unique()
+        diagnostics.warning("Warning: %d duplicate trading_symbol rows for %d symbols in %s data; keeping the first.",
+                            duplicate_count, len(repeated), source)
+        if diagnostics.enabled('debug'):
+            diagnostics.debug("Duplicate trading_symbols: %s", list(repeated))
+            diagnostics.debug("Sample duplicate rows:\n%s", df[df['trading_symbol'].isin(repeated)].head(5))
+        df = df[~duplicates]
+    if null_count or duplicate_count:
+        diagnostics.summary("%s DataFrame shape after removing null and duplicate symbols: %s", source, df.shape)
+    # What is left is non-null and unique, so no nunique() pass is needed
+    diagnostics.summary("Unique %s trading_symbol count: %d", source, len(df))
+    return df
+
+def transform_upstox_data(df, symbol_memo=None, mask=upstox_equity_mask):
+    """Filter and transform Upstox data for NSE Equity instruments.
+
+    Pass another `mask` (df -> boolean Series) to keep a different exchange
+    segment; see exchanges.PARTITIONS.
+    """
+    diagnostics.summary("Transforming Upstox data for NSE Equity...")
+    diagnostics.summary("Raw Upstox DataFrame shape: %s", df.shape)
+    diagnostics.debug("Upstox columns: %s", lazy(df.columns.tolist))
+    diagnostics.debug("Unique exchange values: %s", lazy(lambda: df['exchange'].unique().tolist()))
+    diagnostics.debug("Unique instrument_type values: %s", lazy(lambda: df['instrument_type'].unique().tolist()))
+    
+    # Filter for NSE Equity variations
+    df_filtered = df[mask(df)]
+    diagnostics.summary("Filtered Upstox DataFrame shape: %s", df_filtered.shape)
+    
+    if df_filtered.empty:
+        diagnostics.warning("Warning: No NSE Equity instruments found in Upstox data.")
+        diagnostics.debug("Sample Upstox rows (first 5):\n%s", lazy(lambda: df.head(5)))
+    
+    # Define available columns
+    available_columns = df_filtered.columns.tolist()
+    required_columns = ['exchange', 'instrument_key', 'tradingsymbol', 'name']
+    optional_columns = ['isin', 'short_name']
+    
+    # Select available required columns
+    columns_to_select = [col for col in required_columns if col in available_columns]
+    
+    # Initialize transformed DataFrame
+    df_transformed = df_filtered[columns_to_select].copy()
+    
+    # Normalize trading_symbol
+    if 'tradingsymbol' in df_transformed.columns:
+        df_transformed['tradingsymbol'] = normalize_trading_symbols(
+            df_transformed['tradingsymbol'], symbol_memo, label='Upstox trading_symbol')
+    
+    # Add symbol_name
+    df_transformed['symbol_name'] = df_transformed['tradingsymbol'] if 'tradingsymbol' in df_transformed.columns else None
+    
+    # Add security_id
+    df_transformed['security_id'] = None
+    
+    # Add optional columns
+    for col in optional_columns:
+        if col not in df_transformed.columns:
+            df_transformed[col] = None
+    
+    # Fill missing ISINs from the instrument key
+    if 'instrument_key' in df_transformed.columns:
+        isins = df_transformed['isin'].astype(object)
+        df_transformed['isin'] = isins.where(isins.notna(), isin_from_instrument_key(df_transformed['instrument_key']))
+    
+    # Rename columns
+    df_transformed = df_transformed.rename(columns=UPSTOX_SCHEMA['rename'])
+    
+    # Validate trading_symbol
+    if 'trading_symbol' in df_transformed.columns:
+        df_transformed = drop_invalid_symbols(df_transformed, 'Upstox')
+    
+    # Reorder columns
+    output_columns = ['exchange', 'instrument_key', 'symbol_name', 'security_id', 
+                     'short_name', 'name', 'isin', 'trading_symbol']
+    for col in output_columns:
+        if col not in df_transformed.columns:
+            df_transformed[col] = None
+    
+    diagnostics.summary("Final Upstox transformed DataFrame shape: %s", df_transformed.shape)
+    if not df_transformed.empty:
+        diagnostics.debug("Sample Upstox transformed data:\n%s", lazy(lambda: df_transformed.head(5)))
+    return df_transformed[output_columns]
+
+def transform_dhan_data(df, symbol_memo=None, mask=dhan_equity_mask):
+    """Filter and transform Dhan data for NSE Equity instruments.
+
+    Pass another `mask` (df -> boolean Series) to keep a different exchange
+    segment; see exchanges.PARTITIONS.
+    """
+    diagnostics.summary("Transforming Dhan data for NSE Equity...")
+    diagnostics.summary("Raw Dhan DataFrame shape: %s", df.shape)
+    diagnostics.debug("Dhan columns: %s", lazy(df.columns.tolist))
+    
+    # Filter for NSE Equity
+    df_filtered = df[mask(df)]
+    diagnostics.summary("Filtered Dhan DataFrame shape: %s", df_filtered.shape)
+    
+    if df_filtered.empty:
+        diagnostics.warning("Warning: No NSE Equity instruments found in Dhan data.")
+    
+    # Select and rename columns
+    df_transformed = df_filtered[[
+        'SEM_EXM_EXCH_ID', 'SM_SYMBOL_NAME', 'SEM_SMST_SECURITY_ID', 'SEM_TRADING_SYMBOL'
+    ]].copy()
+    
+    # Normalize trading_symbol
+    if 'SEM_TRADING_SYMBOL' in df_transformed.columns:
+        df_transformed['SEM_TRADING_SYMBOL'] = normalize_trading_symbols(
+            df_transformed['SEM_TRADING_SYMBOL'], symbol_memo, label='Dhan trading_symbol')
+    
+    # Add missing columns
+    df_transformed['instrument_key'] = None
+    df_transformed['short_name'] = None
+    df_transformed['name'] = None
+    # The detailed Dhan master carries ISINs; the compact one does not
+    df_transformed['isin'] = df_filtered['ISIN'] if 'ISIN' in df_filtered.columns else None
+    
+    # Rename columns
+    df_transformed = df_transformed.rename(columns=DHAN_SCHEMA['rename'])
+    
+    # Int64 as in the read schema, also for frames of strings; ids that are not numbers become missing
+    df_transformed['security_id'] = pd.to_numeric(df_transformed['security_id'], errors='coerce').astype('Int64')
+    
+    # Validate trading_symbol
+    if 'trading_symbol' in df_transformed.columns:
+        df_transformed = drop_invalid_symbols(df_transformed, 'Dhan')
+    
+    # Reorder columns
+    output_columns = ['exchange', 'instrument_key', 'symbol_name', 'security_id', 
+                      'short_name', 'name', 'isin', 'trading_symbol']
+    diagnostics.summary("Final Dhan transformed DataFrame shape: %s", df_transformed.shape)
+    if not df_transformed.empty:
+        diagnostics.debug("Sample Dhan transformed data:\n%s", lazy(lambda: df_transformed.head(5)))
     return df_transformed[output_columns]
\ No newline at end of file
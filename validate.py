@@ -0,0 +1,235 @@
+import json
+import os
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from decouple import config
+
+import diagnostics
+from schemas import STRING_DTYPE
+
+VALIDATION_REPORT_PATH = os.path.join('output', 'validation_report.json')
+# Share of a frame's rows a rule may fail before the frame fails validation;
+# a rule's own max_failure_rate takes precedence
+MAX_FAILURE_RATE = config('VALIDATION_MAX_FAILURE_RATE', default=0.01, cast=float)
+# Failing rows kept per rule in the report
+SAMPLE_SIZE = 5
+ISIN_PATTERN = r'[A-Z]{2}[A-Z0-9]{9}[0-9]'
+
+# A rule checks one column of a frame with one of CHECKS; `arg` parameterizes
+# the check. Apart from not_null, checks only look at non-null values.
+Rule = namedtuple('Rule', ['name', 'column', 'check', 'arg', 'max_failure_rate'], defaults=[None, None])
+
+class ValidationError(Exception):
+    """A frame failed validation; `report` is the validation report."""
+
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+# Each check takes a column, its non-null mask, the rule's arg and the
+# frame, and returns a boolean array marking the failing rows.
+
+def _not_null(values, present, arg, df):
+    return ~present
+
+def _unique(values, present, arg, df):
+    return present & values.duplicated().to_numpy()
+
+def _pattern(values, present, arg, df):
+    return present & ~values.str.fullmatch(arg, na=True).to_numpy(dtype=bool)
+
+def _integer(values, present, arg, df):
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return np.zeros(len(values), dtype=bool)
+    numbers = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    with np.errstate(invalid='ignore'):
+        return present & ~(np.isfinite(numbers) & (numbers == np.floor(numbers)))
+
+def _exchange_prefix(values, present, arg, df):
+    """Fail values that do not start with '<exchange>|', the exchange being column `arg` of the row."""
+    exchanges = df[arg].astype('category')
+    codes = exchanges.cat.codes.to_numpy()
+    failed = present & (codes < 0)
+    # One prefix test over the column per exchange, of which a frame has a handful
+    for code, exchange in enumerate(exchanges.cat.categories):
+        prefixed = values.str.startswith(f"{exchange}|").to_numpy(dtype=bool, na_value=True)
+        failed |= present & (codes == code) & ~prefixed
+    return failed
+
+def _luhn_tables():
+    """Return (char value by code point, Luhn contribution by (char value, doubled)).
+
+    Digits are worth 0-9 and letters 10-35 (A-Z); any other code point
+    below 128 is 255. A letter contributes its two digits, the ones digit
+    doubled or not as the character is, and the tens digit the other way.
+    """
+    char_values = np.full(128, 255, dtype=np.uint8)
+    char_values[ord('0'):ord('9') + 1] = np.arange(10)
+    char_values[ord('A'):ord('Z') + 1] = np.arange(10, 36)
+    luhn = np.array([[digit, digit * 2 - 9 if digit > 4 else digit * 2] for digit in range(10)], dtype=np.uint8)
+    contributions = np.array([[luhn[value, doubled] if value < 10
+                               else luhn[value % 10, doubled] + luhn[value // 10, 1 - doubled]
+                               for doubled in (0, 1)] for value in range(36)], dtype=np.uint8)
+    return char_values, contributions
+
+CHAR_VALUES, LUHN_CONTRIBUTIONS = _luhn_tables()
+
+def isin_check_digits(values):
+    """Return boolean arrays (well_formed, valid) for a sequence of strings.
+
+    well_formed marks 12-character ISIN-shaped values; valid marks those
+    whose last digit is the check digit of the first eleven characters: a
+    Luhn check over the characters with letters expanded to two digits
+    (A=10 ... Z=35). Every step is a table lookup or a row-wise sum over a
+    (values x 12) array, so there is no per-value Python work.
+    """
+    # UCS-4 fixed width: a 13th non-zero code point means the value is too long
+    codes = np.asarray(values, dtype='U13').view(np.uint32).reshape(-1, 13)
+    numbers = CHAR_VALUES[np.minimum(codes[:, :12], 127)]
+    well_formed = ((codes[:, 12] == 0) & (numbers[:, :2] >= 10).all(axis=1) & (numbers[:, :2] < 36).all(axis=1)
+                   & (numbers[:, 2:11] < 36).all(axis=1) & (numbers[:, 11] < 10))
+    payload = np.where(well_formed[:, None], numbers[:, :11], 0)
+    # A character is doubled when an even number of digits follow it in the
+    # payload; letters are two digits, everything else one
+    widths = 1 + (payload >= 10)
+    following = np.cumsum(widths[:, ::-1], axis=1)[:, ::-1] - widths
+    total = LUHN_CONTRIBUTIONS[payload, 1 - following % 2].sum(axis=1, dtype=np.int64)
+    valid = well_formed & ((10 - total % 10) % 10 == numbers[:, 11])
+    return well_formed, valid
+
+def _isin_check_digit(values, present, arg, df):
+    # Malformed values are the pattern rule's to report
+    failed = np.zeros(len(values), dtype=bool)
+    well_formed, valid = isin_check_digits(values[present].to_numpy(dtype=object))
+    failed[present] = well_formed & ~valid
+    return failed
+
+# Check name -> check function; see Rule
+CHECKS = {
+    'not_null': _not_null,
+    'unique': _unique,
+    'pattern': _pattern,
+    'integer': _integer,
+    'exchange_prefix': _exchange_prefix,
+    'isin_check_digit': _isin_check_digit,
+}
+
+_COMMON_RULES = [
+    Rule('trading_symbol_not_null', 'trading_symbol', 'not_null', max_failure_rate=0),
+    Rule('trading_symbol_unique', 'trading_symbol', 'unique', max_failure_rate=0),
+    Rule('isin_format', 'isin', 'pattern', ISIN_PATTERN),
+    Rule('isin_check_digit', 'isin', 'isin_check_digit'),
+]
+# Source -> rules its transformed frame is validated against
+RULES = {
+    'upstox': _COMMON_RULES + [
+        Rule('instrument_key_not_null', 'instrument_key', 'not_null', max_failure_rate=0),
+        Rule('instrument_key_exchange_prefix', 'instrument_key', 'exchange_prefix', 'exchange'),
+    ],
+    'dhan': _COMMON_RULES + [
+        Rule('security_id_not_null', 'security_id', 'not_null', max_failure_rate=0),
+        Rule('security_id_integer', 'security_id', 'integer'),
+    ],
+}
+
+def compile_rules(rules):
+    """Group rules by column and look up their checks.
+
+    Returns {column: [(rule, check)]}, so a frame is validated by reading
+    each of its checked columns once and running every check of the column
+    on it. Raises ValueError for an unknown check.
+    """
+    compiled = {}
+    for rule in rules:
+        if rule.check not in CHECKS:
+            raise ValueError(f"Unknown check {rule.check!r} in rule {rule.name}. Choose from {list(CHECKS)}.")
+        compiled.setdefault(rule.column, []).append((rule, CHECKS[rule.check]))
+    return compiled
+
+def _samples(values, failed, sample_size):
+    positions = np.flatnonzero(failed)[:sample_size]
+    sampled = values.iloc[positions].astype(object)
+    return [{'row': int(position), 'value': None if pd.isna(value) else value}
+            for position, value in zip(positions, sampled)]
+
+def validate_frame(df, source, rules=None, max_failure_rate=MAX_FAILURE_RATE, sample_size=SAMPLE_SIZE):
+    """Validate a transformed frame against `rules` (default: RULES[source]).
+
+    Each checked column is read once and every check is vectorized over
+    the whole column, so the cost is a few column scans per rule. Returns the frame's
+    report: per rule the failed row count, failure rate and up to
+    `sample_size` failing rows, and whether the rule and the frame passed.
+    A missing column fails all of its rules.
+    """
+    started = time.perf_counter()
+    compiled = compile_rules(RULES[source] if rules is None else rules)
+    rows = len(df)
+    results = []
+    for column, checks in compiled.items():
+        missing = column not in df
+        if not missing:
+            values = df[column]
+            # Arrow-backed strings make the string checks run in Arrow kernels
+            if values.dtype == object:
+                values = values.astype(STRING_DTYPE)
+            present = values.notna().to_numpy()
+        for rule, check in checks:
+            failed = np.ones(rows, dtype=bool) if missing else check(values, present, rule.arg, df)
+            count = int(failed.sum())
+            rate = count / rows if rows else 0.0
+            limit = max_failure_rate if rule.max_failure_rate is None else rule.max_failure_rate
+            results.append({
+                'rule': rule.name,
+                'column': column,
+                'check': rule.check,
+                'failed': count,
+                'failure_rate': rate,
+                'max_failure_rate': limit,
+                'passed': rate <= limit,
+                'samples': [] if missing else _samples(values, failed, sample_size),
+            })
+    return {
+        'source': source,
+        'rows': rows,
+        'passed': all(result['passed'] for result in results),
+        'seconds': time.perf_counter() - started,
+        'rules': results,
+    }
+
+def validate_frames(frames, path=VALIDATION_REPORT_PATH, raise_on_failure=True, rules=None, **kwargs):
+    """Validate {source: transformed frame} and write the JSON report to `path`.
+
+    `rules` maps each source to its rules (default: RULES). Failing rules
+    are logged as diagnostics warnings. Raises ValidationError when a frame
+    failed and raise_on_failure is set, so a bad source is stopped before
+    it is loaded; the report is written either way. Returns the report.
+    """
+    report = {
+        'validated_at': datetime.now().isoformat(timespec='seconds'),
+        'frames': [validate_frame(df, source, None if rules is None else rules[source], **kwargs)
+                   for source, df in frames.items()],
+    }
+    report['passed'] = all(frame['passed'] for frame in report['frames'])
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    os.replace(path + '.tmp', path)
+
+    for frame in report['frames']:
+        diagnostics.summary("Validated %d %s rows against %d rules in %.1f ms: %s.", frame['rows'], frame['source'],
+                            len(frame['rules']), frame['seconds'] * 1000, 'passed' if frame['passed'] else 'FAILED')
+        for result in frame['rules']:
+            if result['failed']:
+                diagnostics.warning("Warning: %d %s rows (%.2f%%, limit %.2f%%) fail %s, e.g. %s", result['failed'],
+                                    frame['source'], result['failure_rate'] * 100, result['max_failure_rate'] * 100,
+                                    result['rule'], [sample['value'] for sample in result['samples']])
+    if raise_on_failure and not report['passed']:
+        failed = [f"{frame['source']}: {result['rule']}" for frame in report['frames']
+                  for result in frame['rules'] if not result['passed']]
+        raise ValidationError(f"Validation failed ({', '.join(failed)}); see {path}.", report)
+    return report